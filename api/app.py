@@ -22,8 +22,6 @@ the OpenCV USB camera path (the camera is CSI), the DHT22/DHT11 fallback (the
 sensor is an SHT31), and the mock environment generator.
 """
 
-import glob
-import json
 import os
 import re
 import sys
@@ -51,7 +49,7 @@ for _system_path in (
 
 from flask import Flask, Response, jsonify, request, send_file
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 
 try:
     import config
@@ -64,9 +62,15 @@ sys.path.insert(0, os.path.join(
 
 from adc import ElectrodeMonitor
 from bus import SwitchGate
-from camera import Timelapse, open_camera
+from camera import FrameBroadcaster, Timelapse, open_camera
+from catalogue import ImageCatalogue
+from derivatives import DerivativeWorker
+from events import EventBus, Fanout
+from readings_range import parse_time, stream_json
+from export import ExportQueue
 from sensor import EnvironmentMonitor
 from store import electrode_log, environment_log
+from turnlog import TurnTail
 
 app = Flask(__name__)
 
@@ -91,10 +95,20 @@ for directory in (config.IMAGE_DIR, config.LOG_DIR, config.CSV_DIR):
 # own module's switching.
 gate = SwitchGate(getattr(config, 'ADC_SWITCH_SETTLE', 0.25))
 
+# What the dashboard's socket is fed from. The monitors publish each reading
+# as they take it and matrixd's state events publish the light on every
+# switch; the fan-out pushes whatever changed to whoever subscribed to it.
+events = EventBus()
+
 # Both monitors write every sample to a daily CSV under data/readings. The
 # rolling buffers are for the API; these files are the record of the run.
-electrodes = ElectrodeMonitor(config, gate=gate, log=electrode_log(config))
-environment = EnvironmentMonitor(config, gate=gate, log=environment_log(config))
+electrodes = ElectrodeMonitor(config, gate=gate, log=electrode_log(config),
+                              bus=events)
+# A second handle on the same files, for reading only: /api/readings/range
+# must not contend with the sampling thread for the writer's lock.
+electrode_history = electrode_log(config)
+environment = EnvironmentMonitor(config, gate=gate, log=environment_log(config),
+                                 bus=events)
 
 
 def open_matrix():
@@ -113,7 +127,7 @@ def open_matrix():
     try:
         from matrix_client import open_matrix as _open
 
-        matrix, error = _open(allow_direct=False)
+        matrix, error = _open(allow_direct=False, persistent=True)
         if matrix is None:
             print(f"· matrix unavailable ({error}); captures will have no backlight")
             return None
@@ -139,37 +153,36 @@ def register_admin():
         print(f"· admin controls unavailable ({exc})")
 
 
+# Thumbnail and medium renditions of each capture, rendered in worker
+# processes. Started first, so the workers are forked before the matrix
+# client, the camera or any thread exists; see gpio/derivatives.py.
+derivatives = DerivativeWorker(
+    config.IMAGE_DIR,
+    getattr(config, 'IMAGE_DERIVATIVES', None),
+    workers=getattr(config, 'IMAGE_DERIVATIVE_WORKERS', 1),
+    quality=getattr(config, 'IMAGE_DERIVATIVE_QUALITY', 80)).start()
+
 register_admin()
 
 matrix = open_matrix()
-camera = open_camera(config, matrix=matrix)
+# Every capture on disk, built once here and kept current by the camera; see
+# gpio/catalogue.py.
+images = ImageCatalogue(config.IMAGE_DIR)
+camera = open_camera(config, matrix=matrix, catalogue=images,
+                     derivatives=derivatives)
+# The live preview: one capture thread shared by every viewer of /api/stream.
+stream = (FrameBroadcaster(camera, getattr(config, 'STREAM_FPS', 2))
+          if camera is not None else None)
+# Timelapse video and contact-sheet exports, one at a time in the background;
+# unfinished ones from before a restart are resumed. See gpio/export.py.
+exports = ExportQueue(getattr(config, 'EXPORT_DIR',
+                              os.path.join(config.DATA_DIR, 'exports')),
+                      images, derivatives)
 timelapse = None
 
 _stimulus_timer = None
 _stimulus_lock = threading.Lock()
 
-# Capture filenames are slime_YYYYMMDD_HHMMSS.jpg, or slime_YYYYMMDD_HHMMSS_mmm.jpg
-# for captures written with millisecond precision.
-IMAGE_FILENAME_RE = re.compile(r'^slime_(\d{8})_(\d{6})(?:_(\d{1,3}))?\.jpg$')
-
-
-def parse_image_filename(filename):
-    """Extract the capture time from an image filename, or None if it doesn't match"""
-    match = IMAGE_FILENAME_RE.match(filename)
-    if not match:
-        return None
-
-    date_part, time_part, ms_part = match.groups()
-    try:
-        captured_at = datetime.strptime(f"{date_part}_{time_part}", "%Y%m%d_%H%M%S")
-    except ValueError:
-        return None
-
-    if ms_part:
-        captured_at = captured_at.replace(microsecond=int(ms_part.ljust(3, '0')) * 1000)
-    return captured_at
-
-
 # --- readings ---------------------------------------------------------------
 
 @app.route('/')
@@ -190,6 +203,53 @@ def get_readings_history():
     return jsonify(electrodes.history(limit))
 
 
+@app.route('/api/readings/range', methods=['GET'])
+def get_readings_range():
+    """Electrode history from the daily files, reduced to at most max_points.
+
+    Query: start, end (unix seconds or ISO; default the last 24 hours),
+    channels (comma-separated; default ADC_CHANNELS), max_points, mode
+    (default the current run's). Rows are min/max/mean per time bucket; see
+    gpio/readings_range.py. Streamed, so a long range neither waits for the
+    last day nor builds the response in memory.
+    """
+    try:
+        end = parse_time(request.args.get('end', time.time()))
+        start = parse_time(request.args.get('start', end - 86400))
+        channels = request.args.get('channels')
+        configured = tuple(getattr(config, 'ADC_CHANNELS', (0, 1, 2)))
+        channels = (tuple(int(c) for c in channels.split(',') if c.strip())
+                    if channels else configured)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+    unknown = set(channels) - set(configured)
+    if unknown or not channels:
+        return jsonify({"error": f"channels must be among {list(configured)}"}), 400
+    if end <= start:
+        return jsonify({"error": "end must be after start"}), 400
+    max_days = getattr(config, 'READINGS_RANGE_MAX_DAYS', 90)
+    if end - start > max_days * 86400:
+        return jsonify({"error": f"range longer than {max_days} days"}), 400
+    limit = getattr(config, 'READINGS_RANGE_MAX_POINTS', 5000)
+    max_points = min(max(request.args.get('max_points', 1000, type=int), 1), limit)
+
+    import run as run_state
+
+    mode = request.args.get('mode')
+    if mode is None:
+        try:
+            mode = run_state.current(config).get('mode', 'test')
+        except Exception:
+            mode = 'test'
+    elif mode not in run_state.MODES:
+        # Also what keeps the mode, which names a directory, from naming any
+        # other directory.
+        return jsonify({"error": f"mode must be one of {list(run_state.MODES)}"}), 400
+    return Response(stream_json(electrode_history, start, end, channels,
+                                max_points, mode=mode),
+                    mimetype='application/json')
+
+
 @app.route('/api/environment', methods=['GET'])
 def get_environment():
     """Latest chamber temperature and humidity"""
@@ -242,6 +302,9 @@ def get_status():
         "environment": env if env["available"] else None,
         "camera_model": camera.model if camera is not None else None,
         "timelapse": timelapse.status() if timelapse is not None else None,
+        "derivatives": derivatives.status(),
+        "stream": stream.status() if stream is not None else None,
+        "sockets": fanout.status(),
     })
 
 
@@ -275,35 +338,35 @@ def list_images():
         if order not in ('asc', 'desc'):
             return jsonify({"error": "order must be 'asc' or 'desc'"}), 400
 
-        entries = []
-        with os.scandir(config.IMAGE_DIR) as scan:
-            for entry in scan:
-                if not entry.is_file():
-                    continue
-                captured_at = parse_image_filename(entry.name)
-                if captured_at is None:
-                    continue
-                if date_filter and captured_at.strftime('%Y%m%d') != date_filter:
-                    continue
-                entries.append((entry.name, captured_at, entry.stat().st_size))
-
-        # Filenames lead with the timestamp, so sorting by name sorts chronologically
-        entries.sort(key=lambda entry: entry[0], reverse=(order == 'desc'))
-
-        total = len(entries)
-        start = (page - 1) * per_page
-        page_entries = entries[start:start + per_page]
-
-        return jsonify({
+        # The listing only changes when a capture lands, so a client that
+        # sends back the tag it was given skips the page until one does.
+        # no-cache rather than max-age: a browser keeps the page and asks
+        # with If-None-Match every time, which is exactly that.
+        images.reconcile()
+        etag = f"{images.etag}-{order}-{date_filter or ''}-{page}-{per_page}"
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+
+        page_entries, total = images.page(page, per_page, date=date_filter,
+                                          descending=(order == 'desc'))
+
+        response = jsonify({
             "images": [
                 {
                     "filename": name,
                     "url": f"/api/images/{name}",
                     "datetime": captured_at.isoformat(),
                     "timestamp": captured_at.timestamp(),
-                    "size": size
+                    "size": size,
+                    "width": width,
+                    "height": height,
+                    "sizes": {size: f"/api/images/{name}?size={size}"
+                              for size in derivatives.sizes},
                 }
-                for name, captured_at, size in page_entries
+                for name, captured_at, size, width, height in page_entries
             ],
             "page": page,
             "per_page": per_page,
@@ -312,9 +375,9 @@ def list_images():
             "order": order,
             "date": date_filter
         })
-    except FileNotFoundError:
-        print(f"Image directory not found: {config.IMAGE_DIR}")
-        return jsonify({"error": "Image directory not found"}), 500
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         print(f"Error listing images: {e}")
         return jsonify({"error": str(e)}), 500
@@ -322,7 +385,18 @@ def list_images():
 
 @app.route('/api/images/<filename>', methods=['GET'])
 def get_image(filename):
-    """Serve one captured image"""
+    """Serve one captured image, or with ?size= a reduced copy of it.
+
+    size is one of IMAGE_DERIVATIVES (thumb and medium by default), or full
+    for the original. A rendition not yet made is rendered on this request,
+    waiting up to a few seconds; failing that the original is sent, marked
+    no-cache so the browser asks again rather than keeping it under the
+    derivative's URL.
+    """
+    size = request.args.get('size', 'full')
+    if size != 'full' and size not in derivatives.sizes:
+        return jsonify({"error": f"size must be one of full, "
+                                 f"{', '.join(derivatives.sizes)}"}), 400
     # Only jpgs out of IMAGE_DIR, and no path separators, so a crafted
     # filename cannot walk out of the directory.
     if not filename.endswith('.jpg'):
@@ -330,12 +404,24 @@ def get_image(filename):
     if '/' in filename or '..' in filename:
         return jsonify({"error": "Invalid filename"}), 400
 
-    filepath = os.path.join(config.IMAGE_DIR, filename)
+    # Through the catalogue, which knows which day directory a capture was
+    # filed in, so the URL is the same under either IMAGE_LAYOUT and across a
+    # migration. Anything it does not list is looked for at the top, as before.
+    filepath = images.resolve(filename) or os.path.join(config.IMAGE_DIR, filename)
     if not os.path.exists(filepath):
         return jsonify({"error": "Image not found"}), 404
 
+    if size != 'full':
+        derived = derivatives.get(filepath, size, timeout=5.0)
+        if derived is None:
+            response = send_file(filepath, mimetype='image/jpeg')
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        filepath = derived
+
     # Cached hard, because these never change: the filename carries the capture
-    # timestamp and the bytes behind it are written once.
+    # timestamp and the bytes behind it are written once. A derivative is
+    # rendered once from those bytes, so the same holds for it.
     #
     # They used to be served `no-store`, which forbids the browser from keeping
     # the response at all. Scrubbing survived that -- one frame at a time, each
@@ -376,20 +462,77 @@ def capture_image():
     })
 
 
-def generate_stream():
-    """MJPEG frames from the CSI camera, at a deliberately modest rate."""
-    fps = getattr(config, 'STREAM_FPS', 2)
-    interval = 1.0 / max(fps, 0.1)
-    while camera is not None and camera.available:
-        started = time.monotonic()
-        try:
-            frame = camera.stream_frame()
-        except Exception as exc:
-            print(f"stream frame failed: {exc}")
-            return
-        yield (b'--frame\r\n'
-               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+# --- exports ----------------------------------------------------------------
+
+def _is_admin():
+    try:
+        import admin as admin_module
+
+        return admin_module.is_authenticated()
+    except Exception:
+        return False
+
+
+@app.route('/api/exports', methods=['GET'])
+def list_exports():
+    """Every export job with its progress, newest first."""
+    return jsonify({"exports": exports.status()})
+
+
+@app.route('/api/exports', methods=['POST'])
+def create_export():
+    """Queue a timelapse export. Admin only: it is minutes of CPU and disk.
+
+    JSON body: start and end as YYYYMMDD or YYYYMMDD_HHMMSS (inclusive), and
+    optionally fps, step (every Nth capture), size (a derivative name or
+    full) and sheet_tiles (0 for no contact sheet).
+    """
+    if not _is_admin():
+        return jsonify({"error": "not authenticated"}), 401
+    body = request.get_json(silent=True) or {}
+    try:
+        job = exports.submit(
+            body.get('start'), body.get('end'),
+            fps=body.get('fps', 12), step=body.get('step', 1),
+            size=body.get('size', 'medium'),
+            sheet_tiles=body.get('sheet_tiles', 144))
+    except (TypeError, ValueError) as exc:
+        return jsonify({"error": str(exc)}), 400
+    return jsonify(job), 202
+
+
+@app.route('/api/exports/<job_id>', methods=['GET'])
+def get_export(job_id):
+    job = exports.status(job_id)
+    if job is None:
+        return jsonify({"error": "no such export"}), 404
+    return jsonify(job)
+
+
+@app.route('/api/exports/<job_id>/cancel', methods=['POST'])
+def cancel_export(job_id):
+    if not _is_admin():
+        return jsonify({"error": "not authenticated"}), 401
+    if not exports.cancel(job_id):
+        return jsonify({"error": "no such export"}), 404
+    return jsonify(exports.status(job_id))
+
+
+@app.route('/api/exports/<job_id>/<name>', methods=['GET'])
+def get_export_file(job_id, name):
+    """A finished export's video or contact sheet."""
+    path = exports.path(job_id, name)
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": "not found, or not finished"}), 404
+    mimetype = 'video/x-msvideo' if name.endswith('.avi') else 'image/jpeg'
+    return send_file(path, mimetype=mimetype, as_attachment=name.endswith('.avi'),
+                     download_name=f"sllm-{job_id}-{name}")
+
+
+# The turn log as of a second ago, held by line position so a poll reads only
+# the turns it returns. See gpio/turnlog.py.
+turn_tail = TurnTail(config.LOG_DIR,
+                     interval=getattr(config, 'TURN_TAIL_INTERVAL', 1.0))
 
 
 @app.route('/api/turns', methods=['GET'])
@@ -409,7 +552,7 @@ def get_turns():
     presence has always been able to see that.
     """
     try:
-        limit = min(int(request.args.get('limit', 200)), 1000)
+        limit = max(1, min(int(request.args.get('limit', 200)), 1000))
     except ValueError:
         limit = 200
     after = request.args.get('after', '')
@@ -422,30 +565,8 @@ def get_turns():
     except Exception:
         privileged = False
 
-    paths = sorted(glob.glob(os.path.join(config.LOG_DIR, 'turns_*.jsonl')))
-    # Newest files last; read backwards only far enough to satisfy the limit.
-    lines = []
-    for path in reversed(paths):
-        try:
-            with open(path) as handle:
-                lines = handle.readlines() + lines
-        except OSError:
-            continue
-        if len(lines) >= limit and not after:
-            break
-
     turns = []
-    for line in lines:
-        line = line.strip()
-        if not line:
-            continue
-        try:
-            record = json.loads(line)
-        except ValueError:
-            continue
-        if after and record.get('datetime', '') <= after:
-            continue
-
+    for record in turn_tail.turns(limit, after):
         reply = record.get('reply') or {}
         turn = {
             'turn': record.get('turn'),
@@ -464,7 +585,7 @@ def get_turns():
         turns.append(turn)
 
     return jsonify({
-        'turns': turns[-limit:],
+        'turns': turns,
         'privileged': privileged,
         'loop_running': _loop_running(),
     })
@@ -485,14 +606,56 @@ def video_stream():
     """Live preview. A framing aid, not the science data."""
     if camera is None or not camera.available:
         return jsonify({"error": "No camera attached"}), 503
-    return Response(generate_stream(),
+    return Response(stream.frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 
 # --- stimulus ---------------------------------------------------------------
 
+def _light_changed(state):
+    """Publish each panel state matrixd reports, whoever switched it.
+
+    The daemon pushes every change to this process's session -- its own
+    switches, llm/loop.py's, a flash, the watchdog -- timed at the switch, so
+    this is the whole of the API's knowledge of the light. Called on the
+    session's reader thread: it must not call the matrix.
+    """
+    previous = events.latest('status')
+    if state is None:
+        payload = {"exposure_light": False, "zone": None, "zones": {},
+                   "flashing": False, "timestamp": time.time()}
+    else:
+        zones = {int(z): level for z, level in state["zones"].items()}
+        payload = {
+            "exposure_light": state["active"],
+            # The dashboard shows one zone; the lowest lit, all in `zones`.
+            "zone": min(zones) if zones else None,
+            "zones": state["zones"],
+            "flashing": state["flashing"],
+            "cause": state["cause"],
+            "version": state["version"],
+            "timestamp": state["changed"],
+        }
+    events.publish('status', payload)
+    if previous is None or (previous["exposure_light"], previous["zone"]) != (
+            payload["exposure_light"], payload["zone"]):
+        socketio.emit('light_changed', {
+            "exposure_light": payload["exposure_light"],
+            "zone": payload["zone"],
+            "timestamp": payload["timestamp"],
+        })
+
+
+if matrix is not None:
+    matrix.on_change(_light_changed)
+else:
+    _light_changed(None)
+
+
 def _stimulus_active():
-    return matrix is not None and matrix.stimulus_active()
+    """Whether a stimulus zone is lit, from the last state matrixd pushed."""
+    state = events.latest('status')
+    return bool(state and state["exposure_light"])
 
 
 def _clear_stimulus():
@@ -502,10 +665,6 @@ def _clear_stimulus():
         if matrix is not None:
             with gate.switching():
                 matrix.clear_stimulus()
-    socketio.emit('light_changed', {
-        "exposure_light": False,
-        "timestamp": time.time()
-    })
 
 
 @app.route('/api/trigger-light', methods=['POST'])
@@ -534,7 +693,10 @@ def trigger_light():
     duration = min(float(duration), max_duration)
 
     if state == 'toggle':
-        state = 'off' if _stimulus_active() else 'on'
+        # From the mirror, which has caught up with every switch matrixd
+        # has reported, not from the published state a socket thread is
+        # still fanning out.
+        state = 'off' if matrix.stimulus_active() else 'on'
 
     try:
         with _stimulus_lock:
@@ -544,8 +706,8 @@ def trigger_light():
 
             with gate.switching():
                 if state == 'on':
-                    matrix.clear_stimulus()
-                    matrix.set_zone(zone, intensity)
+                    # One frame, one edge, whatever was lit before.
+                    matrix.set_frame({zone: intensity})
                 else:
                     matrix.clear_stimulus()
 
@@ -559,11 +721,6 @@ def trigger_light():
         return jsonify({"error": str(exc)}), 400
 
     lit = state == 'on'
-    socketio.emit('light_changed', {
-        "exposure_light": lit,
-        "zone": zone if lit else None,
-        "timestamp": time.time()
-    })
     return jsonify({
         "status": "success",
         "light_state": "on" if lit else "off",
@@ -574,48 +731,49 @@ def trigger_light():
 
 # --- socket.io --------------------------------------------------------------
 
+fanout = Fanout(
+    events,
+    {'reading': 'reading_update',
+     'environment': 'environment_update',
+     'status': 'status_update'},
+    emit=lambda event, payload, room: socketio.emit(event, payload, to=room),
+    join=lambda sid, room: join_room(room, sid=sid, namespace='/'),
+    leave=lambda sid, room: leave_room(room, sid=sid, namespace='/'),
+    default=config.SOCKET_EMIT_INTERVAL,
+    floor=getattr(config, 'SOCKET_MIN_INTERVAL', 0.25),
+)
+
+
 @socketio.on('connect')
 def handle_connect():
     print(f"Client connected: {request.sid}")
-    reading = electrodes.snapshot()
-    if reading["timestamp"] > 0:
-        emit('reading_update', reading)
+    for event, payload in fanout.snapshot():
+        emit(event, payload)
+    # Everything at the default rate until the client says otherwise, which
+    # is what the dashboard has always been sent.
+    fanout.subscribe(request.sid)
 
-    env = environment.snapshot()
-    if env["available"]:
-        emit('environment_update', env)
 
-    emit('status_update', {
-        "exposure_light": _stimulus_active(),
-        "timestamp": time.time()
-    })
+@socketio.on('subscribe')
+def handle_subscribe(data):
+    """{"topics": {"reading": seconds, ...}}: what to receive, and how often.
+
+    Replaces the client's subscription. Topics left out stop arriving;
+    intervals below SOCKET_MIN_INTERVAL are raised to it. Acknowledged with
+    `subscribed` carrying what is in force.
+    """
+    topics = (data or {}).get('topics') if isinstance(data, dict) else None
+    if not isinstance(topics, dict):
+        emit('subscribed', {"error": "expected {\"topics\": {topic: seconds}}",
+                            "topics": sorted(fanout.events)})
+        return
+    emit('subscribed', {"topics": fanout.subscribe(request.sid, topics)})
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print(f"Client disconnected: {request.sid}")
-
-
-def emit_realtime_data():
-    """Push the latest readings to connected clients."""
-    while True:
-        try:
-            reading = electrodes.snapshot()
-            if reading["timestamp"] > 0:
-                socketio.emit('reading_update', reading)
-
-            env = environment.snapshot()
-            if env["available"]:
-                socketio.emit('environment_update', env)
-
-            socketio.emit('status_update', {
-                "exposure_light": _stimulus_active(),
-                "timestamp": time.time()
-            })
-        except Exception as exc:
-            print(f"Error emitting data: {exc}")
-
-        time.sleep(config.SOCKET_EMIT_INTERVAL)
+    fanout.unsubscribe(request.sid)
 
 
 def main():
@@ -629,7 +787,9 @@ def main():
         print(f"✓ timelapse every {config.IMAGE_CAPTURE_INTERVAL}s")
 
     if config.ENABLE_WEBSOCKETS:
-        threading.Thread(target=emit_realtime_data, daemon=True).start()
+        fanout.start()
+
+    exports.start()
 
     try:
         socketio.run(app, host=config.SERVER_HOST, port=config.SERVER_PORT,
@@ -639,6 +799,11 @@ def main():
         environment.stop()
         if timelapse is not None:
             timelapse.stop()
+        if stream is not None:
+            stream.stop()
+        fanout.stop()
+        exports.close()
+        derivatives.close()
         if camera is not None:
             camera.close()
         if matrix is not None:
@@ -650,6 +815,7 @@ def main():
                 matrix.clear_stimulus()
             except Exception as exc:  # noqa: BLE001 -- shutdown must not raise
                 print(f"could not clear stimulus on shutdown: {exc}")
+            matrix.close()  # ends the matrixd session, not the panel
 
 
 if __name__ == '__main__':
@@ -19,6 +19,8 @@ DATA_DIR = os.path.join(PROJECT_ROOT, 'data')
 IMAGE_DIR = os.path.join(DATA_DIR, 'images')
 LOG_DIR = os.path.join(DATA_DIR, 'logs')
 CSV_DIR = os.path.join(DATA_DIR, 'readings')
+# Timelapse videos and contact sheets made from /api/exports, a directory per job
+EXPORT_DIR = os.path.join(DATA_DIR, 'exports')
 
 # --- electrodes, ADS1115 ----------------------------------------------------
 # Three recording electrodes read differentially against the reference in the
@@ -37,6 +39,16 @@ ADC_REFERENCE_CHANNEL = 3
 # CSV in data/readings, not this.
 MAX_READINGS_BUFFER = 2400
 
+# Mirror the electrode columns into a fixed-record binary file beside each daily
+# CSV, so the model's window is a memory-mapped slice rather than a parse of the
+# day's text. The CSV is written either way and stays the record; this only
+# makes reading it fast. Backfill older days with `gpio/store.py backfill`.
+READINGS_BINARY_SIDECAR = True
+# Per-minute, per-10-minute and per-hour min/max/mean/std/count beside each
+# daily CSV, electrodes and environment both, updated as rows are written.
+# /api/readings/range reads these for long ranges instead of raw samples.
+READINGS_ROLLUPS = True
+
 # Settling time after any switching event before the ADC is allowed to convert
 # again. Nothing may convert while the matrix, fan or relay is being energised.
 ADC_SWITCH_SETTLE = 0.25       # seconds
@@ -96,6 +108,20 @@ FAN_RH_OFF = None              # e.g. 91.0
 CAMERA_RESOLUTION = (2304, 1296)
 CAMERA_WARMUP_TIME = 2         # seconds
 IMAGE_CAPTURE_INTERVAL = 300   # seconds
+# 'flat' writes every capture straight into IMAGE_DIR. 'daily' files them as
+# IMAGE_DIR/YYYY/MM/DD/ with a manifest per day, which keeps directories small
+# on the SD card once a timelapse has run for weeks. Image URLs are the same
+# either way. Existing captures move over with
+# `./scripts/py gpio/catalogue.py migrate`.
+IMAGE_LAYOUT = 'flat'
+# Reduced copies of every capture, served as /api/images/<name>?size=thumb.
+# Long edge in pixels by name. Rendered in IMAGE_DERIVATIVE_WORKERS processes
+# at low priority, off the capture path; the archive is filled in with
+# `./scripts/py gpio/derivatives.py backfill`. Needs PIL (apt python3-pil,
+# which picamera2 already pulls in); without it the original is served.
+IMAGE_DERIVATIVES = {'thumb': 320, 'medium': 1280}
+IMAGE_DERIVATIVE_WORKERS = 1
+IMAGE_DERIVATIVE_QUALITY = 80
 
 # Module 3 has an autofocus lens and the dish never moves, so focus is locked
 # rather than left hunting between frames. None sweeps autofocus once at
@@ -112,10 +138,15 @@ DEFAULT_STIMULUS_ZONE = 4
 MAX_STIMULUS_DURATION = 300    # seconds; a manual stimulus always self-cancels
 
 # --- live preview -----------------------------------------------------------
-# Frames per second for /api/stream. Kept low on purpose: the preview exists to
-# frame and focus the camera, and every frame competes with the timelapse for
-# the same capture lock.
-STREAM_FPS = 2
+# Frames per second for /api/stream. The preview exists to frame and focus the
+# camera, and every frame's grab competes with the timelapse for the capture
+# lock. One capture thread serves every viewer, so this is the camera's load
+# however many are watching. Frames come from a small lores stream beside the
+# still one (see gpio/camera.py), cheap enough that the rate can be a usable
+# one; `camera.py bench` shows what it costs here.
+STREAM_FPS = 5
+STREAM_SIZE = (640, 360)       # lores preview, must be smaller than the still
+STREAM_QUALITY = 70            # JPEG quality of preview frames
 TIMELAPSE_ENABLED = True
 
 # --- the model loop ---------------------------------------------------------
@@ -129,10 +160,43 @@ TIMELAPSE_ENABLED = True
 OLLAMA_HOST = 'http://100.127.41.6:11434'
 OLLAMA_MODEL = 'qwen2.5:14b'
 
+# More than one server, if there is more than one. Each turn goes to the least
+# loaded endpoint that passed its last health check (every
+# OLLAMA_HEALTH_INTERVAL seconds) and fails over to the next within the turn's
+# OLLAMA_TIMEOUT. An entry is a host, or {'host': ..., 'model': ...} to serve a
+# different model there. Empty means OLLAMA_HOST alone. The endpoint that
+# answered is recorded in every turn.
+OLLAMA_ENDPOINTS = []
+OLLAMA_HEALTH_INTERVAL = 30
+
+# One pooled, keep-alive connection to the laptop, reused turn to turn. The
+# connect timeout is short on purpose: a sleeping laptop should cost seconds,
+# not the turn. Read is the longest silence allowed while the model generates;
+# OLLAMA_TIMEOUT caps one whole ask(), retries included. Refused connections
+# and 502/503/504 are retried with backoff before a turn is given up.
+OLLAMA_TIMEOUT = 300
+OLLAMA_CONNECT_TIMEOUT = 5.0
+OLLAMA_READ_TIMEOUT = 300
+OLLAMA_POOL_SIZE = 4
+OLLAMA_TRANSPORT_RETRIES = 3
+# Seconds Ollama keeps the model loaded after each turn. Its own default is
+# five minutes, shorter than LLM_TURN_INTERVAL, so the model was unloaded
+# between every pair of turns and the whole prompt re-encoded each time. Held
+# longer, the server reuses its cache of the unchanged history. -1 is forever.
+OLLAMA_KEEP_ALIVE = 3600
+
 LLM_PROMPT = 'blind'           # blind | informed | null, see llm/filters/prompts.md
 LLM_WINDOW_S = 1800            # what the model sees, 30 min ~ 15-30 contractions
 LLM_TURN_INTERVAL = 600        # how often it speaks
 LLM_HISTORY_TURNS = 8          # how far back it remembers
+# When the model has to re-encode the history anyway (it was unloaded, or the
+# oldest half of the history was just dropped), turns older than the last
+# LLM_HISTORY_KEEP_FULL are resent as their changes_since_last_turn only.
+LLM_HISTORY_KEEP_FULL = 2
+# Stream the reply and apply the light action as soon as that field is
+# complete, rather than after the note has finished generating. Each turn
+# records time_to_action_s and time_to_complete_s. --no-stream turns it off.
+LLM_STREAM = True
 
 # Fraction of turns where the action is logged and NOT applied. The model is
 # never told which turn it is in; that is what makes it a control rather than
@@ -143,8 +207,20 @@ LLM_SHAM_RATE = 0.25
 SERVER_HOST = '127.0.0.1'
 SERVER_PORT = 5000
 DEBUG_MODE = False
-SOCKET_EMIT_INTERVAL = 0.5     # seconds between Socket.IO emissions
+# /api/readings/range reads the daily files and returns at most this many
+# rows, however long the range, and refuses ranges longer than this many days.
+READINGS_RANGE_MAX_POINTS = 5000
+READINGS_RANGE_MAX_DAYS = 90
+# Socket.IO pushes a topic (reading, environment, status) only when it has
+# changed, and to each client no more often than the interval it subscribed
+# at. This is the interval for a client that never says; a client can ask for
+# slower, or faster down to SOCKET_MIN_INTERVAL.
+SOCKET_EMIT_INTERVAL = 0.5     # seconds
+SOCKET_MIN_INTERVAL = 0.25     # seconds
 ENABLE_WEBSOCKETS = True
+# How stale /api/turns may be. The API checks the turn log's files for growth
+# at most this often and otherwise answers from what it already holds.
+TURN_TAIL_INTERVAL = 1.0       # seconds
 
 # --- frontend ---------------------------------------------------------------
 CHART_UPDATE_RATE = 500        # milliseconds
@@ -96,12 +96,15 @@ class ElectrodeADC:
 class ElectrodeMonitor:
     """Background thread: sample at the configured rate into a rolling buffer."""
 
-    def __init__(self, config, gate=None, log=None):
+    def __init__(self, config, gate=None, log=None, bus=None):
         self.interval = 1.0 / getattr(config, 'ADC_SAMPLE_RATE', 1.0)
         self.buffer = deque(maxlen=getattr(config, 'MAX_READINGS_BUFFER', 2400))
         # None disables disk logging; the standalone CLI passes nothing so a
         # bring-up check does not scribble into the run's record.
         self.log = log
+        # An events.EventBus to publish each reading to as 'reading', so the
+        # API pushes it to the dashboard when it changes rather than on a timer.
+        self.bus = bus
         self.latest = {
             "timestamp": 0,
             "datetime": None,
@@ -161,6 +164,9 @@ class ElectrodeMonitor:
             if error is None:
                 self.buffer.append(reading)
 
+        if self.bus is not None:
+            self.bus.publish('reading', reading)
+
         if error is None and self.log is not None:
             row = {"timestamp": reading["timestamp"],
                    "datetime": reading["datetime"]}
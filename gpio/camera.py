@@ -15,8 +15,23 @@ imperceptible to an organism responding over minutes.
 The matrix is optional. With no matrix the capture still works, it just has no
 backlight and no blanking -- useful for focusing and framing.
 
+The live preview does not use the still stream. The camera is configured with
+two outputs from the one ISP pass: `main` at full still resolution, which
+only capture() reads, and a small `lores` YUV420 stream (STREAM_SIZE) that
+stream_frame() takes a frame from and compresses with simplejpeg, which
+picamera2 already depends on. A 640x360 preview frame is a few milliseconds
+of encode where a 2304x1296 still was well over a hundred, and the camera
+lock is held only to grab the frame, not to compress it. Without simplejpeg,
+or if the sensor refuses the lores size, the preview falls back to encoding
+the still stream as before.
+
+The Pi 5 has no hardware JPEG or MJPEG encoder to hand this to -- the V4L2
+one picamera2's MJPEGEncoder uses exists only up to the Pi 4 -- so the cheap
+path is a small frame, not a different encoder.
+
     ./scripts/py gpio/camera.py info        # what camera is attached
     sudo ./scripts/py gpio/camera.py shot   # one capture through the flash sequence
+    ./scripts/py gpio/camera.py bench [N]   # preview cost, lores against still
 """
 
 import io
@@ -27,10 +42,11 @@ import threading
 import time
 import syspath  # noqa: F401  (path setup, must precede hardware imports)
 import leds  # zone geometry and the Matrix type; touches no hardware on import
+from catalogue import append_manifest, image_path
 
 from datetime import datetime
 
-# Capture filenames are what api/app.py parses back into timestamps, so this
+# Capture filenames are what catalogue.py parses back into timestamps, so this
 # format is load-bearing on both sides. Millisecond precision because the
 # timelapse can capture faster than once a second during testing.
 FILENAME_FORMAT = "slime_%Y%m%d_%H%M%S.jpg"
@@ -41,11 +57,27 @@ class CameraUnavailable(Exception):
 
 
 class Camera:
-    """A picamera2 still camera, optionally synchronised with the matrix."""
+    """A picamera2 still camera, optionally synchronised with the matrix.
+
+    `catalogue`, if given, is told about every capture as it lands, which is
+    how the API's image listing sees timelapse frames without rescanning.
+    `derivatives` is handed each capture to render reduced copies of, in its
+    own processes, once the camera lock is released.
+    """
 
-    def __init__(self, config, matrix=None):
+    def __init__(self, config, matrix=None, catalogue=None, derivatives=None):
         self.matrix = matrix
+        self.catalogue = catalogue
+        self.derivatives = derivatives
         self.image_dir = config.IMAGE_DIR
+        # 'flat' or 'daily'; see catalogue.py for what each writes.
+        self.layout = getattr(config, 'IMAGE_LAYOUT', 'flat')
+        self.size = (None, None)
+        # 'lores' or 'still': where stream_frame() gets its pixels.
+        self.preview = 'still'
+        self.preview_size = None
+        self.preview_quality = getattr(config, 'STREAM_QUALITY', 70)
+        self._encode_jpeg = None
         self.warmup = getattr(config, 'CAMERA_WARMUP_TIME', 2)
         self._lock = threading.Lock()
         self._picam = None
@@ -69,24 +101,47 @@ class Camera:
             raise CameraUnavailable(f"could not open camera: {exc}") from exc
 
         resolution = getattr(config, 'CAMERA_RESOLUTION', None)
-        if resolution:
-            still_config = self._picam.create_still_configuration(
-                main={"size": tuple(resolution)}
-            )
-        else:
-            # Largest mode the fitted sensor actually offers, rather than a
-            # size guessed from a module version that may not be what is here.
-            still_config = self._picam.create_still_configuration()
+        # Largest mode the fitted sensor actually offers unless pinned, rather
+        # than a size guessed from a module version that may not be here.
+        main_stream = {"size": tuple(resolution)} if resolution else {}
+        preview_size = getattr(config, 'STREAM_SIZE', (640, 360))
+        try:
+            from simplejpeg import encode_jpeg_yuv_planes
+        except ImportError as exc:
+            print(f"· simplejpeg not installed ({exc}); preview encodes stills")
+            preview_size = None
 
-        self._picam.configure(still_config)
+        configured = False
+        if preview_size:
+            try:
+                self._picam.configure(self._picam.create_still_configuration(
+                    main=main_stream,
+                    lores={"size": tuple(preview_size), "format": "YUV420"},
+                ))
+                self._encode_jpeg = encode_jpeg_yuv_planes
+                self.preview = 'lores'
+                configured = True
+            except Exception as exc:
+                print(f"· lores preview {preview_size} refused ({exc}); "
+                      "preview encodes stills")
+        if not configured:
+            self._picam.configure(self._picam.create_still_configuration(
+                main=main_stream))
         self._picam.start()
         self._set_focus(config)
         # The sensor needs a moment for AE and AWB to settle before the first
         # frame is worth keeping.
         time.sleep(self.warmup)
 
-        size = self._picam.camera_configuration()['main']['size']
-        print(f"✓ camera {self.model} at {size[0]}x{size[1]}")
+        configuration = self._picam.camera_configuration()
+        size = configuration['main']['size']
+        self.size = tuple(size)
+        if self.preview == 'lores':
+            self.preview_size = tuple(configuration['lores']['size'])
+        else:
+            self.preview_size = self.size
+        print(f"✓ camera {self.model} at {size[0]}x{size[1]}, preview "
+              f"{self.preview_size[0]}x{self.preview_size[1]} from {self.preview}")
 
     def _set_focus(self, config):
         """Lock focus if the fitted module has an autofocus lens.
@@ -129,7 +184,8 @@ class Camera:
             raise CameraUnavailable("camera not initialised")
 
         filename = filename or datetime.now().strftime(FILENAME_FORMAT)
-        path = os.path.join(self.image_dir, filename)
+        path = image_path(self.image_dir, filename, self.layout)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
 
         with self._lock:
             if self.matrix is not None:
@@ -139,6 +195,12 @@ class Camera:
             else:
                 self._picam.capture_file(path)
 
+        if self.layout == 'daily':
+            append_manifest(path, *self.size)
+        if self.catalogue is not None:
+            self.catalogue.add(path, *self.size)
+        if self.derivatives is not None:
+            self.derivatives.submit(path)
         return path
 
     def stream_frame(self):
@@ -146,17 +208,43 @@ class Camera:
 
         Shares the capture lock with `capture`, so a preview frame can never
         land in the middle of the blank/flash sequence and a timelapse frame
-        is never delayed behind a half-finished preview frame. Deliberately
-        low rate -- this is a framing and focus aid, not the science data.
+        is never delayed behind a half-finished preview frame. This is a
+        framing and focus aid, not the science data.
         """
         if not self.available:
             raise CameraUnavailable("camera not initialised")
+        if self.preview == 'lores':
+            return self.lores_frame()
+        return self.still_frame()
 
+    def still_frame(self):
+        """A full-resolution JPEG of the still stream, encoded under the lock."""
         buffer = io.BytesIO()
         with self._lock:
             self._picam.capture_file(buffer, format='jpeg')
         return buffer.getvalue()
 
+    def lores_frame(self):
+        """A JPEG of the lores stream. Only the grab is under the lock."""
+        with self._lock:
+            array = self._picam.capture_array('lores')
+        return self._encode_lores(array)
+
+    def _encode_lores(self, array):
+        # YUV420 arrives as one (height * 3/2, stride) array: the Y plane, then
+        # U and V at half size each, a quarter of the rows apiece. Rows may be
+        # padded past the width, so each plane is cropped back to it.
+        width, height = self.preview_size
+        stride = array.shape[1]
+        planes = array.reshape(-1)
+        y = array[:height, :width]
+        u_start = height * stride
+        v_start = u_start + height * stride // 4
+        u = planes[u_start:v_start].reshape(height // 2, stride // 2)[:, :width // 2]
+        v = planes[v_start:v_start + height * stride // 4].reshape(
+            height // 2, stride // 2)[:, :width // 2]
+        return self._encode_jpeg(y, u, v, quality=self.preview_quality)
+
     def close(self):
         if self._picam is not None:
             self._picam.stop()
@@ -207,15 +295,180 @@ class Timelapse:
         }
 
 
-def open_camera(config, matrix=None):
+class FrameBroadcaster:
+    """One preview producer, however many people are watching.
+
+    The MJPEG preview used to run a generator per viewer, each calling
+    stream_frame() at STREAM_FPS. Every one of those is a JPEG encode under
+    the camera lock, so ten viewers asked for ten times the frames, queued
+    the timelapse capture behind all of them, and delayed the flash sequence
+    by however long the queue was.
+
+    Here one thread captures at `fps` into a single latest-frame slot and
+    bumps a generation counter; viewers wait on a condition for the counter
+    to move and send the same bytes. Camera load is one viewer's worth with
+    a hundred watching, and none with nobody watching: the producer sleeps
+    until the first viewer arrives.
+
+    A viewer whose connection cannot keep up skips to the newest frame
+    rather than queueing old ones. The frames it skipped are counted in
+    `dropped`, so a slow link shows in /api/status rather than as lag.
+    """
+
+    BOUNDARY = b'frame'
+
+    def __init__(self, camera, fps=2):
+        self.camera = camera
+        self.fps = fps
+        self.interval = 1.0 / max(fps, 0.1)
+        self.viewers = 0
+        self.produced = 0
+        self.dropped = 0
+        self.last_error = None
+        self._frame = None
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set() and self.camera.available:
+            with self._cond:
+                while self.viewers == 0 and not self._stop.is_set():
+                    self._cond.wait()
+            if self._stop.is_set():
+                break
+            started = time.monotonic()
+            try:
+                frame = self.camera.stream_frame()
+            except Exception as exc:
+                # Transient by assumption -- a capture timing out once -- so
+                # viewers keep waiting rather than being disconnected.
+                self.last_error = str(exc)
+                print(f"stream frame failed: {exc}")
+            else:
+                with self._cond:
+                    self._frame = frame
+                    self._generation += 1
+                    self.produced += 1
+                    self._cond.notify_all()
+            self._stop.wait(max(0.0, self.interval - (time.monotonic() - started)))
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def frames(self):
+        """multipart/x-mixed-replace parts for one viewer, until it disconnects."""
+        with self._cond:
+            self.viewers += 1
+            self._start()
+            self._cond.notify_all()
+            seen = self._generation
+        try:
+            while True:
+                with self._cond:
+                    # Bounded, so a stalled camera still lets a closed
+                    # connection be noticed on the next write.
+                    self._cond.wait_for(
+                        lambda: self._generation != seen or self._stop.is_set(),
+                        timeout=max(5.0, 4 * self.interval))
+                    if self._stop.is_set():
+                        return
+                    if self._generation == seen:
+                        continue
+                    self.dropped += self._generation - seen - 1
+                    seen = self._generation
+                    frame = self._frame
+                yield (b'--' + self.BOUNDARY + b'\r\n'
+                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        finally:
+            with self._cond:
+                self.viewers -= 1
+
+    def stop(self):
+        with self._cond:
+            self._stop.set()
+            self._cond.notify_all()
+
+    def status(self):
+        return {
+            "viewers": self.viewers,
+            "fps": self.fps,
+            "frames": self.produced,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+
+def open_camera(config, matrix=None, catalogue=None, derivatives=None):
     """Camera or None. Never raises -- the API must start without a camera."""
     try:
-        return Camera(config, matrix=matrix)
+        return Camera(config, matrix=matrix, catalogue=catalogue,
+                      derivatives=derivatives)
     except CameraUnavailable as exc:
         print(f"· camera unavailable: {exc}")
         return None
 
 
+def bench(camera, frames=50):
+    """Time both preview paths on the live camera, without the matrix.
+
+    Per frame: wall time, the part of it spent compressing, and process CPU
+    (every thread, picamera2's own included) -- the figure that competes
+    with the sampling loops. The still path compresses inside capture_file,
+    so its encode is the whole wall time less a raw grab of the same stream.
+    """
+    results = {}
+
+    def measure(label, grab, encode):
+        grab()  # first frame after a switch waits for the pipeline
+        wall = enc = 0.0
+        size = 0
+        cpu = time.process_time()
+        for _ in range(frames):
+            started = time.perf_counter()
+            data = grab()
+            grabbed = time.perf_counter()
+            if encode is not None:
+                data = encode(data)
+            done = time.perf_counter()
+            wall += done - started
+            enc += done - grabbed
+            size += len(data)
+        cpu = time.process_time() - cpu
+        results[label] = (wall, enc, cpu, size)
+
+    with camera._lock:
+        raw_main = time.perf_counter()
+        for _ in range(5):
+            camera._picam.capture_array('main')
+        raw_main = (time.perf_counter() - raw_main) / 5
+
+    measure('still', camera.still_frame, None)
+    wall, _, cpu, size = results['still']
+    results['still'] = (wall, max(0.0, wall - raw_main * frames), cpu, size)
+    if camera.preview == 'lores':
+        measure('lores', lambda: camera._picam.capture_array('lores'),
+                camera._encode_lores)
+    else:
+        print("· no lores stream configured; only the still path is measured")
+
+    print(f"{frames} frames per path, still {camera.size[0]}x{camera.size[1]}, "
+          f"preview {camera.preview_size[0]}x{camera.preview_size[1]}\n")
+    print(f"  {'path':<6} {'ms/frame':>9} {'encode ms':>10} {'cpu ms':>8} "
+          f"{'kB':>7} {'max fps':>8}")
+    for label, (wall, enc, cpu, size) in results.items():
+        print(f"  {label:<6} {wall / frames * 1000:9.1f} {enc / frames * 1000:10.1f} "
+              f"{cpu / frames * 1000:8.1f} {size / frames / 1000:7.1f} "
+              f"{frames / wall:8.1f}")
+    return 0
+
+
 def main():
     # Config lives beside this module's parent, so the deployed copy at
     # /var/www/sllm finds its own config rather than the checkout's.
@@ -269,7 +522,17 @@ def main():
                 matrix.off()
         return 0
 
-    print(f"usage: python3 {sys.argv[0]} [info|shot]")
+    if mode == "bench":
+        frames = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+        camera = open_camera(config)
+        if camera is None:
+            return 1
+        try:
+            return bench(camera, frames)
+        finally:
+            camera.close()
+
+    print(f"usage: python3 {sys.argv[0]} [info|shot|bench [frames]]")
     return 1
 
 
@@ -0,0 +1,478 @@
+"""The captured images, as a sorted list held in memory, and how they are filed.
+
+/api/images used to scandir IMAGE_DIR, parse every filename and stat every
+file, then sort the lot -- on every paginated request. A timelapse left
+running for weeks puts tens of thousands of JPEGs in that directory, and the
+dashboard's image browser asks for a page at a time.
+
+The catalogue is built once, when the API starts, and kept in capture order.
+Camera.capture() adds each frame as it is written, so a timelapse frame is
+listed the moment it exists. Anything else that changes the directory --
+frames copied in, old ones deleted by hand -- is caught by checking directory
+mtimes before answering: unchanged, and the list is current; moved, and that
+directory alone is scanned again, statting only the names it has not seen.
+
+Filenames lead with the capture time, so name order is time order and a day
+is a contiguous run of names: a page or a date filter is a bisect and a slice.
+
+`etag` changes whenever the listing does, so a client polling for new frames
+can send If-None-Match and get a 304 for a page that has not moved.
+
+Layout. IMAGE_LAYOUT = 'flat' writes every capture straight into IMAGE_DIR,
+as it always has. 'daily' files them by capture date instead:
+
+    data/images/2026/08/05/slime_20260805_120000.jpg
+    data/images/2026/08/05/manifest.jsonl
+
+A single flat directory of tens of thousands of entries is slow to list and
+slow to look a name up in on an SD card or USB stick; a day's directory holds
+a few hundred. Each day directory carries a manifest, one JSON line per
+capture -- filename, timestamp, size, width, height -- appended as frames are
+written, so a day is loaded without statting or opening any image in it. Like
+the other sidecars it is derived: a capture missing from it is statted
+instead, and `manifests` rebuilds them all from the files.
+
+The filename stays the identity either way. /api/images/<filename> is
+resolved through the catalogue, so every URL handed out before a migration
+still works after it.
+
+    ./scripts/py gpio/catalogue.py migrate     # flat -> daily, then manifests
+    ./scripts/py gpio/catalogue.py manifests   # rebuild every day's manifest
+"""
+
+import bisect
+import json
+import os
+import pathlib
+import re
+import struct
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Capture filenames are slime_YYYYMMDD_HHMMSS.jpg, or slime_YYYYMMDD_HHMMSS_mmm.jpg
+# for captures written with millisecond precision.
+IMAGE_FILENAME_RE = re.compile(r'^slime_(\d{8})_(\d{6})(?:_(\d{1,3}))?\.jpg$')
+
+LAYOUTS = ('flat', 'daily')
+MANIFEST = 'manifest.jsonl'
+# Directory names at each level below IMAGE_DIR in the daily layout.
+DAY_PARTS = (re.compile(r'^\d{4}$'), re.compile(r'^\d{2}$'), re.compile(r'^\d{2}$'))
+
+
+def parse_image_filename(filename):
+    """Extract the capture time from an image filename, or None if it doesn't match"""
+    match = IMAGE_FILENAME_RE.match(filename)
+    if not match:
+        return None
+
+    date_part, time_part, ms_part = match.groups()
+    try:
+        captured_at = datetime.strptime(f"{date_part}_{time_part}", "%Y%m%d_%H%M%S")
+    except ValueError:
+        return None
+
+    if ms_part:
+        captured_at = captured_at.replace(microsecond=int(ms_part.ljust(3, '0')) * 1000)
+    return captured_at
+
+
+def image_path(directory, filename, layout='flat'):
+    """Where a capture of this name is written under `layout`."""
+    if layout == 'daily':
+        captured_at = parse_image_filename(filename)
+        if captured_at is not None:
+            return os.path.join(directory, f"{captured_at:%Y}",
+                                f"{captured_at:%m}", f"{captured_at:%d}",
+                                filename)
+    return os.path.join(directory, filename)
+
+
+def jpeg_size(path):
+    """(width, height) from a JPEG's frame header, or (None, None).
+
+    Walks the marker segments to the first SOFn and reads the size out of
+    it, which is a few hundred bytes into the file past the EXIF block --
+    no image library, and nothing decoded.
+    """
+    try:
+        with open(path, 'rb') as handle:
+            if handle.read(2) != b'\xff\xd8':
+                return None, None
+            while True:
+                marker = handle.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None, None
+                kind = marker[1]
+                if kind == 0xFF:
+                    handle.seek(-1, os.SEEK_CUR)   # fill byte
+                    continue
+                if kind == 0x01 or 0xD0 <= kind <= 0xD8:
+                    continue                       # no length follows
+                length, = struct.unpack('>H', handle.read(2))
+                if 0xC0 <= kind <= 0xCF and kind not in (0xC4, 0xC8, 0xCC):
+                    _, height, width = struct.unpack('>BHH', handle.read(5))
+                    return width, height
+                handle.seek(length - 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None, None
+
+
+def manifest_line(path, width=None, height=None):
+    """The manifest record for one capture on disk."""
+    name = os.path.basename(path)
+    captured_at = parse_image_filename(name)
+    return {
+        "filename": name,
+        "timestamp": captured_at.timestamp() if captured_at else None,
+        "size": os.path.getsize(path),
+        "width": width,
+        "height": height,
+    }
+
+
+def append_manifest(path, width=None, height=None):
+    """Add a capture just written to its directory's manifest.
+
+    Never raises: the manifest only saves a stat, and a capture must not be
+    reported as failed because its bookkeeping was.
+    """
+    try:
+        line = json.dumps(manifest_line(path, width, height))
+        with open(os.path.join(os.path.dirname(path), MANIFEST), 'a',
+                  encoding='utf-8') as handle:
+            handle.write(line + '\n')
+    except OSError as exc:
+        print(f"catalogue: manifest write failed: {exc}", flush=True)
+
+
+def read_manifest(directory):
+    """filename -> manifest record for one day directory; {} if there is none."""
+    out = {}
+    try:
+        with open(os.path.join(directory, MANIFEST), encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                    out[record["filename"]] = record
+                except (KeyError, TypeError, ValueError):
+                    continue
+    except OSError:
+        pass
+    return out
+
+
+class ImageCatalogue:
+    """Every capture under one directory, sorted by name and so by time.
+
+    Follows both layouts at once -- flat files at the top and day
+    directories beneath it -- so a half-finished migration lists everything
+    exactly once.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._names = []
+        # name -> (captured_at, size, path relative to directory, width, height)
+        self._entries = {}
+        # directory -> (mtime, capture names in it, subdirectories)
+        self._dirs = {}
+        # Part of the ETag, so a restarted API never reissues an old tag for
+        # a different listing.
+        self._epoch = f"{time.time_ns():x}"
+        self.version = 0
+        self.scans = 0
+        self.reconcile()
+
+    def add(self, path, width=None, height=None):
+        """Record a capture just written. Names that are not captures are ignored."""
+        name = os.path.basename(path)
+        captured_at = parse_image_filename(name)
+        relative = os.path.relpath(path, self.directory)
+        if captured_at is None or relative.startswith(os.pardir):
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self._lock:
+            if name not in self._entries:
+                bisect.insort(self._names, name)
+            self._entries[name] = (captured_at, size, relative, width, height)
+            known = self._dirs.get(os.path.dirname(path))
+            if known is not None:
+                known[1].add(name)
+            self.version += 1
+
+    def reconcile(self):
+        """Rescan whichever directories have a different mtime than last time.
+
+        One stat per directory in the tree when nothing has changed: the top,
+        and in the daily layout each year, month and day below it.
+        """
+        with self._lock:
+            if self._visit(self.directory, 0):
+                self._names = sorted(self._entries)
+                self.version += 1
+                self.scans += 1
+
+    def _visit(self, path, depth):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        known = self._dirs.get(path)
+        changed = False
+        if known is None or mtime is None or known[0] != mtime:
+            # Our own add() moves the mtime too, so the first request after
+            # each capture rescans that one directory.
+            changed = self._scan(path, depth, mtime)
+            known = self._dirs.get(path)
+        for sub in list(known[2]) if known else ():
+            changed |= self._visit(sub, depth + 1)
+        return changed
+
+    def _scan(self, path, depth, mtime):
+        """Re-read one directory. Returns whether its captures or subdirectories changed."""
+        before = self._dirs.get(path, (None, set(), []))
+        names, subdirs = set(), []
+        manifest = read_manifest(path) if depth == len(DAY_PARTS) else {}
+        try:
+            with os.scandir(path) as scan:
+                for entry in scan:
+                    if depth < len(DAY_PARTS) and DAY_PARTS[depth].match(entry.name):
+                        if entry.is_dir():
+                            subdirs.append(entry.path)
+                        continue
+                    captured_at = parse_image_filename(entry.name)
+                    if captured_at is None:
+                        continue
+                    relative = os.path.relpath(entry.path, self.directory)
+                    known = self._entries.get(entry.name)
+                    record = manifest.get(entry.name)
+                    if known is not None and known[2] == relative:
+                        # A capture is written once and never changes.
+                        pass
+                    elif record is not None:
+                        self._entries[entry.name] = (
+                            captured_at, record.get("size"), relative,
+                            record.get("width"), record.get("height"))
+                    elif entry.is_file():
+                        self._entries[entry.name] = (
+                            captured_at, entry.stat().st_size, relative,
+                            None, None)
+                    else:
+                        continue
+                    names.add(entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            mtime = None
+
+        for gone in before[1] - names:
+            entry = self._entries.get(gone)
+            # Only if it was filed here: a migration moves a name from the
+            # top into a day directory, and the day may be read first.
+            if entry is not None and os.path.join(self.directory, entry[2]) == \
+                    os.path.join(path, gone):
+                del self._entries[gone]
+        for sub in set(before[2]) - set(subdirs):
+            self._forget(sub)
+
+        if mtime is None:
+            self._dirs.pop(path, None)
+        else:
+            self._dirs[path] = (mtime, names, subdirs)
+        return names != before[1] or set(subdirs) != set(before[2])
+
+    def _forget(self, path):
+        """Drop a directory that has disappeared, and everything under it."""
+        known = self._dirs.pop(path, None)
+        if known is None:
+            return
+        for name in known[1]:
+            entry = self._entries.get(name)
+            if entry is not None and os.path.join(self.directory, entry[2]) == \
+                    os.path.join(path, name):
+                del self._entries[name]
+        for sub in known[2]:
+            self._forget(sub)
+
+    @property
+    def etag(self):
+        return f"{self._epoch}-{self.version}"
+
+    def __len__(self):
+        return len(self._names)
+
+    def paths(self):
+        """Every capture's path, oldest first."""
+        self.reconcile()
+        with self._lock:
+            return [os.path.join(self.directory, self._entries[name][2])
+                    for name in self._names]
+
+    def resolve(self, filename):
+        """The path of the capture with this name, or None.
+
+        Reconciles once before giving up, so a frame that reached the disk
+        some other way than add() is still found.
+        """
+        for attempt in range(2):
+            with self._lock:
+                entry = self._entries.get(filename)
+            if entry is not None:
+                return os.path.join(self.directory, entry[2])
+            if attempt == 0:
+                self.reconcile()
+        return None
+
+    def _span(self, date):
+        """(lo, hi) of the names captured on `date` (YYYYMMDD), or of all."""
+        if not date:
+            return 0, len(self._names)
+        return (bisect.bisect_left(self._names, f"slime_{date}_"),
+                bisect.bisect_left(self._names, f"slime_{date}_~"))
+
+    def between(self, start, end):
+        """Names captured from `start` to `end` inclusive, oldest first.
+
+        Bounds are YYYYMMDD for whole days, or YYYYMMDD_HHMMSS.
+        """
+        self.reconcile()
+        with self._lock:
+            return self._names[bisect.bisect_left(self._names, f"slime_{start}"):
+                               bisect.bisect_left(self._names, f"slime_{end}~")]
+
+    def page(self, page, per_page, date=None, descending=True):
+        """(entries, total) for one page.
+
+        Entries are (name, captured_at, size, width, height); width and
+        height are None where no manifest recorded them. Reconciles with the
+        directory first, which is one stat per directory when nothing has
+        changed.
+        """
+        self.reconcile()
+        with self._lock:
+            lo, hi = self._span(date)
+            total = hi - lo
+            start = (page - 1) * per_page
+            if descending:
+                names = self._names[max(lo, hi - start - per_page):max(lo, hi - start)]
+                names.reverse()
+            else:
+                names = self._names[lo + start:min(hi, lo + start + per_page)]
+            out = []
+            for name in names:
+                captured_at, size, _, width, height = self._entries[name]
+                out.append((name, captured_at, size, width, height))
+            return out, total
+
+
+def write_manifest(day):
+    """Rebuild one day directory's manifest from the captures in it.
+
+    Dimensions already recorded are kept for files whose size has not
+    changed; the rest are read from the JPEG headers. Returns the count.
+    """
+    previous = read_manifest(day)
+    lines = []
+    for name in sorted(os.listdir(day)):
+        path = os.path.join(day, name)
+        if parse_image_filename(name) is None or not os.path.isfile(path):
+            continue
+        size = os.path.getsize(path)
+        old = previous.get(name)
+        if old is not None and old.get("size") == size and old.get("width"):
+            lines.append(old)
+            continue
+        lines.append(manifest_line(path, *jpeg_size(path)))
+    target = os.path.join(day, MANIFEST)
+    tmp = target + '.rebuilding'
+    with open(tmp, 'w', encoding='utf-8') as handle:
+        handle.writelines(json.dumps(line) + '\n' for line in lines)
+    os.replace(tmp, target)
+    return len(lines)
+
+
+def day_directories(directory):
+    """Every YYYY/MM/DD directory under `directory`, in date order."""
+    out = []
+
+    def walk(path, depth):
+        if depth == len(DAY_PARTS):
+            out.append(path)
+            return
+        try:
+            names = sorted(os.listdir(path))
+        except OSError:
+            return
+        for name in names:
+            sub = os.path.join(path, name)
+            if DAY_PARTS[depth].match(name) and os.path.isdir(sub):
+                walk(sub, depth + 1)
+
+    walk(directory, 0)
+    return out
+
+
+def migrate(directory, dry_run=False):
+    """Move flat captures into the daily layout, then rebuild every manifest.
+
+    One rename per file, so on the same filesystem nothing is copied and a
+    running API never sees a file half-written; its catalogue follows the
+    moves through the directory mtimes. A name already present in its day
+    directory is left where it is and reported. Safe to run again.
+    Returns (moved, skipped).
+    """
+    moved, skipped = 0, []
+    with os.scandir(directory) as scan:
+        entries = sorted((e for e in scan if e.is_file()), key=lambda e: e.name)
+    for entry in entries:
+        if parse_image_filename(entry.name) is None:
+            continue
+        target = image_path(directory, entry.name, 'daily')
+        if os.path.exists(target):
+            skipped.append(entry.name)
+            continue
+        if not dry_run:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(entry.path, target)
+        moved += 1
+    if not dry_run:
+        for day in day_directories(directory):
+            write_manifest(day)
+    return moved, skipped
+
+
+def main():
+    # Config lives beside this module's parent, so the deployed copy at
+    # /var/www/sllm finds its own config rather than the checkout's.
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'api'))
+    import config
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else ""
+    if mode == "migrate":
+        dry_run = '--dry-run' in sys.argv[2:]
+        moved, skipped = migrate(config.IMAGE_DIR, dry_run=dry_run)
+        print(f"{'would move' if dry_run else 'moved'} {moved} captures "
+              f"into {config.IMAGE_DIR}/YYYY/MM/DD")
+        for name in skipped:
+            print(f"  left {name}: already in its day directory")
+        if getattr(config, 'IMAGE_LAYOUT', 'flat') != 'daily':
+            print("· set IMAGE_LAYOUT = 'daily' in config.py so new captures "
+                  "are filed the same way")
+        return 0
+
+    if mode == "manifests":
+        days = day_directories(config.IMAGE_DIR)
+        total = sum(write_manifest(day) for day in days)
+        print(f"{total} captures in {len(days)} manifests")
+        return 0
+
+    print(f"usage: python3 {sys.argv[0]} migrate [--dry-run] | manifests")
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
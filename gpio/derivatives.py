@@ -0,0 +1,280 @@
+"""Reduced copies of every capture, for the gallery and the timelapse player.
+
+A still is whatever the sensor mode gives -- 2304x1296 by default, the full
+4608x2592 if CAMERA_RESOLUTION is cleared -- and /api/images/<filename> used
+to serve nothing else. The timeline pulls one of those per frame through
+nginx and Tailscale to show it in a box a few hundred pixels wide.
+
+Each capture now gets renditions at fixed long edges, IMAGE_DERIVATIVES:
+
+    data/images/derived/thumb/2026/08/05/slime_20260805_120000.jpg
+    data/images/derived/medium/2026/08/05/slime_20260805_120000.jpg
+
+mirroring wherever the original is filed, so the layout in catalogue.py
+carries over. /api/images/<filename>?size=thumb serves one, and since the
+bytes behind a derivative never change either, it is cached as immutably as
+the original.
+
+Rendering runs in a process pool, never in the capture path: Camera.capture()
+hands the new file over after it has released the camera lock and returns.
+A JPEG decode and resample of a full frame is a few hundred milliseconds of
+CPU on a Pi 5. In a thread that would be GIL time taken from the sampling
+loops; in a worker process at lowered priority it is only ever spare CPU.
+JPEG draft mode decodes straight to the nearest 1/2, 1/4 or 1/8 scale, so
+most of a full-size decode is never done.
+
+The workers are forked once, when the API starts, before the camera, the
+matrix client or any thread exists. Forking later would copy a process whose
+other threads may hold locks; spawning instead would re-import app.py in the
+child, which opens the hardware at import time.
+
+Derivatives are derived data, like every sidecar here. A missing one is
+rendered on the request that wants it, or the original is served until it
+exists.
+
+    ./scripts/py gpio/derivatives.py backfill            # the whole archive
+    ./scripts/py gpio/derivatives.py backfill --size thumb --workers 4
+"""
+
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import pathlib
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DERIVED = 'derived'
+# Long edge in pixels, by the name used in ?size=.
+SIZES = {'thumb': 320, 'medium': 1280}
+QUALITY = 80
+
+
+def derivative_path(image_dir, original, size):
+    """Where the `size` rendition of the capture at `original` is kept."""
+    return os.path.join(image_dir, DERIVED, size,
+                        os.path.relpath(original, image_dir))
+
+
+def render(original, target, long_edge, quality=QUALITY):
+    """Write one rendition of `original` to `target`. Runs in a worker process."""
+    from PIL import Image
+
+    with Image.open(original) as image:
+        # Lets the JPEG decoder scale by 1/2, 1/4 or 1/8 as it decodes, to the
+        # smallest size still at least long_edge on both sides.
+        image.draft('RGB', (long_edge, long_edge))
+        image = image.convert('RGB')
+        image.thumbnail((long_edge, long_edge), Image.LANCZOS)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Written aside and renamed, so a request never serves half a file.
+        partial = target + '.partial'
+        image.save(partial, 'JPEG', quality=quality, optimize=True)
+    os.replace(partial, target)
+    return target
+
+
+def _lower_priority():
+    try:
+        os.nice(10)
+    except OSError:
+        pass
+
+
+def _ready():
+    return True
+
+
+class DerivativeWorker:
+    """Renders derivatives in a small process pool, one job per (capture, size).
+
+    `available` is False when PIL is missing, in which case nothing is
+    rendered and every request falls back to the original.
+    """
+
+    def __init__(self, image_dir, sizes=None, workers=1, quality=QUALITY):
+        self.image_dir = image_dir
+        self.sizes = dict(sizes or SIZES)
+        self.workers = max(1, workers)
+        self.quality = quality
+        self.available = importlib.util.find_spec('PIL') is not None
+        self.done = 0
+        self.failed = 0
+        self.last_error = None
+        self._pool = None
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Fork the workers now, while this process is still single-threaded."""
+        if self.available and self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_lower_priority)
+            # The fork context launches every worker on the first submit.
+            self._pool.submit(_ready).result()
+        return self
+
+    def call(self, function, *args):
+        """Run any other image work in the same pool. Returns the future.
+
+        `function` must be importable by name, as with any process pool.
+        """
+        if not self.available:
+            raise RuntimeError(self.last_error or "PIL not installed")
+        self.start()
+        return self._pool.submit(function, *args)
+
+    def path(self, original, size):
+        return derivative_path(self.image_dir, original, size)
+
+    def submit(self, original, sizes=None, force=False):
+        """Queue the renditions of one capture that do not exist yet.
+
+        Returns {size: future}. Never blocks on the render.
+        """
+        if not self.available:
+            return {}
+        self.start()
+        futures = {}
+        queued = []
+        with self._lock:
+            for size in sizes or self.sizes:
+                target = self.path(original, size)
+                if target in self._pending:
+                    futures[size] = self._pending[target]
+                    continue
+                if not force and os.path.exists(target):
+                    continue
+                try:
+                    future = self._pool.submit(render, original, target,
+                                               self.sizes[size], self.quality)
+                except RuntimeError as exc:
+                    # BrokenProcessPool: a worker died. Not re-forked from
+                    # here, where other threads exist; originals are served
+                    # until the next restart.
+                    self.available = False
+                    self.last_error = f"pool stopped: {exc}"
+                    print(f"derivatives unavailable: {exc}", flush=True)
+                    break
+                self._pending[target] = future
+                queued.append((target, future))
+                futures[size] = future
+        # Outside the lock: a future already done runs its callback here and
+        # now, and _finished takes the lock itself.
+        for target, future in queued:
+            future.add_done_callback(
+                lambda f, target=target: self._finished(target, f))
+        return futures
+
+    def _finished(self, target, future):
+        with self._lock:
+            self._pending.pop(target, None)
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                self.done += 1
+            else:
+                self.failed += 1
+                self.last_error = f"{os.path.basename(target)}: {error}"
+                print(f"derivative failed: {self.last_error}", flush=True)
+
+    def get(self, original, size, timeout=10.0):
+        """The path of a rendition, rendering it first if need be; None if it
+        cannot be had within `timeout` seconds."""
+        target = self.path(original, size)
+        if os.path.exists(target):
+            return target
+        future = self.submit(original, [size]).get(size)
+        if future is None:
+            return None
+        try:
+            future.result(timeout=timeout)
+        except Exception:  # noqa: BLE001 -- the original is served instead
+            return None
+        return target if os.path.exists(target) else None
+
+    def status(self):
+        return {
+            "available": self.available,
+            "sizes": self.sizes,
+            "pending": len(self._pending),
+            "done": self.done,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def backfill(worker, paths, sizes=None, force=False, progress=print):
+    """Render every missing derivative of `paths`. Returns (rendered, failed)."""
+    futures = []
+    for path in paths:
+        futures += worker.submit(path, sizes, force=force).values()
+    if not futures:
+        return 0, 0
+    rendered = failed = 0
+    started = time.monotonic()
+    for i, future in enumerate(as_completed(futures), 1):
+        if future.exception() is None:
+            rendered += 1
+        else:
+            failed += 1
+        if i % 100 == 0 or i == len(futures):
+            elapsed = time.monotonic() - started
+            progress(f"  {i}/{len(futures)}  {i / elapsed:.1f}/s  "
+                     f"{failed} failed")
+    return rendered, failed
+
+
+def main():
+    # Config lives beside this module's parent, so the deployed copy at
+    # /var/www/sllm finds its own config rather than the checkout's.
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'api'))
+    import config
+    from catalogue import ImageCatalogue
+
+    p = argparse.ArgumentParser()
+    p.add_argument("mode", choices=["backfill"])
+    p.add_argument("--size", action="append", default=None,
+                   help="only this size (repeatable); default all")
+    p.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--force", action="store_true",
+                   help="render again even where a derivative exists")
+    args = p.parse_args()
+
+    sizes = getattr(config, 'IMAGE_DERIVATIVES', SIZES)
+    worker = DerivativeWorker(config.IMAGE_DIR, sizes, workers=args.workers,
+                              quality=getattr(config, 'IMAGE_DERIVATIVE_QUALITY',
+                                              QUALITY))
+    if not worker.available:
+        print("PIL not installed: apt install python3-pil")
+        return 1
+    unknown = set(args.size or ()) - set(sizes)
+    if unknown:
+        print(f"unknown size {', '.join(sorted(unknown))}; "
+              f"configured: {', '.join(sizes)}")
+        return 1
+
+    catalogue = ImageCatalogue(config.IMAGE_DIR)
+    paths = catalogue.paths()
+    print(f"{len(paths)} captures, sizes {', '.join(args.size or sizes)}, "
+          f"{worker.workers} workers")
+    try:
+        rendered, failed = backfill(worker, paths, args.size, force=args.force)
+    finally:
+        worker.close()
+    print(f"rendered {rendered}, failed {failed}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""Latest-value topics, and the socket fan-out that pushes them to the dashboard.
+
+The dashboard's socket used to be fed by a timer: every SOCKET_EMIT_INTERVAL
+the API broadcast the electrode reading, the chamber reading and the light
+state to everyone connected, whether any of it had changed or not. The light
+state cost a unix-socket round trip to matrixd each time, so a process with
+nobody watching still asked the daemon about the panel twice a second.
+
+Now the things that know when something changed say so:
+
+    ElectrodeMonitor.poll()      publishes 'reading'
+    EnvironmentMonitor.poll()    publishes 'environment'
+    matrixd's state events       publish 'status' on every switch
+
+into an EventBus, which keeps only the newest payload per topic and a version
+number that moves when the payload does. A payload equal to the last one but
+for its timestamps is not a change and moves nothing -- a sensor that is
+unplugged republishes the same error every second and nobody needs to hear it.
+
+A Fanout thread waits on the bus and sends each topic's newest payload to the
+clients subscribed to it, at no more than the rate each asked for. Bursts
+coalesce: a client at one update a second gets the latest reading once a
+second, never a queue of them. Clients asking for the same rate share a room,
+so a change costs one emit per rate in use, not one per viewer. With nobody
+connected the thread does not wake at all.
+
+Nothing here knows about Flask; the API hands Fanout the callables that emit
+and that join and leave rooms.
+"""
+
+import threading
+import time
+
+# Keys that change on every publish without the payload meaning anything new.
+VOLATILE = frozenset(('timestamp', 'datetime'))
+
+
+def _content(payload):
+    if isinstance(payload, dict):
+        return {k: v for k, v in payload.items() if k not in VOLATILE}
+    return payload
+
+
+class EventBus:
+    """Newest payload per topic, with a version that moves on real change."""
+
+    def __init__(self):
+        self._latest = {}
+        self._versions = {}
+        self._cond = threading.Condition()
+        self._interrupted = False
+        self.published = 0
+        self.unchanged = 0
+
+    def publish(self, topic, payload):
+        """Record `payload` as the topic's newest. Returns whether it changed."""
+        with self._cond:
+            previous = self._latest.get(topic)
+            if previous is not None and _content(previous) == _content(payload):
+                # Kept, so a late subscriber still gets the fresh timestamp,
+                # but the version stays put and nobody is woken.
+                self._latest[topic] = payload
+                self.unchanged += 1
+                return False
+            self._latest[topic] = payload
+            self._versions[topic] = self._versions.get(topic, 0) + 1
+            self.published += 1
+            self._cond.notify_all()
+            return True
+
+    def latest(self, topic, default=None):
+        with self._cond:
+            return self._latest.get(topic, default)
+
+    def versions(self):
+        with self._cond:
+            return dict(self._versions)
+
+    def interrupt(self):
+        """Wake every waiter without a change, for shutdown."""
+        with self._cond:
+            self._interrupted = True
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout=None):
+        """Block until some topic's version differs from `seen`, or `timeout`.
+
+        Returns the current {topic: version}.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._interrupted or any(
+                    seen.get(t) != v for t, v in self._versions.items()),
+                timeout=timeout)
+            return dict(self._versions)
+
+
+class _Room:
+    """Everyone taking one topic at one interval."""
+
+    def __init__(self, topic, interval):
+        self.topic = topic
+        self.interval = interval
+        self.members = set()
+        self.sent = None         # bus version last emitted here
+        self.last = float('-inf')
+
+    @property
+    def name(self):
+        return f'{self.topic}@{self.interval:g}'
+
+
+class Fanout:
+    """Pushes bus topics to subscribed clients, coalesced to each one's rate.
+
+    `events` maps topic to the socket event name it is sent as. `emit(event,
+    payload, room)` sends to a room; `join(sid, room)` and `leave(sid, room)`
+    manage membership. A client's rates are seconds between updates, one per
+    topic, clamped to no faster than `floor`; a topic it leaves out it does
+    not receive.
+    """
+
+    def __init__(self, bus, events, emit, join, leave, default=1.0, floor=0.25):
+        self.bus = bus
+        self.events = dict(events)
+        self.emit = emit
+        self.join = join
+        self.leave = leave
+        self.default = default
+        self.floor = floor
+        self.sent = 0
+        self._rooms = {}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def clients(self):
+        return len(self._clients)
+
+    def _interval(self, rate):
+        try:
+            rate = float(rate)
+        except (TypeError, ValueError):
+            rate = self.default
+        # Rounded, so clients asking for 1.0 and 1.04 share a room.
+        return max(self.floor, round(rate, 1))
+
+    def subscribe(self, sid, rates=None):
+        """Set a client's topics and intervals, replacing any it had.
+
+        `rates` is {topic: seconds}; None means every topic at the default.
+        Returns the {topic: seconds} actually in force.
+        """
+        if rates is None:
+            rates = dict.fromkeys(self.events, self.default)
+        wanted = {topic: self._interval(rate) for topic, rate in rates.items()
+                  if topic in self.events}
+        with self._lock:
+            held = self._clients.get(sid, {})
+            for topic, interval in held.items():
+                if wanted.get(topic) != interval:
+                    self._part(sid, topic, interval)
+            for topic, interval in wanted.items():
+                if held.get(topic) != interval:
+                    key = (topic, interval)
+                    room = self._rooms.get(key)
+                    if room is None:
+                        room = self._rooms[key] = _Room(topic, interval)
+                        # Caught up from the start: a new room sends the next
+                        # change, the client got the current value on joining.
+                        room.sent = self.bus.versions().get(topic)
+                    room.members.add(sid)
+                    self.join(sid, room.name)
+            self._clients[sid] = wanted
+        self._wake.set()
+        return wanted
+
+    def _part(self, sid, topic, interval):
+        room = self._rooms.get((topic, interval))
+        if room is None:
+            return
+        room.members.discard(sid)
+        self.leave(sid, room.name)
+        if not room.members:
+            del self._rooms[(topic, interval)]
+
+    def unsubscribe(self, sid):
+        with self._lock:
+            for topic, interval in self._clients.pop(sid, {}).items():
+                self._part(sid, topic, interval)
+
+    def snapshot(self, topics=None):
+        """[(event, payload)] of what is current, for a client just connected."""
+        out = []
+        for topic in topics or self.events:
+            payload = self.bus.latest(topic)
+            if payload is not None:
+                out.append((self.events[topic], payload))
+        return out
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self._clients:
+                # Nobody listening: sleep until someone subscribes, rather than
+                # waking on every publish to find no one to send to.
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            now = time.monotonic()
+            due = None
+            with self._lock:
+                versions = self.bus.versions()
+                for room in list(self._rooms.values()):
+                    version = versions.get(room.topic)
+                    if version is None or version == room.sent:
+                        continue
+                    ready = room.last + room.interval
+                    if ready > now:
+                        due = ready if due is None else min(due, ready)
+                        continue
+                    payload = self.bus.latest(room.topic)
+                    room.sent, room.last = version, now
+                    try:
+                        self.emit(self.events[room.topic], payload, room.name)
+                        self.sent += 1
+                    except Exception as exc:  # noqa: BLE001 -- keep serving the rest
+                        print(f"socket emit failed: {exc}")
+            seen = versions
+            # Until the next room falls due, or something new arrives.
+            timeout = None if due is None else max(0.0, due - time.monotonic())
+            if timeout is None or timeout > 0:
+                self.bus.wait(seen, timeout=timeout)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self.bus.interrupt()
+
+    def status(self):
+        with self._lock:
+            rooms = {room.name: len(room.members) for room in self._rooms.values()}
+        return {
+            "clients": len(self._clients),
+            "rooms": rooms,
+            "sent": self.sent,
+            "published": self.bus.published,
+            "unchanged": self.bus.unchanged,
+        }
@@ -0,0 +1,438 @@
+"""Timelapse exports: a video and a contact sheet of a run, built in the background.
+
+Until now the only way to look back over a multi-day run was /api/images a
+page at a time. An export takes a date range from the image catalogue and
+makes two files from it:
+
+    timelapse.avi    MJPEG in AVI: every frame's JPEG bytes, one after another,
+                     with an index. Plays in VLC, mpv and browsers' download
+                     viewers, and ffmpeg can re-encode it to anything.
+    sheet.jpg        a contact sheet, a grid of thumbnails sampled evenly
+                     across the range, for seeing two weeks on one screen
+
+MJPEG because the frames already are JPEGs. The medium derivatives from
+derivatives.py go into the file as they are -- no decode, no encode, nothing
+in memory but the frame being copied -- so a run of any length exports in
+bounded memory, and the only image processing the job ever asks for is a
+derivative that does not exist yet, which the worker pool renders as usual.
+The contact sheet is pasted together from thumbnails in the same pool.
+
+Jobs run one at a time on a background thread, and are resumable. Each job
+lives in its own directory under EXPORT_DIR:
+
+    data/exports/20260819T101500-3f2a/job.json       parameters and progress
+    data/exports/20260819T101500-3f2a/frames.txt     the frame list, frozen
+    data/exports/20260819T101500-3f2a/timelapse.avi.partial
+    data/exports/20260819T101500-3f2a/timelapse.avi.idx
+
+Progress is checkpointed every CHECKPOINT_FRAMES frames: the frame count and
+the byte length of the video so far, flushed to disk first. A job interrupted
+by a restart -- or stopped by close() at shutdown -- is picked up by the next
+ExportQueue, which truncates the partial file back to the last checkpoint and
+carries on from the next frame. The frame list is written once when the job
+starts, so frames captured during an export never shift what "frame 4000"
+means across a resume.
+
+A job has two phases, recorded in job.json as `phase`: "video", then
+"sheet" once timelapse.avi is in place. A job resumed in the sheet phase
+goes straight to the sheet. The video is never rebuilt after it is
+finished; its partial file and index are gone by then, and rebuilding from
+them would overwrite a good video with an empty one.
+
+AVI 1.0 keeps sizes in 32 bits. A file that would pass MAX_AVI_BYTES fails
+with a message to raise `step` or use smaller frames, rather than writing
+something players cannot open.
+"""
+
+import json
+import os
+import re
+import struct
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+
+from catalogue import jpeg_size
+
+CHECKPOINT_FRAMES = 25
+MAX_AVI_BYTES = 4_000_000_000
+SHEET_TILES = 144
+SHEET_COLUMNS = 12
+# YYYYMMDD, or YYYYMMDD_HHMMSS for part of a day.
+BOUND_RE = re.compile(r'^\d{8}(?:_\d{6})?$')
+
+AVI_HEADER_BYTES = 224
+# Offset of the 'movi' fourcc; idx1 offsets are counted from here.
+MOVI_OFFSET = 220
+INDEX_ENTRY = struct.Struct('<4sIII')
+
+
+def _chunk(fourcc, data):
+    return fourcc + struct.pack('<I', len(data)) + data
+
+
+def avi_header(width, height, fps, frames, movi_bytes, file_bytes, largest):
+    """The fixed 224 bytes that open an MJPEG AVI, through the 'movi' fourcc."""
+    avih = struct.pack('<14I', int(1_000_000 / fps), int(largest * fps), 0,
+                       0x10, frames, 0, 1, largest, width, height, 0, 0, 0, 0)
+    strh = struct.pack('<4s4sIHHIIIIIIIIhhhh', b'vids', b'MJPG', 0, 0, 0, 0,
+                       1, fps, 0, frames, largest, 0xFFFFFFFF, 0,
+                       0, 0, width, height)
+    strf = struct.pack('<IiiHH4sIiiII', 40, width, height, 1, 24, b'MJPG',
+                       width * height * 3, 0, 0, 0, 0)
+    strl = b'strl' + _chunk(b'strh', strh) + _chunk(b'strf', strf)
+    hdrl = b'hdrl' + _chunk(b'avih', avih) + _chunk(b'LIST', strl)
+    header = (b'RIFF' + struct.pack('<I', max(0, file_bytes - 8)) + b'AVI '
+              + _chunk(b'LIST', hdrl)
+              + b'LIST' + struct.pack('<I', movi_bytes) + b'movi')
+    assert len(header) == AVI_HEADER_BYTES
+    return header
+
+
+def contact_sheet(tiles, columns, tile_width, target):
+    """Paste thumbnails into a grid, each labelled with its capture time.
+
+    `tiles` is [(path, label)]. Runs in a derivative worker process.
+    """
+    from PIL import Image, ImageDraw
+
+    images = []
+    tile_height = None
+    for path, label in tiles:
+        try:
+            with Image.open(path) as image:
+                image.draft('RGB', (tile_width, tile_width))
+                image = image.convert('RGB')
+                image.thumbnail((tile_width, tile_width))
+        except OSError:
+            image = None
+        if image is not None and tile_height is None:
+            tile_height = image.height
+        images.append((image, label))
+    tile_height = tile_height or tile_width * 9 // 16
+
+    rows = -(-len(images) // columns)
+    sheet = Image.new('RGB', (columns * tile_width, rows * tile_height))
+    draw = ImageDraw.Draw(sheet)
+    for i, (image, label) in enumerate(images):
+        x, y = (i % columns) * tile_width, (i // columns) * tile_height
+        if image is not None:
+            sheet.paste(image, (x, y))
+        draw.text((x + 4, y + 2), label, fill=(255, 255, 255))
+    partial = target + '.partial'
+    sheet.save(partial, 'JPEG', quality=85)
+    os.replace(partial, target)
+    return target
+
+
+class ExportQueue:
+    """Runs export jobs one at a time, and resumes any left unfinished.
+
+    `catalogue` is the API's ImageCatalogue; `derivatives` its
+    DerivativeWorker, or None to export originals and skip the sheet.
+    """
+
+    def __init__(self, directory, catalogue, derivatives=None):
+        self.directory = directory
+        self.catalogue = catalogue
+        self.derivatives = derivatives
+        self._jobs = {}
+        self._queue = deque()
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._cancel = set()
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            job = self._load(name)
+            if job is None:
+                continue
+            self._jobs[job["id"]] = job
+            if job["state"] in ("queued", "running"):
+                job["state"] = "queued"
+                self._queue.append(job["id"])
+
+    def _dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def _load(self, job_id):
+        try:
+            with open(os.path.join(self._dir(job_id), 'job.json')) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _save(self, job):
+        job["updated"] = time.time()
+        path = os.path.join(self._dir(job["id"]), 'job.json')
+        with open(path + '.tmp', 'w') as handle:
+            json.dump(job, handle, indent=1)
+        os.replace(path + '.tmp', path)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Stop after the current checkpoint. The job resumes on next start."""
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+
+    def submit(self, start, end, fps=12, step=1, size='medium',
+               sheet_tiles=SHEET_TILES):
+        """Queue an export of captures from `start` to `end`, both inclusive.
+
+        Bounds are YYYYMMDD or YYYYMMDD_HHMMSS. Raises ValueError on bad
+        parameters. Returns the job's status.
+        """
+        for bound in (start, end):
+            if not BOUND_RE.match(bound or ''):
+                raise ValueError("start and end must be YYYYMMDD or YYYYMMDD_HHMMSS")
+        fps, step, sheet_tiles = int(fps), int(step), int(sheet_tiles)
+        if not 1 <= fps <= 60 or step < 1 or not 0 <= sheet_tiles <= 1000:
+            raise ValueError("fps must be 1-60, step at least 1, "
+                             "sheet_tiles 0-1000")
+        sizes = ['full'] + list(self.derivatives.sizes if self.derivatives else ())
+        if size not in sizes:
+            raise ValueError(f"size must be one of {', '.join(sizes)}")
+
+        job_id = f"{datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:4]}"
+        job = {
+            "id": job_id, "state": "queued", "error": None,
+            "start": start, "end": end, "fps": fps, "step": step,
+            "size": size, "sheet_tiles": sheet_tiles,
+            "created": time.time(), "frames_total": None, "frames_done": 0,
+            "frames_written": 0, "avi_bytes": 0, "largest": 0, "width": None, "height": None,
+            "phase": "video", "files": {},
+        }
+        os.makedirs(self._dir(job_id))
+        self._save(job)
+        with self._wake:
+            self._jobs[job_id] = job
+            self._queue.append(job_id)
+            self._wake.notify_all()
+        return self.status(job_id)
+
+    def cancel(self, job_id):
+        """Stop a queued or running job for good. False if there is no such job."""
+        job = self._jobs.get(job_id)
+        if job is None:
+            return False
+        with self._wake:
+            if job_id in self._queue:
+                self._queue.remove(job_id)
+                job["state"] = "cancelled"
+                self._save(job)
+            elif job["state"] == "running":
+                self._cancel.add(job_id)
+        return True
+
+    def status(self, job_id=None):
+        """One job's progress, or every job's, newest first."""
+        if job_id is None:
+            return [self.status(j) for j in sorted(self._jobs, reverse=True)]
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        total, done = job["frames_total"], job["frames_done"]
+        out = {key: job[key] for key in (
+            "id", "state", "error", "start", "end", "fps", "step", "size",
+            "frames_total", "frames_done", "created", "updated")}
+        out["phase"] = job.get("phase", "video")
+        out["progress"] = round(done / total, 4) if total else None
+        out["files"] = {name: f"/api/exports/{job_id}/{name}"
+                        for name in job["files"]}
+        return out
+
+    def path(self, job_id, name):
+        """A finished file of a job, or None."""
+        job = self._jobs.get(job_id)
+        if job is None or name not in job.get("files", {}):
+            return None
+        return os.path.join(self._dir(job_id), job["files"][name])
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._wake:
+                while not self._queue and not self._stop.is_set():
+                    self._wake.wait()
+                if self._stop.is_set():
+                    return
+                job = self._jobs[self._queue.popleft()]
+            try:
+                self._export(job)
+            except Exception as exc:  # noqa: BLE001 -- one job must not end the queue
+                job["state"], job["error"] = "failed", str(exc)
+                print(f"export {job['id']} failed: {exc}", flush=True)
+                self._save(job)
+
+    def _frames(self, job):
+        """The job's frame list: written once, then read back on every resume."""
+        path = os.path.join(self._dir(job["id"]), 'frames.txt')
+        if os.path.exists(path):
+            with open(path) as handle:
+                return handle.read().split()
+        names = self.catalogue.between(job["start"], job["end"])[::job["step"]]
+        with open(path + '.tmp', 'w') as handle:
+            handle.write('\n'.join(names) + '\n')
+        os.replace(path + '.tmp', path)
+        return names
+
+    def _source(self, name, size):
+        """Path of the bytes to use for one frame, or None if it is gone.
+
+        A derivative that cannot be rendered falls back to the original, so
+        one bad frame costs a frame at the wrong size rather than the export.
+        """
+        original = self.catalogue.resolve(name)
+        if original is None:
+            return None
+        if size == 'full' or self.derivatives is None or not self.derivatives.available:
+            return original
+        return self.derivatives.get(original, size, timeout=120.0) or original
+
+    def _interrupted(self, job):
+        """True if the job should stop here: cancelled, or the queue closing.
+
+        A cancel is settled on the spot; a close leaves the job "running",
+        to be resumed from its last checkpoint on the next start.
+        """
+        if job["id"] in self._cancel:
+            self._cancel.discard(job["id"])
+            job["state"] = "cancelled"
+            self._save(job)
+            return True
+        return self._stop.is_set()
+
+    def _export(self, job):
+        job["state"] = "running"
+        names = self._frames(job)
+        job["frames_total"] = len(names)
+        self._save(job)
+        if not names:
+            raise ValueError("no captures in that range")
+
+        folder = self._dir(job["id"])
+        video = os.path.join(folder, 'timelapse.avi')
+        partial, index = video + '.partial', video + '.idx'
+
+        if job.get("phase", "video") == "video" and "timelapse.avi" in job["files"]:
+            # From before phases were recorded: the video was finished.
+            job["phase"] = "sheet"
+        if (job.get("phase", "video") == "video" and not os.path.exists(partial)
+                and os.path.exists(video) and job["frames_done"] == len(names)):
+            # Killed between moving the video into place and recording it.
+            job["files"]["timelapse.avi"] = 'timelapse.avi'
+            job["phase"] = "sheet"
+        if job.get("phase", "video") == "video":
+            if not self._video(job, names, partial, index):
+                return
+            self._finish_video(job, partial, index, video)
+            job["files"]["timelapse.avi"] = 'timelapse.avi'
+            job["phase"] = "sheet"
+            self._save(job)
+        if os.path.exists(index):
+            os.unlink(index)
+
+        if job["sheet_tiles"] and self.derivatives is not None \
+                and self.derivatives.available:
+            if not self._sheet(job, names):
+                return
+        job["state"] = "done"
+        self._save(job)
+
+    def _video(self, job, names, partial, index):
+        """Write frames into the partial file. False if interrupted first."""
+        with open(partial, 'ab') as out, open(index, 'ab') as entries:
+            # Back to the last checkpoint: anything after it may be half a
+            # frame, or a frame the checkpoint does not know was written.
+            # A new file is extended to the header's length with zeros; the
+            # real header is written over them once the frame count is known.
+            out.truncate(job["avi_bytes"] or AVI_HEADER_BYTES)
+            entries.truncate(job["frames_written"] * INDEX_ENTRY.size)
+            out.seek(0, os.SEEK_END)
+            entries.seek(0, os.SEEK_END)
+
+            for i in range(job["frames_done"], len(names)):
+                if self._stop.is_set() or job["id"] in self._cancel:
+                    break
+                source = self._source(names[i], job["size"])
+                if source is None:
+                    data = None
+                else:
+                    with open(source, 'rb') as handle:
+                        data = handle.read()
+                if data:
+                    if job["width"] is None:
+                        job["width"], job["height"] = jpeg_size(source)
+                    position = out.tell()
+                    if position + len(data) + 8 + (job["frames_written"] + 1) \
+                            * INDEX_ENTRY.size > MAX_AVI_BYTES:
+                        raise ValueError("video would pass AVI's 4GB limit; "
+                                         "raise step or use a smaller size")
+                    out.write(_chunk(b'00dc', data) + (b'\0' if len(data) % 2 else b''))
+                    entries.write(INDEX_ENTRY.pack(b'00dc', 0x10,
+                                                   position - MOVI_OFFSET, len(data)))
+                    job["largest"] = max(job["largest"], len(data))
+                    job["frames_written"] += 1
+                job["frames_done"] = i + 1
+                if job["frames_done"] % CHECKPOINT_FRAMES == 0:
+                    self._checkpoint(job, out, entries)
+            self._checkpoint(job, out, entries)
+
+        return not self._interrupted(job)
+
+    def _checkpoint(self, job, out, entries):
+        out.flush()
+        entries.flush()
+        os.fsync(out.fileno())
+        os.fsync(entries.fileno())
+        job["avi_bytes"] = out.tell()
+        self._save(job)
+
+    def _finish_video(self, job, partial, index, video):
+        """Append the index, write the real header, and move the file into place."""
+        with open(index, 'rb') as handle:
+            entries = handle.read()
+        frames = len(entries) // INDEX_ENTRY.size
+        with open(partial, 'r+b') as out:
+            out.seek(0, os.SEEK_END)
+            movi_bytes = out.tell() - MOVI_OFFSET
+            out.write(_chunk(b'idx1', entries))
+            size = out.tell()
+            out.seek(0)
+            out.write(avi_header(job["width"] or 0, job["height"] or 0, job["fps"],
+                                 frames, movi_bytes, size, job["largest"]))
+        os.replace(partial, video)
+
+    def _sheet(self, job, names):
+        """Contact sheet of up to sheet_tiles frames, evenly spaced.
+
+        False if cancelled or stopped between tiles. Nothing is checkpointed:
+        a resumed sheet starts over, and finds the thumbnails it already
+        rendered on disk.
+        """
+        count = min(job["sheet_tiles"], len(names))
+        picks = [names[round(i * (len(names) - 1) / max(1, count - 1))]
+                 for i in range(count)]
+        tiles = []
+        for name in picks:
+            if self._interrupted(job):
+                return False
+            source = self._source(name, 'thumb' if 'thumb' in self.derivatives.sizes
+                                  else job["size"])
+            if source is not None:
+                tiles.append((source, name[6:21].replace('_', ' ')))
+        tile_width = self.derivatives.sizes.get('thumb', 320)
+        target = os.path.join(self._dir(job["id"]), 'sheet.jpg')
+        if self._interrupted(job):
+            return False
+        self.derivatives.call(contact_sheet, tiles, SHEET_COLUMNS, tile_width,
+                              target).result()
+        job["files"]["sheet.jpg"] = 'sheet.jpg'
+        return True
@@ -18,11 +18,21 @@ the bottom-left, runs right along the bottom row, and every alternate row runs
 backwards. The four flags below encode that. If the panel is ever remounted or
 rotated, re-run matrix_map.py and change only those flags; every zone and
 sequence in this file derives from them.
+
+Frames are composed, not painted. The zone geometry is compiled once, at
+import, into an array of chain indices per zone; a frame is a 256x3 array
+built from those in a few vectorised assignments and copied into the strip's
+buffers in one go (write_frame). Matrix keeps the last frame it composed and
+composes again only after the blue state changes, so matrixd's periodic
+refresh is a buffer copy and a show(), not a repaint pixel by pixel.
+`./scripts/py gpio/leds_bench.py` measures both against a stand-in strip.
 """
 
 import sys
 import time
 
+import numpy as np
+
 SIDE = 16
 PIXELS = SIDE * SIDE
 ZONES = 9
@@ -86,6 +96,89 @@ def zone_pixels(zone):
     return [electrical_index(x, y) for y in range(y0, y1) for x in range(x0, x1)]
 
 
+# Chain indices per zone, compiled once from the flags above.
+ZONE_INDEX = tuple(np.array(zone_pixels(z), dtype=np.intp) for z in range(ZONES))
+
+# Whole-panel frames for the flash sequence, RGB per chain position.
+DARK = np.zeros((PIXELS, 3), dtype=np.uint8)
+RED = np.zeros((PIXELS, 3), dtype=np.uint8)
+RED[:, 0] = 255
+
+
+def compose(blue):
+    """Per-zone blue levels 0.0..1.0 -> the frame, RGB per chain position."""
+    frame = np.zeros((PIXELS, 3), dtype=np.uint8)
+    for z, level in enumerate(blue):
+        if level > 0:
+            frame[ZONE_INDEX[z], 2] = int(255 * min(level, 1.0))
+    return frame
+
+
+def frame_levels(levels):
+    """A whole stimulus frame -> ZONES blue levels, all checked before any is used.
+
+    Either a sequence of ZONES levels, or {zone: level} with absent zones
+    dark. The barrier's entry must be absent, None or 0: it is held lit
+    whatever a frame says, and a frame asking for it is a mistake to report,
+    not to paper over.
+    """
+    if isinstance(levels, dict):
+        wanted = [0.0] * ZONES
+        for zone, level in levels.items():
+            zone = int(zone)
+            if not 0 <= zone < ZONES:
+                raise ValueError(f"zone {zone} outside 0..{ZONES - 1}")
+            wanted[zone] = level
+    else:
+        wanted = list(levels)
+        if len(wanted) != ZONES:
+            raise ValueError(f"a frame has {ZONES} levels, not {len(wanted)}")
+    out = []
+    for zone, level in enumerate(wanted):
+        if zone == BARRIER_ZONE:
+            if level:
+                raise ValueError(f"zone {BARRIER_ZONE} is the barrier and is not drivable")
+            out.append(None)
+            continue
+        level = float(level or 0.0)
+        if not 0.0 <= level <= 1.0:
+            raise ValueError(f"intensity {level} outside 0.0..1.0")
+        out.append(level)
+    return out
+
+
+def write_frame(px, frame, brightness):
+    """Load a composed frame into a NeoPixel's buffers at `brightness`.
+
+    Does not show it. adafruit_pixelbuf keeps the colours twice -- as set,
+    and scaled by brightness, which is what goes down the wire -- and its
+    own setters fill both one pixel at a time in Python, then rescale all
+    768 bytes again whenever brightness changes. Here both buffers are
+    written as whole slices, in the strip's byte order, scaled the same way
+    (truncated, as int() does), so the panel receives exactly the bytes the
+    per-pixel path would have sent. Anything that does not look like that
+    buffer layout gets the per-pixel path.
+    """
+    post = getattr(px, '_post_brightness_buffer', None)
+    order = getattr(px, '_byteorder', None)
+    if (isinstance(post, bytearray) and getattr(px, '_bpp', None) == 3
+            and not getattr(px, '_dotstar_mode', False) and order is not None):
+        brightness = min(max(brightness, 0.0), 1.0)
+        wire = np.empty_like(frame)
+        wire[:, list(order[:3])] = frame
+        start, end = px._offset, px._offset + PIXELS * 3
+        if px._pre_brightness_buffer is None:
+            px._pre_brightness_buffer = bytearray(post)
+        px._pre_brightness_buffer[start:end] = wire.tobytes()
+        post[start:end] = (wire * brightness).astype(np.uint8).tobytes()
+        # Set underneath the property, whose setter would rescale the whole
+        # buffer again, byte by byte, to the values just written.
+        px._brightness = brightness
+        return
+    px.brightness = brightness
+    px[:] = [tuple(rgb) for rgb in frame.tolist()]
+
+
 def zone_of(x, y):
     """Arena (x, y) -> which zone contains it."""
     col = next(i for i, (a, b) in enumerate(BANDS) if a <= x < b)
@@ -131,18 +224,20 @@ class Matrix:
         # Intensity 0.0..1.0 per zone, the model's requested blue level.
         self._blue = [0.0] * ZONES
         self._blue[BARRIER_ZONE] = BARRIER_BRIGHTNESS / STIM_BRIGHTNESS
+        # The frame for _blue, or None when _blue has changed since.
+        self._frame = None
         self._render()
 
     def _render(self):
-        """Push current blue state to the panel."""
-        self._px.fill((0, 0, 0))
-        for z, level in enumerate(self._blue):
-            if level <= 0:
-                continue
-            value = int(255 * min(level, 1.0))
-            for i in zone_pixels(z):
-                self._px[i] = (0, 0, value)
-        self._px.brightness = STIM_BRIGHTNESS
+        """Push current blue state to the panel, composing it only if changed."""
+        if self._frame is None:
+            self._frame = compose(self._blue)
+        self._show(self._frame, STIM_BRIGHTNESS)
+
+    def _show(self, frame, brightness=None):
+        """Put any whole-panel frame up, at `brightness` (default unchanged)."""
+        write_frame(self._px, frame,
+                    self._px.brightness if brightness is None else brightness)
         self._px.show()
 
     def set_zone(self, zone, intensity):
@@ -152,8 +247,38 @@ class Matrix:
         if not 0.0 <= intensity <= 1.0:
             raise ValueError(f"intensity {intensity} outside 0.0..1.0")
         self._blue[zone] = intensity
+        self._frame = None
         self._render()
 
+    def set_frame(self, levels, render=True):
+        """Every drivable zone at once, one render and one show(): one edge.
+
+        `levels` as frame_levels() takes it. Replaces the whole stimulus, so
+        `clear_stimulus(); set_zone(z, v)` -- two frames down the wire, the
+        first of them dark -- becomes `set_frame({z: v})`. With `render`
+        false the state is set and the panel left as it is, for a caller
+        that knows something else is on it and will render after.
+        """
+        for zone, level in enumerate(frame_levels(levels)):
+            if level is not None:
+                self._blue[zone] = level
+        self._frame = None
+        if render:
+            self._render()
+
+    def play(self, frames):
+        """set_frame each of [(seconds from now, levels), ...] at its time.
+
+        Blocks until the last. Through matrixd the same call returns at once
+        and the daemon keeps the time; this is for a process that owns the
+        panel itself.
+        """
+        frames = [(float(offset), frame_levels(levels)) for offset, levels in frames]
+        start = time.monotonic()
+        for offset, levels in frames:
+            time.sleep(max(0.0, start + offset - time.monotonic()))
+            self.set_frame(levels)
+
     def active_zones(self):
         """Zones currently lit as stimulus, {zone: intensity}.
 
@@ -173,6 +298,7 @@ class Matrix:
         for z in range(ZONES):
             if z != BARRIER_ZONE:
                 self._blue[z] = 0.0
+        self._frame = None
         self._render()
 
     def capture_flash(self, exposure):
@@ -183,27 +309,21 @@ class Matrix:
         and the blue state is restored even if it raises.
         """
         try:
-            self._px.fill((0, 0, 0))
-            self._px.show()
+            self._show(DARK)
             time.sleep(BLANK_SETTLE)
 
-            self._px.brightness = IMAGING_BRIGHTNESS
-            self._px.fill((255, 0, 0))
-            self._px.show()
+            self._show(RED, IMAGING_BRIGHTNESS)
             time.sleep(BLANK_SETTLE)
 
             return exposure()
         finally:
-            self._px.fill((0, 0, 0))
-            self._px.show()
+            self._show(DARK)
             time.sleep(BLANK_SETTLE)
             self._render()
 
     def off(self):
         """Everything dark, including the barrier. For shutdown only."""
-        self._px.brightness = MAX_BRIGHTNESS
-        self._px.fill((0, 0, 0))
-        self._px.show()
+        self._show(DARK, MAX_BRIGHTNESS)
 
 
 def main():
@@ -0,0 +1,233 @@
+"""Benchmark for leds.Matrix rendering, with no panel attached.
+
+Installs a stand-in `board` and `neopixel` before leds.Matrix is built, so
+this runs on any machine and never touches /dev/mem. The stand-in strip is
+adafruit_pixelbuf's own PixelBuf when that is installed -- the same buffer
+code the real NeoPixel runs -- and otherwise a copy of the parts of it that
+rendering exercises. show() records the bytes instead of sending them.
+
+Three ways of putting the current state up are timed per frame:
+
+    paint     the old Matrix._render(), reproduced here verbatim: fill(),
+              then zone_pixels() and one __setitem__ per lit pixel
+    compose   the new _render() after a state change: compose from the
+              precompiled zone indices, then one bulk buffer write
+    refresh   the new _render() with nothing changed, which is what matrixd
+              does every REFRESH_INTERVAL_S: the cached frame re-written
+
+and the flash sequence, old fill()s against the new whole-frame writes; and
+a switch from one lit zone to another, clear_stimulus then set_zone against
+one set_frame, counting the frames each sends. Every path must leave the
+panel with the same bytes as the old one, or this exits non-zero.
+
+    ./scripts/py gpio/leds_bench.py
+    ./scripts/py gpio/leds_bench.py --frames 5000
+"""
+
+import argparse
+import sys
+import time
+import types
+
+try:
+    from adafruit_pixelbuf import PixelBuf
+except ImportError:
+    PixelBuf = None
+
+
+class _PixelBuf:
+    """adafruit_pixelbuf.PixelBuf as far as leds.py uses it, RGB only."""
+
+    def __init__(self, size, *, byteorder='GRB', brightness=1.0,
+                 auto_write=False):
+        self._pixels = size
+        self._bytes = 3 * size
+        self._byteorder = tuple(byteorder.index(c) for c in 'RGB')
+        self._bpp = 3
+        self._offset = 0
+        self._dotstar_mode = False
+        self._pre_brightness_buffer = None
+        self._post_brightness_buffer = bytearray(self._bytes)
+        self._brightness = 1.0
+        self.brightness = brightness
+        self.auto_write = auto_write
+
+    @property
+    def brightness(self):
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, value):
+        value = min(max(value, 0.0), 1.0)
+        if -0.001 < value - self._brightness < 0.001:
+            return
+        self._brightness = value
+        if self._pre_brightness_buffer is None:
+            self._pre_brightness_buffer = bytearray(self._post_brightness_buffer)
+        for i in range(self._bytes):
+            self._post_brightness_buffer[i] = int(
+                self._pre_brightness_buffer[i] * self._brightness)
+
+    def __len__(self):
+        return self._pixels
+
+    def _set_item(self, index, r, g, b, _w=0):
+        offset = index * 3
+        if self._pre_brightness_buffer is not None:
+            self._pre_brightness_buffer[offset + self._byteorder[0]] = r
+            self._pre_brightness_buffer[offset + self._byteorder[1]] = g
+            self._pre_brightness_buffer[offset + self._byteorder[2]] = b
+        self._post_brightness_buffer[offset + self._byteorder[0]] = int(r * self._brightness)
+        self._post_brightness_buffer[offset + self._byteorder[1]] = int(g * self._brightness)
+        self._post_brightness_buffer[offset + self._byteorder[2]] = int(b * self._brightness)
+
+    def fill(self, color):
+        for i in range(self._pixels):
+            self._set_item(i, *color)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            for i, color in zip(range(*index.indices(self._pixels)), value):
+                self._set_item(i, *color)
+        else:
+            self._set_item(index, *value)
+
+    def show(self):
+        return self._transmit(self._post_brightness_buffer)
+
+
+def install_fakes():
+    """Put stand-in `board` and `neopixel` modules where leds.Matrix imports them."""
+    base = PixelBuf or _PixelBuf
+
+    class NeoPixel(base):
+        def __init__(self, pin, n, *, brightness=1.0, auto_write=True,
+                     pixel_order='GRB'):
+            super().__init__(n, byteorder=pixel_order, brightness=brightness,
+                             auto_write=auto_write)
+            self.sent = []
+
+        def _transmit(self, buffer):
+            self.sent.append(bytes(buffer))
+
+    sys.modules['board'] = types.SimpleNamespace(D18=18)
+    sys.modules['neopixel'] = types.SimpleNamespace(NeoPixel=NeoPixel)
+    return 'adafruit_pixelbuf' if PixelBuf else 'stand-in PixelBuf'
+
+
+def paint(matrix, leds):
+    """Matrix._render() before zone indices and frames, verbatim."""
+    matrix._px.fill((0, 0, 0))
+    for z, level in enumerate(matrix._blue):
+        if level <= 0:
+            continue
+        value = int(255 * min(level, 1.0))
+        for i in leds.zone_pixels(z):
+            matrix._px[i] = (0, 0, value)
+    matrix._px.brightness = leds.STIM_BRIGHTNESS
+    matrix._px.show()
+
+
+def paint_flash(matrix, leds):
+    """The old flash sequence's panel writes, without the settle sleeps."""
+    px = matrix._px
+    px.fill((0, 0, 0))
+    px.show()
+    px.brightness = leds.IMAGING_BRIGHTNESS
+    px.fill((255, 0, 0))
+    px.show()
+    px.fill((0, 0, 0))
+    px.show()
+    paint(matrix, leds)
+
+
+def frame_flash(matrix, leds):
+    matrix._show(leds.DARK)
+    matrix._show(leds.RED, leds.IMAGING_BRIGHTNESS)
+    matrix._show(leds.DARK)
+    matrix._render()
+
+
+def timed(action, frames):
+    started = time.perf_counter()
+    for _ in range(frames):
+        action()
+    return (time.perf_counter() - started) * 1e6 / frames
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=2000)
+    args = parser.parse_args()
+
+    strip = install_fakes()
+    import leds
+
+    leds.BLANK_SETTLE = 0
+    matrix = leds.Matrix()
+    states = [{}, {4: 1.0}, {0: 0.3, 4: 0.8, 8: 1.0},
+              {z: 0.5 for z in range(leds.ZONES) if z != leds.BARRIER_ZONE}]
+
+    ok = True
+    print(f"strip: {strip}, {leds.PIXELS} pixels, {args.frames} frames per case\n")
+    print(f"  {'state':<10} {'paint us':>10} {'compose us':>11} {'refresh us':>11}"
+          f"  same bytes")
+    for n, state in enumerate(states):
+        matrix.clear_stimulus()
+        for zone, level in state.items():
+            matrix.set_zone(zone, level)
+        sent = matrix._px.sent
+
+        paint(matrix, leds)
+        expected = sent[-1]
+
+        def composed():
+            matrix._frame = None
+            matrix._render()
+
+        old = timed(lambda: paint(matrix, leds), args.frames)
+        new = timed(composed, args.frames)
+        same = sent[-1] == expected
+        refresh = timed(matrix._render, args.frames)
+        same &= sent[-1] == expected
+        ok &= same
+        print(f"  {f'{len(state)} lit':<10} {old:10.1f} {new:11.1f} {refresh:11.1f}"
+              f"  {'yes' if same else 'NO'}")
+        del sent[:]
+
+    matrix.set_zone(4, 1.0)
+    sent = matrix._px.sent
+    paint_flash(matrix, leds)
+    expected = sent[-4:]
+    old = timed(lambda: paint_flash(matrix, leds), args.frames // 4 or 1)
+    new = timed(lambda: frame_flash(matrix, leds), args.frames // 4 or 1)
+    same = sent[-4:] == expected
+    ok &= same
+    print(f"\n  flash sequence, 4 writes: {old:.1f} us painted, {new:.1f} us "
+          f"from frames, same bytes {'yes' if same else 'NO'}")
+
+    def pair(zone):
+        matrix.clear_stimulus()
+        matrix.set_zone(zone, 0.8)
+
+    def framed(zone):
+        matrix.set_frame({zone: 0.8})
+
+    switches = []
+    for switch in (pair, framed):
+        matrix.set_zone(4, 1.0)
+        del sent[:]
+        switch(6)
+        switches.append((len(sent), sent[-1]))
+        switches.append(timed(lambda: (switch(6), switch(4)), args.frames // 2 or 1) / 2)
+    (pair_writes, pair_bytes), pair_us, (frame_writes, frame_bytes), frame_us = switches
+    same = pair_bytes == frame_bytes
+    ok &= same and frame_writes == 1
+    print(f"  switch zone 4 -> 6: clear+set {pair_writes} frames {pair_us:.1f} us, "
+          f"set_frame {frame_writes} frame {frame_us:.1f} us, same bytes "
+          f"{'yes' if same else 'NO'}")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,9 +4,9 @@ The panel needs root because rpi_ws281x goes through /dev/mem. The API must not
 be root because it is exposed to the internet. gpio/matrixd.py resolves that by
 being the only privileged process; this is the client side.
 
-MatrixClient presents the same methods as leds.Matrix -- set_zone,
-clear_stimulus, active_zones, stimulus_active, capture_flash, off -- so nothing
-that drives the panel has to know which one it is holding.
+MatrixClient presents the same methods as leds.Matrix -- set_zone, set_frame,
+play, clear_stimulus, active_zones, stimulus_active, capture_flash, off -- so
+nothing that drives the panel has to know which one it is holding.
 
     from matrix_client import open_matrix
     matrix, error = open_matrix()
@@ -14,20 +14,42 @@ that drives the panel has to know which one it is holding.
 `open_matrix` prefers the daemon and falls back to driving the panel directly
 if this process happens to be root and the daemon is not running, which keeps
 the standalone tools working unchanged.
+
+The standalone tools speak matrixd's one-shot protocol: a connection per
+request. The API and the loop ask `persistent=True` and hold one session for
+the life of the process instead -- see matrixd.py -- shared by every thread,
+with requests pipelined over it and matched to replies by id, a ping while
+idle to keep the lease, and a fresh session opened when the old one is found
+dead.
+
+A persistent client also subscribes to matrixd's state events and keeps a
+mirror of the panel state, tagged with the daemon's version. active_zones()
+and stimulus_active() answer from it without a round trip, and on_change()
+hands every new state to whoever registered -- a feed of each switch, timed
+by the daemon, whichever client made it. The mirror lives and dies with its
+session: while there is none, reads go to the daemon and a thread keeps
+trying to open one, which starts the mirror again from a fresh snapshot.
 """
 
+import itertools
 import json
 import socket
+import threading
+import time
 
 import syspath  # noqa: F401  (path setup, must precede hardware imports)
 import leds
 
-from matrixd import SOCKET_PATH
+from matrixd import PROTOCOL_VERSION, SESSION_LEASE_S, SOCKET_PATH
 
 # Longer than the daemon's own BLANK_SETTLE pauses, which a flash_begin call
 # blocks on, plus room for the panel write itself.
 TIMEOUT_S = 10.0
 
+# Between attempts to reopen a mirrored session the daemon dropped, doubling
+# from the first to the second.
+RECONNECT_S = (0.5, 30.0)
+
 ZONES = leds.ZONES
 BARRIER_ZONE = leds.BARRIER_ZONE
 
@@ -36,23 +58,283 @@ class MatrixUnavailable(Exception):
     """The daemon could not be reached, or refused the command."""
 
 
+class _Lost(Exception):
+    """The session died. `sent` says whether the request may have arrived."""
+
+    def __init__(self, message, sent):
+        super().__init__(message)
+        self.sent = sent
+
+
+class _Session:
+    """One persistent, pipelined connection to matrixd.
+
+    Any number of threads call() at once. Each request goes out under a send
+    lock with a fresh id; a reader thread hands each reply to whichever call
+    is waiting on its id. When the connection goes, every waiting call fails
+    and the session is dead for good -- the client opens another.
+
+    With `on_state`, the session subscribes to state events: `state` is the
+    newest one seen, and `on_state` is called with each state newer than the
+    last, in version order, from whichever thread saw it first. `on_lost` is
+    called once when the session dies.
+    """
+
+    def __init__(self, path, lease, on_state=None, on_lost=None):
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._sock.settimeout(TIMEOUT_S)
+            self._sock.connect(path)
+            self._sock.sendall((json.dumps({
+                "cmd": "session", "version": PROTOCOL_VERSION, "lease": lease,
+            }) + "\n").encode())
+            buf = b""
+            while b"\n" not in buf:
+                chunk = self._sock.recv(4096)
+                if not chunk:
+                    raise OSError("closed while opening a session")
+                buf += chunk
+            line, self._buf = buf.split(b"\n", 1)
+            reply = json.loads(line)
+        except (OSError, ValueError):
+            self._sock.close()
+            raise
+        if not reply.get("ok") or "session" not in reply:
+            self._sock.close()
+            # A daemon from before sessions answers "unknown command".
+            raise OSError(reply.get("error", "session refused"))
+        self.id = reply["session"]
+        self.lease = float(reply.get("lease", lease))
+        self.alive = True
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._last_sent = time.monotonic()
+        self.state = None
+        self.subscribed = False
+        self._state_cond = threading.Condition()
+        self._on_state = on_state
+        self._on_lost = on_lost
+        self._sock.settimeout(None)
+        threading.Thread(target=self._read, daemon=True).start()
+        threading.Thread(target=self._heartbeat, daemon=True).start()
+        if on_state is not None:
+            try:
+                reply = self.call({"cmd": "subscribe"})
+            except _Lost as exc:
+                raise OSError(str(exc)) from exc
+            # A daemon without state events refuses; the session still works,
+            # there is just nothing to mirror.
+            if reply.get("ok"):
+                self.subscribed = True
+                self._apply(reply["state"])
+
+    def call(self, request, timeout=None):
+        if not self.alive:
+            raise _Lost("session closed", sent=False)
+        request_id = next(self._ids)
+        waiter = [threading.Event(), None]
+        with self._pending_lock:
+            self._pending[request_id] = waiter
+        data = (json.dumps({"id": request_id, **request}) + "\n").encode()
+        try:
+            with self._send_lock:
+                self._sock.sendall(data)
+                self._last_sent = time.monotonic()
+        except OSError as exc:
+            self._fail(exc)
+            raise _Lost(f"send failed: {exc}", sent=False) from exc
+        if not waiter[0].wait(TIMEOUT_S if timeout is None else timeout):
+            # Replies come back in order; one that never came means the
+            # daemon is wedged or the stream is out of step. Neither is
+            # worth keeping.
+            self._fail(OSError("no reply within the timeout"))
+        if waiter[1] is None:
+            raise _Lost("connection lost awaiting the reply", sent=True)
+        return waiter[1]
+
+    def _read(self):
+        buf = self._buf
+        try:
+            while True:
+                while b"\n" not in buf:
+                    chunk = self._sock.recv(65536)
+                    if not chunk:
+                        raise OSError("matrixd closed the session")
+                    buf += chunk
+                line, buf = buf.split(b"\n", 1)
+                reply = json.loads(line)
+                if reply.get("event") == "state":
+                    self._apply(reply)
+                    continue
+                with self._pending_lock:
+                    waiter = self._pending.pop(reply.get("id"), None)
+                if waiter is not None:
+                    waiter[1] = reply
+                    waiter[0].set()
+        except (OSError, ValueError) as exc:
+            self._fail(exc)
+
+    def _apply(self, state):
+        with self._state_cond:
+            if self.state is not None and state["version"] <= self.state["version"]:
+                return
+            self.state = state
+            self._state_cond.notify_all()
+            if self._on_state is not None:
+                try:
+                    self._on_state(state)
+                except Exception as exc:  # noqa: BLE001 -- a listener must not kill the reader
+                    print(f"matrix state listener failed: {exc}")
+
+    def wait_version(self, version, timeout=TIMEOUT_S):
+        """Block until the mirror has reached `version` or the session dies."""
+        with self._state_cond:
+            return self._state_cond.wait_for(
+                lambda: not self.alive or (self.state is not None
+                                           and self.state["version"] >= version),
+                timeout=timeout)
+
+    def _heartbeat(self):
+        interval = self.lease / 3
+        while self.alive:
+            time.sleep(max(0.0, self._last_sent + interval - time.monotonic()))
+            if self.alive and time.monotonic() - self._last_sent >= interval:
+                try:
+                    self.call({"cmd": "ping"})
+                except _Lost:
+                    return
+
+    def _fail(self, _exc):
+        was_alive, self.alive = self.alive, False
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        with self._pending_lock:
+            waiting, self._pending = self._pending, {}
+        for waiter in waiting.values():
+            waiter[0].set()
+        with self._state_cond:
+            self._state_cond.notify_all()
+        if was_alive and self._on_lost is not None:
+            self._on_lost()
+
+    def close(self):
+        if self.alive:
+            self._fail(None)
+
+
 class MatrixClient:
     """A leds.Matrix work-alike backed by the daemon.
 
-    One connection per request, matching the daemon. Nothing is cached: the
-    daemon is the single source of truth for panel state, and this process is
-    not the only client -- llm/loop.py drives zones through the same socket
-    while the API is serving. A cached `active_zones` here would go stale the
-    moment the loop acted.
+    One connection per request by default, or with `persistent` one session
+    held open and shared by every thread. The daemon is the single source of
+    truth for panel state, and this process is not the only client --
+    llm/loop.py drives zones through the same socket while the API is
+    serving -- so nothing is remembered here on its own say-so. A persistent
+    client mirrors the daemon's state from its events instead (unless
+    `mirror=False`), which is the daemon's truth arriving as it changes. A
+    one-shot client asks every time.
     """
 
-    def __init__(self, path=SOCKET_PATH):
+    def __init__(self, path=SOCKET_PATH, persistent=False, lease=SESSION_LEASE_S,
+                 mirror=None):
         self.path = path
+        self.persistent = persistent
+        self.lease = lease
+        self.mirror = persistent if mirror is None else bool(mirror and persistent)
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._listeners = []
+        self._closing = False
+        # Not _session_lock: a session that dies while it is being opened
+        # reports so with that lock held.
+        self._reconnect_lock = threading.Lock()
+        self._reconnecting = False
         # Fail construction if the daemon is not there, so callers get the same
         # "matrix is None" signal they already handle for a missing panel.
         self._call("ping")
 
+    def _connected(self):
+        with self._session_lock:
+            if self._session is None or not self._session.alive:
+                try:
+                    if self.mirror:
+                        self._session = _Session(self.path, self.lease,
+                                                 on_state=self._changed,
+                                                 on_lost=self._lost)
+                    else:
+                        self._session = _Session(self.path, self.lease)
+                except (OSError, ValueError) as exc:
+                    self._session = None
+                    raise MatrixUnavailable(f"matrixd at {self.path}: {exc}") from exc
+            return self._session
+
+    def _changed(self, state):
+        for callback in list(self._listeners):
+            try:
+                callback(state)
+            except Exception as exc:  # noqa: BLE001 -- one listener must not stop the rest
+                print(f"matrix state listener failed: {exc}")
+
+    def _lost(self):
+        """The mirrored session died: reopen it in the background."""
+        with self._reconnect_lock:
+            if self._closing or self._reconnecting:
+                return
+            self._reconnecting = True
+        threading.Thread(target=self._reconnect, daemon=True).start()
+
+    def _reconnect(self):
+        delay = RECONNECT_S[0]
+        try:
+            while not self._closing:
+                try:
+                    self._connected()
+                    return
+                except MatrixUnavailable:
+                    time.sleep(delay)
+                    delay = min(delay * 2, RECONNECT_S[1])
+        finally:
+            self._reconnecting = False
+
+    def _mirrored(self):
+        """The mirrored state, or None if there is no live subscription."""
+        session = self._session
+        if session is not None and session.alive and session.subscribed:
+            return session.state
+        return None
+
     def _call(self, cmd, **kwargs):
+        if not self.persistent:
+            reply = self._call_once(cmd, **kwargs)
+        else:
+            reply = self._call_session({"cmd": cmd, **kwargs})
+        if not reply.get("ok"):
+            raise MatrixUnavailable(reply.get("error", "unknown error"))
+        return reply
+
+    def _call_session(self, request):
+        for attempt in range(2):
+            session = self._connected()
+            try:
+                reply = session.call(request)
+            except _Lost as exc:
+                # One that never reached the daemon -- typically a session it
+                # dropped while this one was idle -- is safe to send again.
+                if exc.sent or attempt:
+                    raise MatrixUnavailable(f"matrixd at {self.path}: {exc}") from exc
+                continue
+            if session.subscribed and "version" in reply:
+                # The event for this change may still be behind the reply.
+                # Wait for it, so a read after this write sees the write.
+                session.wait_version(reply["version"])
+            return reply
+
+    def _call_once(self, cmd, **kwargs):
         request = json.dumps({"cmd": cmd, **kwargs}) + "\n"
         try:
             with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
@@ -72,28 +354,74 @@ class MatrixClient:
         if not buf.strip():
             raise MatrixUnavailable("matrixd closed the connection without replying")
         try:
-            reply = json.loads(buf.strip())
+            return json.loads(buf.strip())
         except ValueError as exc:
             raise MatrixUnavailable(f"malformed reply from matrixd: {exc}") from exc
 
-        if not reply.get("ok"):
-            raise MatrixUnavailable(reply.get("error", "unknown error"))
-        return reply
-
     # --- the leds.Matrix surface -------------------------------------------
 
     def set_zone(self, zone, intensity):
         self._call("set_zone", zone=zone, intensity=intensity)
 
+    def set_frame(self, levels):
+        """Every drivable zone at once; see leds.frame_levels for `levels`."""
+        if isinstance(levels, dict):
+            levels = {str(z): v for z, v in levels.items()}
+        self._call("set_frame", levels=levels)
+
+    def play(self, frames):
+        """Hand matrixd [(seconds from now, levels), ...] and return at once.
+
+        Unlike leds.Matrix.play this does not block: the daemon keeps the
+        time, and the sequence runs to its end whatever becomes of this
+        process, unless another drive command ends it first.
+        """
+        frames = [[offset, {str(z): v for z, v in levels.items()}
+                   if isinstance(levels, dict) else levels]
+                  for offset, levels in frames]
+        self._call("play", frames=frames)
+
     def clear_stimulus(self):
         self._call("clear_stimulus")
 
     def active_zones(self):
-        return {int(z): v for z, v in self._call("active_zones")["zones"].items()}
+        state = self._mirrored()
+        zones = state["zones"] if state is not None else self._call("active_zones")["zones"]
+        return {int(z): v for z, v in zones.items()}
 
     def stimulus_active(self):
+        state = self._mirrored()
+        if state is not None:
+            return state["active"]
         return self._call("stimulus_active")["active"]
 
+    def state(self):
+        """The daemon's state event: version, zones, flashing, last change."""
+        state = self._mirrored()
+        return state if state is not None else self._call("state")["state"]
+
+    def on_change(self, callback):
+        """Call `callback(state)` with every new panel state, from now on.
+
+        Needs a mirroring client. Called at once with the current state if
+        there is one, then from the session's reader thread: it must be quick
+        and must not call back into this client, whose replies that thread
+        is the one to read. After a reconnect it is called with the new
+        session's snapshot, whose version restarts if the daemon did.
+        """
+        if not self.mirror:
+            raise ValueError("on_change needs a persistent, mirroring client")
+        session = self._session
+        if session is None or not session.subscribed:
+            self._listeners.append(callback)
+            return
+        # Under the session's state lock, so no event slips in between the
+        # current state and the first one delivered.
+        with session._state_cond:
+            self._listeners.append(callback)
+            if session.alive and session.state is not None:
+                callback(session.state)
+
     def capture_flash(self, exposure):
         """Blue off -> red on -> expose -> red off -> blue restored.
 
@@ -118,17 +446,28 @@ class MatrixClient:
     def off(self):
         self._call("off")
 
+    def close(self):
+        """Drop the session, if any, and stop reopening it in the background."""
+        with self._session_lock:
+            self._closing = True
+            if self._session is not None:
+                self._session.close()
+                self._session = None
 
-def open_matrix(allow_direct=True):
+
+def open_matrix(allow_direct=True, persistent=False):
     """(matrix, error). Prefers the daemon, falls back to the panel directly.
 
     The fallback exists for the standalone tools, which are run with sudo and
     may be used when the daemon is stopped. The API never takes it: it is not
     root, so leds.Matrix() would fail anyway, and it should not be the thing
     that owns the panel even if it could.
+
+    `persistent` holds one session to the daemon instead of connecting per
+    request; for the long-running services, not the one-off tools.
     """
     try:
-        return MatrixClient(), None
+        return MatrixClient(persistent=persistent), None
     except MatrixUnavailable as exc:
         daemon_error = exc
 
@@ -4,7 +4,7 @@
 WS2812B panel must be root. The API must not be: it is a Flask app reachable
 from the public internet through nginx. This daemon is the seam between those
 two facts. It is the only thing that runs privileged, it speaks a fixed
-vocabulary of nine commands, and it never evaluates anything a client sends.
+vocabulary of fourteen commands, and it never evaluates anything a client sends.
 
     sudo python3 gpio/matrixd.py            # run in the foreground
     sudo systemctl start sllm-matrixd       # or as the service
@@ -18,9 +18,52 @@ Protocol: newline-delimited JSON, one request per connection.
     <- {"ok": true}
     <- {"ok": false, "error": "zone 2 is the barrier and is not drivable"}
 
-One request per connection is deliberate. A persistent connection would save a
-few hundred microseconds and cost the ability to reason about what happens when
-a client dies holding it, which for this device means leaving the panel lit.
+One request per connection was deliberate, and is still what the standalone
+tools speak: what happens when a client dies holding a connection is easy to
+reason about when there is nothing to hold. The API and the loop, though, are
+long-lived and ask often, and a connect, accept and thread per question is
+most of what each question costs. So a connection may instead open a session:
+
+    -> {"cmd": "session", "version": 2, "lease": 30}
+    <- {"ok": true, "session": 7, "lease": 30, "version": 2}
+    -> {"id": 1, "cmd": "stimulus_active"}
+    -> {"id": 2, "cmd": "set_zone", "zone": 4, "intensity": 0.8}
+    <- {"ok": true, "id": 1, "active": false}
+    <- {"ok": true, "id": 2}
+
+after which it stays open for any number of requests, each carrying an `id`
+the reply echoes. Requests may be pipelined -- sent without waiting -- and are
+executed and answered in the order sent. The lease is the reasoning the
+one-shot protocol bought, kept: a session that sends nothing, not even a
+ping, for `lease` seconds is closed, and a session that ends any way at all
+with a flash it began still open has that flash restored there and then,
+without waiting out the watchdog.
+
+## State events
+
+The panel's state -- which zones are lit, and whether a flash is open -- has
+a version that moves every time it changes, whoever changed it: a set_zone
+or clear_stimulus, a flash beginning or ending, the watchdog or a dying
+session restoring. A session may subscribe to it:
+
+    -> {"id": 3, "cmd": "subscribe"}
+    <- {"ok": true, "id": 3, "state": {"version": 41, "zones": {}, ...}}
+    <- {"event": "state", "version": 42, "zones": {"4": 0.8}, "active": true,
+        "flashing": false, "changed": 1754380800.25, "cause": "set_zone",
+        "session": 9}
+
+and is then sent every state from the one it was given onwards, in order,
+each exactly once, as lines with an `event` and no `id`. `changed` is the
+daemon's wall clock at the switch and `session` who made it (null for a
+one-shot client or the daemon itself). The events go out from a thread of
+their own, so one may overtake the reply to the subscribe, or to the command
+that caused it; the version says which is newer. Replies to commands that
+change state carry the version they produced, so a client can tell when its
+mirror has caught up with its own write.
+
+A subscriber that falls SUBSCRIBER_BACKLOG events behind is disconnected
+rather than allowed to hold them: it reconnects, resubscribes, and starts
+again from a snapshot, which costs it nothing it needed.
 
 ## The flash is the whole reason this is not trivial
 
@@ -35,10 +78,47 @@ calls, the panel is left at IMAGING_BRIGHTNESS across all 256 pixels, roughly
 So flash_begin arms a watchdog. If flash_end does not arrive within
 FLASH_TIMEOUT_S the daemon restores the panel by itself. The client losing its
 grip is a survivable event, not a stuck light.
+
+## One loop for the clients, one thread for the panel
+
+Clients are coroutines on a single asyncio loop, so one that stalls mid-line,
+or stops reading its replies, parks its own coroutine and nobody else's. The
+panel is driven from one thread, PanelExecutor, which takes work in priority
+order: SAFETY commands (clear_stimulus, flash_end, off, restoring after a
+session) go ahead of ROUTINE ones (set_zone, flash_begin) already waiting.
+Queries (ping, active_zones, stimulus_active, state) never queue at all:
+they read the state under a lock that is never held across a settle sleep,
+so they are answered in the middle of a flash_begin. ping reports the queue
+depth and per-command latency, receipt to reply.
+
+## Frames and sequences
+
+set_frame sets every drivable zone in one render and one show(), where
+clear_stimulus then set_zone is two frames and two switching edges:
+
+    -> {"cmd": "set_frame", "levels": {"4": 0.8}}
+    -> {"cmd": "set_frame", "levels": [0, 0, null, 0, 0.8, 0, 0, 0, 0]}
+
+play hands the daemon a schedule of frames, seconds from receipt, and
+returns at once; the panel thread puts each up at its time:
+
+    -> {"cmd": "play", "frames": [[0, {"4": 1}], [30, {"4": 1, "5": 1}], [60, {}]]}
+
+A pattern is then one call and one edge per transition, and its timing is
+the daemon's, not a client's timer thread. Any other drive command -- a
+set_zone, set_frame, clear_stimulus, off, or another play -- ends a running
+sequence. A frame that falls due during a flash is applied to the state but
+not the panel, which the flash_end renders; it never lights blue into an
+exposure.
 """
 
+import asyncio
+import concurrent.futures
+import heapq
+import itertools
 import json
 import os
+import queue
 import signal
 import socket
 import sys
@@ -72,6 +152,16 @@ FLASH_TIMEOUT_S = 15.0
 
 RECV_LIMIT = 64 * 1024  # a request is a few dozen bytes; this is a sanity cap
 
+PROTOCOL_VERSION = 2
+# Seconds of silence after which a session is dropped, when the client does
+# not ask for its own. Clients ping at a third of it while idle.
+SESSION_LEASE_S = 30.0
+SESSION_LEASE_RANGE = (1.0, 300.0)
+
+# State events queued for one subscriber before it is cut off as not reading.
+# The panel changes a few times a turn; this many unread is a stuck client.
+SUBSCRIBER_BACKLOG = 256
+
 # How often the panel is re-sent its current frame.
 #
 # leds.Matrix only writes on a state change, which during a live run is once
@@ -88,13 +178,129 @@ RECV_LIMIT = 64 * 1024  # a request is a few dozen bytes; this is a sanity cap
 # more. Set to 0 to disable the refresh entirely.
 REFRESH_INTERVAL_S = 2.0
 
+# PanelExecutor priorities, lower first. SAFETY puts light out or back.
+SAFETY = 0
+ROUTINE = 1
+
+# Bounds on one play: a stimulus pattern, not a show.
+SEQUENCE_MAX_FRAMES = 1000
+SEQUENCE_MAX_S = 3600.0
+
+
+def _wake():
+    pass
+
+
+class PanelExecutor:
+    """The one thread that writes to the panel, taking work by priority.
+
+    Work is queued as (priority, arrival) and run one item at a time, so no
+    two writes ever interleave and nothing else needs to hold a lock across
+    one -- flash_begin's settle sleeps included. SAFETY work goes ahead of
+    everything ROUTINE already waiting. `tick` is run between items at most
+    every `interval` seconds, and every `interval` when idle: the watchdog
+    and refresh live there, so they too are serialised with every write.
+    submit_at() holds work back until a monotonic time, then queues it at
+    its priority like any other.
+    """
+
+    def __init__(self, tick=None, interval=0.25):
+        self._queue = queue.PriorityQueue()
+        self._arrivals = itertools.count()
+        self._tick = tick
+        self._interval = interval
+        # (when, arrival, priority, fn, args, future), soonest first.
+        self._timed = []
+        self._timed_lock = threading.Lock()
+        self.max_depth = 0
+        self.max_wait = 0.0
+        self.done = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, priority, fn, *args):
+        """Queue `fn(*args)`; returns a concurrent.futures.Future."""
+        future = concurrent.futures.Future()
+        self._queue.put((priority, next(self._arrivals), time.perf_counter(),
+                         fn, args, future))
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return future
+
+    def submit_at(self, when, priority, fn, *args):
+        """Queue `fn(*args)` at time.monotonic() `when`; returns a Future."""
+        future = concurrent.futures.Future()
+        with self._timed_lock:
+            heapq.heappush(self._timed, (when, next(self._arrivals), priority,
+                                         fn, args, future))
+        # Wake the thread to shorten its wait, if this is sooner than it knows.
+        self._queue.put((-2, next(self._arrivals), 0.0, _wake, (), None))
+        return future
+
+    def _release_due(self):
+        """Move timed work that has come due to the queue; the next due time."""
+        now = time.monotonic()
+        with self._timed_lock:
+            while self._timed and self._timed[0][0] <= now:
+                when, arrival, priority, fn, args, future = heapq.heappop(self._timed)
+                self._queue.put((priority, arrival, time.perf_counter(), fn, args, future))
+            return self._timed[0][0] if self._timed else None
+
+    def call(self, priority, fn, *args):
+        """Run `fn(*args)` on the panel thread and wait for it."""
+        return self.submit(priority, fn, *args).result()
+
+    def _run(self):
+        next_tick = time.monotonic() + self._interval
+        while True:
+            due = self._release_due()
+            wake = next_tick if due is None else min(next_tick, due)
+            try:
+                item = self._queue.get(timeout=max(0.0, wake - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                _, _, queued, fn, args, future = item
+                if fn is None:
+                    return
+                if future is None:
+                    continue  # a wake-up from submit_at
+                self.max_wait = max(self.max_wait, time.perf_counter() - queued)
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args))
+                    except BaseException as exc:  # noqa: BLE001 -- the caller gets it
+                        future.set_exception(exc)
+                self.done += 1
+            if self._tick is not None and time.monotonic() >= next_tick:
+                next_tick = time.monotonic() + self._interval
+                try:
+                    self._tick()
+                except Exception as exc:  # noqa: BLE001 -- must not kill the thread
+                    print(f"panel tick failed: {exc}", flush=True)
+
+    def stop(self):
+        """Stop after the item in hand; whatever is still queued is dropped."""
+        self._queue.put((-1, next(self._arrivals), 0.0, None, (), None))
+        self._thread.join(timeout=5)
+
+    def status(self):
+        return {
+            "depth": self._queue.qsize(),
+            "scheduled": len(self._timed),
+            "max_depth": self.max_depth,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "done": self.done,
+        }
+
 
 class MatrixService:
-    """The panel plus the flash state machine. All access is serialised.
+    """The panel, the flash state machine, and the state clients see.
 
-    One lock over every panel operation. The device is a single chain of 256
-    pixels with brightness as global state -- two writers interleaving would
-    produce a frame that is neither of their intentions.
+    Every panel write runs on `executor`'s thread, through the methods below
+    that it is handed; nothing else touches self._matrix but to read. The
+    lock is only over the state those reads see, so it is held for a frame
+    write at most and never across a settle sleep: a query never waits for
+    the panel.
     """
 
     def __init__(self):
@@ -103,103 +309,230 @@ class MatrixService:
         self._flashing = False
         self._flash_deadline = 0.0
         self._flash_expired = False
-        self._stop = threading.Event()
-        self._watchdog = threading.Thread(target=self._watch, daemon=True)
-        self._watchdog.start()
+        # The session that began the open flash; None for one-shot clients,
+        # whose flash only the watchdog can recover.
+        self._flash_owner = None
+        # What clients see of the panel, versioned. _key is the state the
+        # version was last moved for; subscribers are called, under the lock,
+        # with each new state and must not block.
+        self._version = 0
+        self._key = None
+        self._change = {"changed": time.time(), "cause": "start", "session": None}
+        self._subscribers = []
+        self._note("start")
+        # The running play's token; anything else that drives the zones
+        # replaces it, and its remaining frames find they are not current.
+        self._sequence = None
+        # {command: [count, total seconds, worst seconds]}, receipt to reply.
+        self._latency = {}
+        self._last_refresh = 0.0
+        self.executor = PanelExecutor(tick=self._tick)
 
     # --- flash watchdog -----------------------------------------------------
 
-    def _watch(self):
+    def _tick(self):
         """Restore the panel if a flash outlives its client, and refresh it.
 
         Two jobs on one timer because both are "put the panel back the way it
-        should be", and a second thread would need the same lock anyway.
+        should be". Run by the executor between panel operations, so neither
+        can land inside one.
 
         The refresh never runs during a flash. Mid-flash the panel is red at
         IMAGING_BRIGHTNESS and `_render` would repaint it blue, blanking the
         backlight in the middle of somebody's exposure.
         """
-        last_refresh = 0.0
-        while not self._stop.wait(0.25):
+        if self._flashing:
+            if time.monotonic() < self._flash_deadline:
+                return
             with self._lock:
-                if self._flashing:
-                    if time.monotonic() < self._flash_deadline:
-                        continue
-                    # Do not call _end_flash's bookkeeping twice; restore and mark.
-                    self._flashing = False
-                    self._flash_expired = True
-                    try:
-                        self._matrix._render()
-                    except Exception as exc:  # noqa: BLE001 -- must not kill the thread
-                        print(f"flash watchdog restore failed: {exc}", flush=True)
-                    else:
-                        print(
-                            f"flash watchdog fired after {FLASH_TIMEOUT_S}s; "
-                            "panel restored without a flash_end",
-                            flush=True,
-                        )
-                    last_refresh = time.monotonic()
-                    continue
-
-                if REFRESH_INTERVAL_S <= 0:
-                    continue
-                now = time.monotonic()
-                if now - last_refresh < REFRESH_INTERVAL_S:
-                    continue
-                last_refresh = now
+                # Do not call _end_flash's bookkeeping twice; restore and mark.
+                self._flashing = False
+                self._flash_expired = True
+                self._note("watchdog")
                 try:
                     self._matrix._render()
                 except Exception as exc:  # noqa: BLE001 -- must not kill the thread
-                    # Not fatal and not worth a line every two seconds; the next
-                    # tick tries again. A permanently broken panel shows up as a
-                    # failing set_zone, which the client already reports.
-                    print(f"panel refresh failed: {exc}", flush=True)
+                    print(f"flash watchdog restore failed: {exc}", flush=True)
+                else:
+                    print(
+                        f"flash watchdog fired after {FLASH_TIMEOUT_S}s; "
+                        "panel restored without a flash_end",
+                        flush=True,
+                    )
+            self._last_refresh = time.monotonic()
+            return
 
-    # --- commands -----------------------------------------------------------
+        if REFRESH_INTERVAL_S <= 0:
+            return
+        now = time.monotonic()
+        if now - self._last_refresh < REFRESH_INTERVAL_S:
+            return
+        self._last_refresh = now
+        try:
+            with self._lock:
+                self._matrix._render()
+        except Exception as exc:  # noqa: BLE001 -- must not kill the thread
+            # Not fatal and not worth a line every two seconds; the next
+            # tick tries again. A permanently broken panel shows up as a
+            # failing set_zone, which the client already reports.
+            print(f"panel refresh failed: {exc}", flush=True)
+
+    # --- state and subscribers ---------------------------------------------
+
+    def _state(self):
+        zones = self._matrix.active_zones()
+        return {
+            "version": self._version,
+            # JSON object keys must be strings; the client casts them back.
+            "zones": {str(z): v for z, v in zones.items()},
+            "active": bool(zones),
+            "flashing": self._flashing,
+            **self._change,
+        }
 
-    def ping(self):
-        return {"zones": leds.ZONES, "barrier": leds.BARRIER_ZONE}
+    def _note(self, cause, owner=None, force=False):
+        """Move the version if the state changed, and tell the subscribers.
 
-    def set_zone(self, zone, intensity):
+        Called with the lock held, after the change. A set_zone to the level a
+        zone already has is not a change and moves nothing.
+        """
+        key = (tuple(sorted(self._matrix.active_zones().items())), self._flashing)
+        if key == self._key and not force:
+            return
+        self._key = key
+        self._version += 1
+        self._change = {"changed": time.time(), "cause": cause, "session": owner}
+        event = {"event": "state", **self._state()}
+        for push in self._subscribers:
+            push(event)
+
+    def subscribe(self, push):
+        """Call `push` with every state after the one returned."""
         with self._lock:
-            self._matrix.set_zone(int(zone), float(intensity))
-        return {}
+            self._subscribers.append(push)
+            return self._state()
 
-    def clear_stimulus(self):
+    def unsubscribe(self, push):
         with self._lock:
-            self._matrix.clear_stimulus()
-        return {}
+            if push in self._subscribers:
+                self._subscribers.remove(push)
+
+    def record(self, cmd, seconds):
+        with self._lock:
+            entry = self._latency.setdefault(cmd, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+
+    # --- queries: any thread, never queued ---------------------------------
+
+    def ping(self):
+        with self._lock:
+            latency = {
+                cmd: {"n": n, "mean_ms": round(total / n * 1000, 3),
+                      "max_ms": round(worst * 1000, 3)}
+                for cmd, (n, total, worst) in self._latency.items()
+            }
+        return {"zones": leds.ZONES, "barrier": leds.BARRIER_ZONE,
+                "queue": self.executor.status(), "latency": latency}
 
     def active_zones(self):
         with self._lock:
             # JSON object keys must be strings; the client casts them back.
-            return {"zones": {str(z): v for z, v in self._matrix.active_zones().items()}}
+            return {"zones": {str(z): v for z, v in self._matrix.active_zones().items()},
+                    "version": self._version}
 
     def stimulus_active(self):
         with self._lock:
-            return {"active": self._matrix.stimulus_active()}
+            return {"active": self._matrix.stimulus_active(), "version": self._version}
+
+    def state(self):
+        with self._lock:
+            return {"state": self._state()}
+
+    # --- panel operations: the executor's thread only ----------------------
+
+    def set_zone(self, zone, intensity, owner=None):
+        with self._lock:
+            self._matrix.set_zone(int(zone), float(intensity))
+            self._sequence = None
+            self._note("set_zone", owner)
+            return {"version": self._version}
 
-    def flash_begin(self):
+    def set_frame(self, levels, owner=None):
+        with self._lock:
+            self._matrix.set_frame(levels)
+            self._sequence = None
+            self._note("set_frame", owner)
+            return {"version": self._version}
+
+    def play(self, frames, owner=None):
+        """Schedule [[seconds from now, levels], ...]; every frame checked first."""
+        if not isinstance(frames, list) or not frames:
+            raise ValueError("frames must be a non-empty list of [seconds, levels]")
+        if len(frames) > SEQUENCE_MAX_FRAMES:
+            raise ValueError(f"at most {SEQUENCE_MAX_FRAMES} frames")
+        schedule = []
+        for entry in frames:
+            try:
+                offset, levels = entry
+                offset = float(offset)
+            except (TypeError, ValueError):
+                raise ValueError("each frame is [seconds, levels]") from None
+            if not 0.0 <= offset <= SEQUENCE_MAX_S:
+                raise ValueError(f"frame time {offset} outside 0..{SEQUENCE_MAX_S:g}s")
+            if schedule and offset < schedule[-1][0]:
+                raise ValueError("frame times must not go backwards")
+            schedule.append((offset, leds.frame_levels(levels)))
+        token = object()
+        start = time.monotonic()
+        with self._lock:
+            self._sequence = token
+            for offset, levels in schedule:
+                self.executor.submit_at(start + offset, ROUTINE,
+                                        self._play_frame, token, levels, owner)
+            return {"version": self._version, "frames": len(schedule),
+                    "seconds": schedule[-1][0]}
+
+    def _play_frame(self, token, levels, owner):
+        with self._lock:
+            if self._sequence is not token:
+                return
+            # Mid-flash the panel is the backlight: the state moves on, the
+            # panel catches up when flash_end renders it.
+            self._matrix.set_frame(levels, render=not self._flashing)
+            self._note("play", owner)
+
+    def clear_stimulus(self, owner=None):
+        with self._lock:
+            self._matrix.clear_stimulus()
+            self._sequence = None
+            self._note("clear_stimulus", owner)
+            return {"version": self._version}
+
+    def flash_begin(self, owner=None):
         """Blue off, red on, and start the clock. The client exposes next."""
+        if self._flashing:
+            raise RuntimeError("a flash is already open")
+        # Queries go on being answered through the settle sleeps: the state
+        # they see is unchanged until the flash is open.
         with self._lock:
-            if self._flashing:
-                raise RuntimeError("a flash is already open")
-            px = self._matrix._px
-            px.fill((0, 0, 0))
-            px.show()
-            time.sleep(leds.BLANK_SETTLE)
+            self._matrix._show(leds.DARK)
+        time.sleep(leds.BLANK_SETTLE)
 
-            px.brightness = leds.IMAGING_BRIGHTNESS
-            px.fill((255, 0, 0))
-            px.show()
-            time.sleep(leds.BLANK_SETTLE)
+        with self._lock:
+            self._matrix._show(leds.RED, leds.IMAGING_BRIGHTNESS)
+        time.sleep(leds.BLANK_SETTLE)
 
+        with self._lock:
             self._flashing = True
+            self._flash_owner = owner
             self._flash_expired = False
             self._flash_deadline = time.monotonic() + FLASH_TIMEOUT_S
-        return {"timeout": FLASH_TIMEOUT_S}
+            self._note("flash_begin", owner)
+            return {"timeout": FLASH_TIMEOUT_S, "version": self._version}
 
-    def flash_end(self):
+    def flash_end(self, owner=None):
         """Red off, blue restored. Safe to call after the watchdog beat us."""
         with self._lock:
             expired = self._flash_expired
@@ -207,103 +540,311 @@ class MatrixService:
             if not self._flashing:
                 # Either the watchdog already restored, or this is a stray call.
                 # Both are harmless; report which so the client can log it.
-                return {"expired": expired}
+                return {"expired": expired, "version": self._version}
+            self._matrix._show(leds.DARK)
+        time.sleep(leds.BLANK_SETTLE)
+        with self._lock:
             self._flashing = False
-            px = self._matrix._px
-            px.fill((0, 0, 0))
-            px.show()
-            time.sleep(leds.BLANK_SETTLE)
             self._matrix._render()
-        return {"expired": False}
+            self._note("flash_end", owner)
+            return {"expired": False, "version": self._version}
 
-    def off(self):
+    def release(self, owner):
+        """A session ended. Restore at once if it left its flash open."""
+        if not self._flashing or self._flash_owner != owner:
+            return
+        with self._lock:
+            self._flashing = False
+            self._flash_expired = True
+            self._note("session_end", owner)
+        try:
+            self._matrix._show(leds.DARK)
+            time.sleep(leds.BLANK_SETTLE)
+            with self._lock:
+                self._matrix._render()
+        except Exception as exc:  # noqa: BLE001 -- the watchdog is not needed now, but log
+            print(f"session {owner} restore failed: {exc}", flush=True)
+        else:
+            print(f"session {owner} ended inside a flash; panel restored",
+                  flush=True)
+
+    def off(self, owner=None):
         with self._lock:
             self._flashing = False
+            self._sequence = None
             self._matrix.off()
-        return {}
+            # The zones keep their levels, but nothing is lit: always an event.
+            self._note("off", owner, force=True)
+            return {"version": self._version}
 
     def shutdown(self):
-        self._stop.set()
         try:
-            self.off()
+            self.executor.call(SAFETY, self.off)
         except Exception as exc:  # noqa: BLE001
             print(f"shutdown: could not blank the panel: {exc}", flush=True)
+        self.executor.stop()
 
 
+# Each is (priority, handler); a handler takes the service, the request and
+# the session that sent it (None for a one-shot connection). Priority None is
+# a query: it only reads state, and is answered on the spot without queueing.
+# The rest are panel operations, queued for the executor -- SAFETY ones, which
+# put light out or back, ahead of any ROUTINE one waiting.
 COMMANDS = {
-    "ping": lambda svc, req: svc.ping(),
-    "set_zone": lambda svc, req: svc.set_zone(req["zone"], req["intensity"]),
-    "clear_stimulus": lambda svc, req: svc.clear_stimulus(),
-    "active_zones": lambda svc, req: svc.active_zones(),
-    "stimulus_active": lambda svc, req: svc.stimulus_active(),
-    "flash_begin": lambda svc, req: svc.flash_begin(),
-    "flash_end": lambda svc, req: svc.flash_end(),
-    "off": lambda svc, req: svc.off(),
+    "ping": (None, lambda svc, req, owner: svc.ping()),
+    "active_zones": (None, lambda svc, req, owner: svc.active_zones()),
+    "stimulus_active": (None, lambda svc, req, owner: svc.stimulus_active()),
+    "state": (None, lambda svc, req, owner: svc.state()),
+    "set_zone": (ROUTINE, lambda svc, req, owner: svc.set_zone(req["zone"],
+                                                               req["intensity"], owner)),
+    "set_frame": (ROUTINE, lambda svc, req, owner: svc.set_frame(req["levels"], owner)),
+    "play": (ROUTINE, lambda svc, req, owner: svc.play(req["frames"], owner)),
+    "flash_begin": (ROUTINE, lambda svc, req, owner: svc.flash_begin(owner)),
+    "clear_stimulus": (SAFETY, lambda svc, req, owner: svc.clear_stimulus(owner)),
+    "flash_end": (SAFETY, lambda svc, req, owner: svc.flash_end(owner)),
+    "off": (SAFETY, lambda svc, req, owner: svc.off(owner)),
 }
 
+TOO_LARGE = {"ok": False, "error": "request too large"}
 
-def handle(svc, conn):
-    """One request, one response, then close."""
+
+async def dispatch(svc, raw, owner=None, commands=COMMANDS):
+    """One request line -> its reply. Never raises; every failure is a reply."""
+    started = time.perf_counter()
+    request_id = None
+    known = None
     try:
-        conn.settimeout(10.0)
-        buf = b""
-        oversized = False
-        while b"\n" not in buf:
-            chunk = conn.recv(4096)
-            if not chunk:
-                break
-            buf += chunk
-            if len(buf) > RECV_LIMIT:
-                oversized = True
-                break
-        raw = buf.strip()
-        if not raw and not oversized:
+        req = json.loads(raw)
+        if not isinstance(req, dict):
+            raise ValueError("request must be a JSON object")
+        request_id = req.get("id")
+        cmd = req.get("cmd")
+        if not isinstance(cmd, str) or cmd not in commands:
+            raise ValueError(f"unknown command {cmd!r}")
+        known = cmd
+        priority, handler = commands[cmd]
+        if priority is None:
+            result = handler(svc, req, owner)
+        else:
+            result = await asyncio.wrap_future(
+                svc.executor.submit(priority, handler, svc, req, owner))
+        reply = {"ok": True, **result}
+    except Exception as exc:  # noqa: BLE001 -- every failure is a reply
+        reply = {"ok": False, "error": str(exc)}
+    if request_id is not None:
+        reply["id"] = request_id
+    if known is not None:
+        svc.record(known, time.perf_counter() - started)
+    return reply
+
+
+class _Subscriber:
+    """Sends one session its state events, in order.
+
+    push() is called on the panel thread with the service lock held, so it
+    only hands the event to the event loop, which queues it for a task of
+    its own to write. When the queue overflows or a write fails, `hang_up`
+    ends the session: better a client that resyncs than one quietly missing
+    events.
+    """
+
+    def __init__(self, loop, send, hang_up):
+        self._loop = loop
+        self._send = send
+        self._hang_up = hang_up
+        self._queue = asyncio.Queue(SUBSCRIBER_BACKLOG)
+        self._closed = False
+        self._task = loop.create_task(self._run())
+
+    def push(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # the loop has stopped; so has the session
+
+    def _put(self, event):
+        if self._closed:
             return
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            print(f"subscriber {SUBSCRIBER_BACKLOG} events behind; "
+                  "dropping its session", flush=True)
+            self.close()
+            self._hang_up()
+
+    async def _run(self):
+        while True:
+            event = await self._queue.get()
+            try:
+                await self._send(event)
+            except (OSError, asyncio.TimeoutError):
+                self._closed = True
+                self._hang_up()
+                return
+
+    def close(self):
+        self._closed = True
+        self._task.cancel()
+
+
+_session_ids = itertools.count(1)
+
 
+async def serve_session(svc, reader, writer, opening):
+    """Answer requests on one connection until it closes or its lease lapses.
+
+    A session's own requests run strictly in the order sent, each finished
+    before the next is read: priority reorders work between clients, never a
+    client's set_zone and clear_stimulus against each other.
+    """
+    try:
+        lease = float(opening.get("lease", SESSION_LEASE_S))
+    except (TypeError, ValueError):
+        lease = SESSION_LEASE_S
+    lease = min(max(lease, SESSION_LEASE_RANGE[0]), SESSION_LEASE_RANGE[1])
+    session = next(_session_ids)
+
+    async def send(message):
+        writer.write((json.dumps(message) + "\n").encode())
+        # A client that stops reading holds its replies, not the daemon.
+        async with asyncio.timeout(lease):
+            await writer.drain()
+
+    def hang_up():
+        writer.transport.abort()
+
+    subscriber = None
+
+    def subscribe(svc, req, owner):
+        nonlocal subscriber
+        if subscriber is not None:
+            return svc.state()
+        subscriber = _Subscriber(asyncio.get_running_loop(), send, hang_up)
+        return {"state": svc.subscribe(subscriber.push)}
+
+    def unsubscribe(svc, req, owner):
+        nonlocal subscriber
+        if subscriber is not None:
+            svc.unsubscribe(subscriber.push)
+            subscriber.close()
+            subscriber = None
+        return {}
+
+    commands = {**COMMANDS, "subscribe": (None, subscribe),
+                "unsubscribe": (None, unsubscribe)}
+    reply = {"ok": True, "session": session, "lease": lease,
+             "version": PROTOCOL_VERSION}
+    if opening.get("id") is not None:
+        reply["id"] = opening["id"]
+    try:
+        await send(reply)
+        while True:
+            # asyncio.timeout, not wait_for: no task per request.
+            async with asyncio.timeout(lease):
+                raw = await reader.readline()
+            if not raw:
+                break
+            if raw.strip():
+                await send(await dispatch(svc, raw, owner=session, commands=commands))
+    except asyncio.TimeoutError:
+        print(f"session {session}: nothing for {lease:g}s, lease lapsed", flush=True)
+    except ValueError:
+        # StreamReader's way of saying a line outgrew RECV_LIMIT.
         try:
-            if oversized:
-                raise ValueError("request too large")
-            req = json.loads(raw)
-            cmd = req.get("cmd")
-            handler = COMMANDS.get(cmd)
-            if handler is None:
-                raise ValueError(f"unknown command {cmd!r}")
-            reply = {"ok": True, **handler(svc, req)}
-        except Exception as exc:  # noqa: BLE001 -- every failure is a reply
-            reply = {"ok": False, "error": str(exc)}
-
-        conn.sendall((json.dumps(reply) + "\n").encode())
-    except (OSError, socket.timeout):
-        pass  # client vanished; the watchdog covers any open flash
+            await send(TOO_LARGE)
+        except (OSError, asyncio.TimeoutError):
+            pass
+    except OSError:
+        pass
     finally:
+        unsubscribe(svc, None, session)
+        await asyncio.wrap_future(svc.executor.submit(SAFETY, svc.release, session))
+
+
+async def handle(svc, reader, writer):
+    """One request and one response, or a session if the first asks for one."""
+    try:
         try:
-            conn.close()
-        except OSError:
-            pass
+            raw = (await asyncio.wait_for(reader.readline(), 10.0)).strip()
+        except ValueError:
+            writer.write((json.dumps(TOO_LARGE) + "\n").encode())
+            await asyncio.wait_for(writer.drain(), 10.0)
+            return
+        if not raw:
+            return
+        try:
+            opening = json.loads(raw)
+        except ValueError:
+            opening = None
+        if isinstance(opening, dict) and opening.get("cmd") == "session":
+            await serve_session(svc, reader, writer, opening)
+            return
+        writer.write((json.dumps(await dispatch(svc, raw)) + "\n").encode())
+        await asyncio.wait_for(writer.drain(), 10.0)
+    except (OSError, asyncio.TimeoutError):
+        pass  # client vanished; the watchdog covers any open flash
+    finally:
+        writer.close()
 
 
-def bind_socket():
+def bind_socket(path=SOCKET_PATH):
     """Bind the unix socket with the right ownership, replacing any stale one."""
-    directory = os.path.dirname(SOCKET_PATH)
+    directory = os.path.dirname(path)
     os.makedirs(directory, exist_ok=True)
-    if os.path.exists(SOCKET_PATH):
-        os.unlink(SOCKET_PATH)
+    if os.path.exists(path):
+        os.unlink(path)
 
     server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    server.bind(SOCKET_PATH)
-    server.listen(8)
+    server.bind(path)
+    server.listen(64)
 
     import grp
 
     try:
         gid = grp.getgrnam(SOCKET_GROUP).gr_gid
-        os.chown(SOCKET_PATH, 0, gid)
+        os.chown(path, 0, gid)
     except KeyError:
         print(f"! group {SOCKET_GROUP} not found; socket left root-owned", flush=True)
-    os.chmod(SOCKET_PATH, SOCKET_MODE)
+    os.chmod(path, SOCKET_MODE)
     return server
 
 
+async def _serve(svc, server, stopping):
+    connections = {}
+
+    async def connected(reader, writer):
+        connections[asyncio.current_task()] = writer
+        try:
+            await handle(svc, reader, writer)
+        finally:
+            del connections[asyncio.current_task()]
+
+    listener = await asyncio.start_unix_server(
+        # One byte over, so a line of exactly RECV_LIMIT still fits its newline.
+        connected, sock=server, limit=RECV_LIMIT + 1)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, stopping.wait)
+    finally:
+        listener.close()
+        # Hang up on everyone rather than cancel them, so each session ends
+        # the ordinary way and releases what it held.
+        for writer in list(connections.values()):
+            writer.transport.abort()
+        if connections:
+            await asyncio.wait(list(connections), timeout=5)
+
+
+def serve(svc, server, stopping):
+    """Serve every client on one event loop until `stopping` is set.
+
+    Connections are coroutines, not threads: a client that stalls mid-line
+    costs a parked coroutine, and the panel work they ask for queues on
+    svc.executor in priority order.
+    """
+    asyncio.run(_serve(svc, server, stopping))
+
+
 def main():
     if os.geteuid() != 0:
         print("matrixd must run as root: rpi_ws281x needs /dev/mem")
@@ -323,26 +864,12 @@ def main():
 
     def _signal(_sig, _frame):
         stopping.set()
-        try:
-            # Unblock accept() by poking our own socket.
-            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as poke:
-                poke.connect(SOCKET_PATH)
-        except OSError:
-            pass
 
     signal.signal(signal.SIGTERM, _signal)
     signal.signal(signal.SIGINT, _signal)
 
     try:
-        while not stopping.is_set():
-            try:
-                conn, _ = server.accept()
-            except OSError:
-                break
-            if stopping.is_set():
-                conn.close()
-                break
-            threading.Thread(target=handle, args=(svc, conn), daemon=True).start()
+        serve(svc, server, stopping)
     finally:
         print("matrixd stopping; blanking the panel", flush=True)
         svc.shutdown()
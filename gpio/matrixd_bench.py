@@ -0,0 +1,284 @@
+"""Round-trip latency of matrixd, one-shot against a persistent session.
+
+Runs a real MatrixService and the daemon's own accept loop on a scratch
+socket, over the stand-in strip from leds_bench.py, so it needs neither root
+nor a panel. Then, with MatrixClient:
+
+    one-shot     a connection per request, as the standalone tools use
+    session      one persistent session, one request at a time
+    pipelined    the same session shared by several threads at once
+    mirrored     a session subscribed to state events, answering locally
+
+timing `stimulus_active`, the request the API makes most. Then checks that
+a mirrored client hears another client's switches, in version order and
+promptly, and sees its own writes at once; that with the settle sleeps of a
+real flash_begin holding the panel thread, a query is still answered at
+once and a clear_stimulus goes ahead of set_zones queued before it; that a
+play puts each frame up on time and is ended by the next drive command; and what
+the lease is for: a session that ends inside a flash gets the panel restored
+at once, and a session that goes silent is closed.
+
+    ./scripts/py gpio/matrixd_bench.py
+    ./scripts/py gpio/matrixd_bench.py --requests 5000 --threads 8
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from leds_bench import install_fakes  # noqa: E402
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]  # noqa: E731
+    return pick(0.5) * 1e6, pick(0.99) * 1e6
+
+
+def sequential(client, requests):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        client.stimulus_active()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def concurrent(client, requests, threads):
+    per = max(1, requests // threads)
+    samples = [[] for _ in range(threads)]
+    workers = [threading.Thread(target=lambda out: out.extend(sequential(client, per)),
+                                args=(samples[i],)) for i in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    return [s for chunk in samples for s in chunk], per * threads / elapsed
+
+
+def raw_session(path, lease):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(path)
+    sock.sendall((json.dumps({"cmd": "session", "version": 2,
+                              "lease": lease}) + "\n").encode())
+    reader = sock.makefile('rb')
+    reader.readline()
+    return sock, reader
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    install_fakes()
+    import leds
+    import matrixd
+    from matrix_client import MatrixClient
+
+    leds.BLANK_SETTLE = 0
+    directory = tempfile.mkdtemp(prefix='matrixd_bench_')
+    path = os.path.join(directory, 'matrix.sock')
+    svc = matrixd.MatrixService()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen(64)
+    stopping = threading.Event()
+    serving = threading.Thread(target=matrixd.serve, args=(svc, server, stopping),
+                               daemon=True)
+    serving.start()
+
+    ok = True
+    try:
+        one_shot = MatrixClient(path)
+        session = MatrixClient(path, persistent=True, mirror=False)
+        mirrored = MatrixClient(path, persistent=True)
+        for client in (one_shot, session, mirrored):
+            sequential(client, 50)  # warm
+
+        print(f"{args.requests} x stimulus_active\n")
+        print(f"  {'mode':<22} {'p50 us':>8} {'p99 us':>8} {'req/s':>9}")
+        for label, client in (('one-shot', one_shot), ('session', session),
+                              ('mirrored', mirrored)):
+            started = time.perf_counter()
+            samples = sequential(client, args.requests)
+            rate = args.requests / (time.perf_counter() - started)
+            p50, p99 = percentiles(samples)
+            print(f"  {label:<22} {p50:8.0f} {p99:8.0f} {rate:9.0f}")
+        for label, client in (('one-shot', one_shot), ('session', session)):
+            samples, rate = concurrent(client, args.requests, args.threads)
+            p50, p99 = percentiles(samples)
+            print(f"  {f'{label}, {args.threads} threads':<22} {p50:8.0f} "
+                  f"{p99:8.0f} {rate:9.0f}")
+
+        session.set_zone(4, 0.5)
+        agree = (one_shot.active_zones() == session.active_zones()
+                 == mirrored.active_zones() == {4: 0.5})
+        session.clear_stimulus()
+        ok &= agree
+        print(f"\n  every mode sees the same state: {'yes' if agree else 'NO'}")
+
+        # Another client's switches reach the mirror as events, each version
+        # once and in order, and the mirror's own writes read back at once.
+        heard = []
+        arrived = threading.Event()
+        # Caught up with the clear above first, so only what follows is heard.
+        while mirrored.state()["version"] != one_shot.state()["version"]:
+            time.sleep(0.01)
+        mirrored.on_change(lambda state: (heard.append((time.perf_counter(), state)),
+                                          arrived.set()))
+        lags = []
+        for zone in (0, 1, 3, 4, 5, 6, 7, 8) * 25:
+            arrived.clear()
+            started = time.perf_counter()
+            one_shot.set_zone(zone, 1.0)
+            arrived.wait(1)
+            lags.append(heard[-1][0] - started)
+            one_shot.clear_stimulus()
+        versions = [state["version"] for _, state in heard]
+        ordered = versions == list(range(versions[0], versions[0] + len(versions)))
+        ordered &= len(heard) == 1 + 2 * len(lags)
+        p50, p99 = percentiles(lags)
+        ok &= ordered
+        print(f"  mirror hears another client's {len(lags)} switches, in order: "
+              f"{'yes' if ordered else 'NO'} (set_zone to event p50 {p50:.0f} us, "
+              f"p99 {p99:.0f} us)")
+        mirrored.set_zone(7, 0.25)
+        own = mirrored.active_zones() == {7: 0.25} and mirrored.stimulus_active()
+        mirrored.clear_stimulus()
+        own &= not mirrored.stimulus_active()
+        ok &= own
+        print(f"  mirror reads its own writes: {'yes' if own else 'NO'}")
+
+        # The panel thread busy in a flash_begin, with its real settle sleeps.
+        leds.BLANK_SETTLE = 0.1
+        one_shot.set_zone(0, 1.0)
+        mark = len(heard)
+        flash = threading.Thread(target=one_shot._call, args=("flash_begin",))
+        flash.start()
+        time.sleep(0.03)
+        started = time.perf_counter()
+        session.stimulus_active()
+        query = time.perf_counter() - started
+        queued = [threading.Thread(target=MatrixClient(path).set_zone, args=(z, 1.0))
+                  for z in (1, 3, 5)]
+        for worker in queued:
+            worker.start()
+        time.sleep(0.03)
+        clear = threading.Thread(target=one_shot.clear_stimulus)
+        clear.start()
+        for worker in [flash, clear] + queued:
+            worker.join()
+        one_shot._call("flash_end")
+        leds.BLANK_SETTLE = 0
+        one_shot.clear_stimulus()
+        causes = [state["cause"] for _, state in heard[mark:]]
+        jumped = causes[:2] == ["flash_begin", "clear_stimulus"]
+        answered = query < 0.02
+        ok &= jumped and answered
+        print(f"  query during a flash_begin answered at once: "
+              f"{'yes' if answered else 'NO'} ({query * 1000:.1f} ms)")
+        print(f"  clear_stimulus ahead of set_zones queued before it: "
+              f"{'yes' if jumped else 'NO'} ({', '.join(causes[:5])})")
+        # A sequence: each frame at its time, from the daemon's clock.
+        mark = len(heard)
+        started = time.time()
+        offsets = (0.0, 0.1, 0.2, 0.3)
+        one_shot.play([(offset, {z: 1.0}) for offset, z in zip(offsets, (0, 1, 3, 4))])
+        time.sleep(0.45)
+        played = [state for _, state in heard[mark:] if state["cause"] == "play"]
+        late = [state["changed"] - started - offset
+                for state, offset in zip(played, offsets)]
+        timed_ok = (len(played) == len(offsets) and played[-1]["zones"] == {"4": 1.0}
+                    and max(late) < 0.05)
+        ok &= timed_ok
+        print(f"  play puts {len(offsets)} frames up on time: "
+              f"{'yes' if timed_ok else 'NO'} (worst {max(late or [0]) * 1000:.1f} ms late)")
+        mark = len(heard)
+        one_shot.play([(0.1, {0: 1.0}), (0.2, {1: 1.0})])
+        one_shot.set_frame({8: 0.5})
+        time.sleep(0.3)
+        ended = (mirrored.active_zones() == {8: 0.5}
+                 and not any(s["cause"] == "play" for _, s in heard[mark:]))
+        one_shot.clear_stimulus()
+        ok &= ended
+        print(f"  a set_frame ends the running play: {'yes' if ended else 'NO'}")
+        counters = one_shot._call("ping")
+        print(f"  ping: queue {counters['queue']}")
+        for cmd, entry in sorted(counters["latency"].items()):
+            print(f"        {cmd:<16} {entry}")
+
+        # A session that dies holding a flash: restored on the spot, not after
+        # FLASH_TIMEOUT_S.
+        sock, reader = raw_session(path, 5)
+        sock.sendall(b'{"id": 1, "cmd": "flash_begin"}\n')
+        reader.readline()
+        # The makefile holds the descriptor open; both go, as when a process dies.
+        reader.close()
+        sock.close()
+        deadline = time.monotonic() + 2
+        while svc._flashing and time.monotonic() < deadline:
+            time.sleep(0.01)
+        restored = not svc._flashing
+        ok &= restored
+        print(f"  flash left open by a dead session restored at once: "
+              f"{'yes' if restored else 'NO'}")
+
+        # A session that goes quiet past its lease is closed by the daemon.
+        sock, reader = raw_session(path, 1)
+        started = time.monotonic()
+        closed = reader.readline() == b''
+        waited = time.monotonic() - started
+        closed &= 0.9 < waited < 3
+        ok &= closed
+        print(f"  silent session closed after its 1s lease: "
+              f"{'yes' if closed else 'NO'} ({waited:.1f}s)")
+        reader.close()
+        sock.close()
+
+        # And the pooled client survives its session being dropped; the
+        # mirrored one reopens its own and resyncs without being asked.
+        session._session.close()
+        survived = session.stimulus_active() is False
+        ok &= survived
+        print(f"  client reconnects after losing its session: "
+              f"{'yes' if survived else 'NO'}")
+        before = mirrored._session
+        before.close()
+        one_shot.set_zone(5, 0.75)
+        deadline = time.monotonic() + 3
+        while (mirrored._mirrored() is None or heard[-1][1]["zones"] != {"5": 0.75}) \
+                and time.monotonic() < deadline:
+            time.sleep(0.01)
+        resynced = mirrored._session is not before and heard[-1][1]["zones"] == {"5": 0.75}
+        one_shot.clear_stimulus()
+        ok &= resynced
+        print(f"  mirror resyncs by itself after losing its session: "
+              f"{'yes' if resynced else 'NO'}")
+        session.close()
+        mirrored.close()
+    finally:
+        stopping.set()
+        serving.join(timeout=10)
+        server.close()
+        try:
+            os.unlink(path)
+            os.rmdir(directory)
+        except OSError:
+            pass
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+"""Electrode history over any range, reduced to a chartable number of points.
+
+/api/readings/history only ever had the rolling buffer: 40 minutes, held as
+a dict per sample. The record of a run is in the daily files store.py
+writes, and this reads them for /api/readings/range -- a day, a run, a week --
+and returns at most `max_points` rows however long the range.
+
+The range is cut into `max_points` equal time buckets, and each bucket that
+holds any samples becomes one row:
+
+    [bucket start, samples, ch0 min, ch0 max, ch0 mean, ch1 min, ...]
+
+min and max rather than a single representative sample, so a spike
+narrower than a bucket still reaches the chart as the edge of the band, where
+LTTB-style picking would keep it or drop it depending on its neighbours. The
+mean is the trace. Buckets are fixed in time, not in sample count, so the
+reduction can run a day at a time: each day's samples are folded into the
+buckets as they are read off the binary sidecar, and every bucket that can
+no longer receive samples is written out before the next day is read. Memory
+is one day of samples plus the bucket arrays, whatever the range, and the
+response starts arriving before the last day has been read.
+
+Buckets at least a minute wide are built from the rollups store.py keeps
+(a minute, ten minutes, an hour) rather than from samples: the widest rollup
+no wider than a bucket, summed into it. A week at 1,000 points is ten-minute
+buckets, so 144 records a day are read rather than 86,400 rows. Days without rollups, and today's still-open bucket, fall back to the
+samples. A rollup is placed by its start, so a bucket's edges are accurate
+to the rollup width, which is never more than the bucket's own.
+
+Millivolts, as stored. Ranges short enough that a bucket is narrower than the
+sample interval come back as the raw samples, one per row, min = max = mean.
+
+    ./scripts/py gpio/readings_range.py 2026-08-05 2026-08-08 --points 1000
+"""
+
+import argparse
+import json
+import math
+import pathlib
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+
+from store import ROLLUP_SECONDS
+
+
+def parse_time(value):
+    """Unix seconds, or an ISO 8601 date or datetime (local time if naive)."""
+    try:
+        moment = float(value)
+    except (TypeError, ValueError):
+        try:
+            moment = datetime.fromisoformat(str(value)).timestamp()
+        except ValueError:
+            raise ValueError(f"not a time: {value!r}") from None
+    if not math.isfinite(moment):
+        raise ValueError(f"not a time: {value!r}")
+    return moment
+
+
+class Buckets:
+    """min/max/mean/count per column over fixed time buckets of [start, end)."""
+
+    def __init__(self, start, end, columns, max_points):
+        self.start = start
+        self.columns = list(columns)
+        self.count = max(1, int(max_points))
+        self.width = (end - start) / self.count
+        self.samples = np.zeros(self.count, dtype=np.int64)
+        self.n = {c: np.zeros(self.count, dtype=np.int64) for c in self.columns}
+        self.sum = {c: np.zeros(self.count) for c in self.columns}
+        self.low = {c: np.full(self.count, np.inf) for c in self.columns}
+        self.high = {c: np.full(self.count, -np.inf) for c in self.columns}
+        self.flushed = 0
+        self.late = 0
+
+    def add(self, stamps, rows, stats):
+        """Fold in ReadingLog.summaries() output: rollups or single rows."""
+        if not len(stamps):
+            return
+        # Clipped at the range's start: a rollup that began before it but
+        # overlaps it belongs to the first bucket.
+        index = np.floor(np.maximum(stamps - self.start, 0)
+                         / self.width).astype(np.int64)
+        # Anything for a bucket already written out -- the wall clock stepped
+        # back across a day boundary -- is counted and dropped, not reordered.
+        keep = (index >= self.flushed) & (index < self.count)
+        self.late += int(np.count_nonzero(index < self.flushed))
+        index = index[keep]
+        np.add.at(self.samples, index, rows[keep])
+        for column in self.columns:
+            n, low, high, total = (part[keep] for part in stats[column])
+            present = n > 0
+            at = index[present]
+            np.add.at(self.n[column], at, n[present])
+            np.add.at(self.sum[column], at, total[present])
+            np.minimum.at(self.low[column], at, low[present])
+            np.maximum.at(self.high[column], at, high[present])
+
+    def flush(self, until=None):
+        """Rows for every bucket that ends at or before `until` (all if None)."""
+        if until is None:
+            upto = self.count
+        else:
+            upto = min(self.count, max(self.flushed,
+                                       int((until - self.start) // self.width)))
+        for i in np.flatnonzero(self.samples[self.flushed:upto]) + self.flushed:
+            row = [round(float(self.start + i * self.width), 3),
+                   int(self.samples[i])]
+            for column in self.columns:
+                n = self.n[column][i]
+                if n:
+                    row += [round(float(self.low[column][i]), 4),
+                            round(float(self.high[column][i]), 4),
+                            round(float(self.sum[column][i] / n), 4)]
+                else:
+                    row += [None, None, None]
+            yield row
+        self.flushed = upto
+
+
+def resolution(start, end, max_points):
+    """The rollup width to read for this query, or 0 for raw samples."""
+    width = (end - start) / max(1, int(max_points))
+    return max((s for s in ROLLUP_SECONDS if s <= width), default=0)
+
+
+def decimate(log, start, end, channels, max_points, mode=None):
+    """Yield bucket rows for `channels` of an electrode ReadingLog, in order."""
+    columns = [f'ch{channel}_mv' for channel in channels]
+    buckets = Buckets(start, end, columns, max_points)
+    seconds = resolution(start, end, max_points) if log.rollup_columns else 0
+    if seconds:
+        days = log.summaries(start, end, columns, seconds, mode=mode)
+    else:
+        days = ((stamps, np.ones(len(stamps), dtype=np.int64),
+                 {c: _as_stats(values[c]) for c in columns})
+                for stamps, values in log.span(start, end, columns, mode=mode))
+    for stamps, rows, stats in days:
+        buckets.add(stamps, rows, stats)
+        # Everything before this day's last entry is complete: the next file
+        # is the next UTC day.
+        if len(stamps):
+            yield from buckets.flush(float(np.max(stamps)))
+    yield from buckets.flush()
+
+
+def _as_stats(series):
+    present = ~np.isnan(series)
+    return (present.astype(np.int64), series, series,
+            np.where(present, series, 0.0))
+
+
+def stream_json(log, start, end, channels, max_points, mode=None):
+    """The /api/readings/range body, as an iterable of byte chunks."""
+    columns = ['t', 'n'] + [f'ch{c}_{stat}' for c in channels
+                            for stat in ('min', 'max', 'mean')]
+    head = json.dumps({
+        "start": start,
+        "end": end,
+        "mode": mode,
+        "unit": "mV",
+        "bucket_seconds": round((end - start) / max(1, int(max_points)), 3),
+        # What the buckets were built from: a rollup width, or 0 for samples.
+        "resolution": resolution(start, end, max_points) if log.rollup_columns else 0,
+        "columns": columns,
+    })
+    yield (head[:-1] + ', "points": [').encode('utf-8')
+    count = 0
+    for row in decimate(log, start, end, channels, max_points, mode=mode):
+        yield ((',\n' if count else '\n') + json.dumps(row)).encode('utf-8')
+        count += 1
+    yield f'\n], "count": {count}}}\n'.encode('utf-8')
+
+
+def main():
+    # Config lives beside this module's parent, so the deployed copy at
+    # /var/www/sllm finds its own config rather than the checkout's.
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'api'))
+    import config
+    from store import electrode_log
+
+    p = argparse.ArgumentParser()
+    p.add_argument("start", help="unix seconds or ISO date/time")
+    p.add_argument("end", help="unix seconds or ISO date/time")
+    p.add_argument("--points", type=int, default=1000)
+    p.add_argument("--mode", default=None, help="run mode; default the current")
+    args = p.parse_args()
+
+    start, end = parse_time(args.start), parse_time(args.end)
+    channels = tuple(getattr(config, 'ADC_CHANNELS', (0, 1, 2)))
+    log = electrode_log(config)
+    started = time.perf_counter()
+    rows = list(decimate(log, start, end, channels, args.points, mode=args.mode))
+    elapsed = time.perf_counter() - started
+    samples = sum(row[1] for row in rows)
+    print(f"{samples} samples in {len(rows)} rows of "
+          f"{(end - start) / args.points:.1f}s, {elapsed * 1000:.0f} ms")
+    shown = rows if len(rows) <= 6 else rows[:3] + ['...'] + rows[-3:]
+    for row in shown:
+        print(f"  {row}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -231,10 +231,13 @@ class FanController:
 class EnvironmentMonitor:
     """Background thread: read the sensor, drive the fan, publish the latest."""
 
-    def __init__(self, config, gate=None, log=None):
+    def __init__(self, config, gate=None, log=None, bus=None):
         self.gate = gate or SwitchGate(getattr(config, 'ADC_SWITCH_SETTLE', 0.25))
         self.interval = getattr(config, 'SENSOR_READ_INTERVAL', 1.0)
         self.log = log
+        # An events.EventBus to publish each reading to as 'environment', so the
+        # API pushes it to the dashboard when it changes rather than on a timer.
+        self.bus = bus
         self.latest = {
             "temperature": None,
             "temperature_f": None,
@@ -313,6 +316,11 @@ class EnvironmentMonitor:
         with self._lock:
             self.latest = reading
 
+        # Only readings with values: the dashboard takes any environment
+        # update as data to display, as it did from the old timer.
+        if self.bus is not None and reading["available"]:
+            self.bus.publish('environment', reading)
+
         if self.log is not None:
             try:
                 self.log.append({
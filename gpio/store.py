@@ -17,13 +17,229 @@ One file per UTC day per stream:
 UTC because a run that crosses a daylight-saving boundary would otherwise
 either skip an hour of filenames or write two hours into one, and the whole
 point is that the record is unambiguous afterwards.
+
+Each daily CSV has a sidecar time index beside it, `electrodes_20260805.idx`.
+`recent()` is called every turn and used to parse the whole day to find the
+last half hour of it -- 86,400 rows by midnight, to keep 1,800. The index holds
+one fixed-width record every INDEX_STRIDE_S seconds of readings, so a read
+seeks to just before the cutoff and parses only the window. It is derived data:
+the CSV stays the record, a missing or damaged index only costs the full scan
+it replaced, and it is rebuilt from the CSV whenever the two could disagree.
+
+The electrode log also mirrors its channel columns into a fixed-record binary
+sidecar, `electrodes_20260805.bin`: a float64 timestamp and a float32 per
+channel, appended row for row with the CSV. `window()` memory-maps it and hands
+the reducer arrays without a single string converted. Same rules as the index
+-- derived, rebuilt from the CSV, and never the only copy of anything.
+
+Both logs also keep rollups: per minute, per ten minutes and per hour, one
+fixed record per bucket with the row count and, per column, the count, min,
+max, sum and sum of squares -- mean and standard deviation follow, and
+buckets combine exactly. `electrodes_20260805.r60`, `.r600`, `.r3600`. They
+are written as append() closes each bucket, so a day of 1 Hz samples is 1,440
+minute records to read instead of 86,400 rows, and a week at the hour is 168.
+Again derived: rebuilt from the CSV on every open, like the other sidecars,
+and the bucket still open lives only in the writer until it closes.
+
+    ./scripts/py gpio/store.py backfill     # sidecars for days already on disk
 """
 
 import csv
+import glob
+import io
+import json
 import os
+import pathlib
+import struct
+import sys
 import threading
 from datetime import datetime, timedelta, timezone
 
+import numpy as np
+
+# One index record per this many seconds of readings. At 1 Hz that is 1,440
+# records a day, 23KB, and a read parses at most a minute of rows it then
+# throws away.
+INDEX_STRIDE_S = 60
+
+# (ceiling, offset): every row before byte `offset` of the CSV has a timestamp
+# below `ceiling`. A ceiling rather than the timestamp of the row at `offset`,
+# because the wall clock can step backwards under NTP and a row is not
+# guaranteed to be later than the one before it. Skipping everything before
+# the offset is only safe if nothing before it could be inside the window.
+INDEX_RECORD = struct.Struct('<dQ')
+
+
+def index_path(csv_path):
+    """The sidecar index for a daily CSV."""
+    return os.path.splitext(csv_path)[0] + '.idx'
+
+
+# The binary sidecar opens with this, then a uint32 length and the JSON list of
+# the columns it mirrors, padded to eight bytes. The column list travels with
+# the file because ADC_CHANNELS can change between days, and a reader must not
+# assume today's layout for last week's data.
+BINARY_MAGIC = b'SLLMCOL1'
+
+
+def binary_path(csv_path):
+    """The binary sidecar for a daily CSV."""
+    return os.path.splitext(csv_path)[0] + '.bin'
+
+
+def binary_dtype(columns):
+    """One record: float64 unix time, then float32 per mirrored column.
+
+    float32 is ample for millivolts at the four decimals the CSV carries, and
+    at 1 Hz keeps a day of three channels to 1.7MB.
+    """
+    return np.dtype([('timestamp', '<f8')] + [(name, '<f4') for name in columns])
+
+
+def _binary_header(columns, magic=BINARY_MAGIC):
+    names = json.dumps(list(columns)).encode('utf-8')
+    names += b' ' * (-(len(magic) + 4 + len(names)) % 8)
+    return magic + struct.pack('<I', len(names)) + names
+
+
+def _open_records(path, magic, dtype_for):
+    """(columns, records) for a sidecar opening with `magic`, or None."""
+    try:
+        with open(path, 'rb') as handle:
+            head = handle.read(len(magic) + 4)
+            if len(head) < len(magic) + 4 or head[:len(magic)] != magic:
+                return None
+            (length,) = struct.unpack('<I', head[len(magic):])
+            columns = json.loads(handle.read(length).decode('utf-8'))
+        size = os.path.getsize(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    dtype = dtype_for(columns)
+    offset = len(magic) + 4 + length
+    count = max(0, (size - offset) // dtype.itemsize)
+    if count == 0:
+        return columns, np.zeros(0, dtype=dtype)
+    return columns, np.memmap(path, dtype=dtype, mode='r', offset=offset,
+                              shape=(count,))
+
+
+def open_binary(path):
+    """(columns, records) for a binary sidecar, or None if it is unusable.
+
+    `records` is a read-only memmap of whole records. A writer may be part
+    way through the last one; that partial record is left off the end.
+    """
+    return _open_records(path, BINARY_MAGIC, binary_dtype)
+
+
+# Rollup bucket widths, in seconds. Each divides a day, so a bucket never
+# straddles two daily files.
+ROLLUP_SECONDS = (60, 600, 3600)
+ROLLUP_MAGIC = b'SLLMRUP1'
+
+
+def rollup_path(csv_path, seconds):
+    """The rollup sidecar of one bucket width for a daily CSV."""
+    return f"{os.path.splitext(csv_path)[0]}.r{seconds}"
+
+
+def rollup_dtype(columns):
+    """One bucket: its start, rows in it, then n/min/max/sum/sumsq per column.
+
+    Sums rather than means, so buckets add: an hour is its minutes summed,
+    and a query bucket of any width is the rollups inside it summed.
+    """
+    fields = [('start', '<f8'), ('rows', '<u4')]
+    for column in columns:
+        fields += [(f'{column}:n', '<u4'), (f'{column}:min', '<f4'),
+                   (f'{column}:max', '<f4'), (f'{column}:sum', '<f8'),
+                   (f'{column}:sumsq', '<f8')]
+    return np.dtype(fields)
+
+
+def open_rollup(path):
+    """(columns, records) for a rollup sidecar, or None if it is unusable."""
+    return _open_records(path, ROLLUP_MAGIC, rollup_dtype)
+
+
+def rollup_stats(records, column):
+    """{n, min, max, mean, std} arrays for one column of rollup records."""
+    n = records[f'{column}:n'].astype(float)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = records[f'{column}:sum'] / n
+        variance = records[f'{column}:sumsq'] / n - mean * mean
+    empty = n == 0
+    return {
+        "n": n.astype(int),
+        "min": np.where(empty, np.nan, records[f'{column}:min']),
+        "max": np.where(empty, np.nan, records[f'{column}:max']),
+        "mean": np.where(empty, np.nan, mean),
+        # Population deviation; clipped because the sums can round a
+        # constant column's variance a hair below zero.
+        "std": np.where(empty, np.nan, np.sqrt(np.clip(variance, 0, None))),
+    }
+
+
+class Rollup:
+    """One bucket width's aggregates, folded a row at a time.
+
+    Holds the open bucket only. add() hands back the packed record of the
+    bucket it closed, which the caller appends to the sidecar; record() packs
+    the open one, for a file that will get no more rows.
+    """
+
+    def __init__(self, seconds, columns):
+        self.seconds = seconds
+        self.columns = list(columns)
+        self._struct = struct.Struct('<dI' + 'Iffdd' * len(self.columns))
+        self.start = None
+        self._clear()
+
+    def _clear(self):
+        width = len(self.columns)
+        self.rows = 0
+        self.n = [0] * width
+        self.low = [float('inf')] * width
+        self.high = [float('-inf')] * width
+        self.sum = [0.0] * width
+        self.sumsq = [0.0] * width
+
+    def add(self, stamp, values):
+        """Fold in one row. Returns the closed bucket's record, or b''."""
+        bucket = stamp - stamp % self.seconds
+        closed = b''
+        if self.start is None:
+            self.start = bucket
+        elif bucket > self.start:
+            closed = self.record()
+            self.start = bucket
+            self._clear()
+        # A row for an earlier bucket -- the clock stepped back -- is folded
+        # into the open one rather than rewriting a record already on disk.
+        self.rows += 1
+        for i, value in enumerate(values):
+            if value != value:  # NaN: a blank cell
+                continue
+            self.n[i] += 1
+            self.low[i] = min(self.low[i], value)
+            self.high[i] = max(self.high[i], value)
+            self.sum[i] += value
+            self.sumsq[i] += value * value
+        return closed
+
+    def record(self):
+        if self.start is None or not self.rows:
+            return b''
+        fields = [self.start, self.rows]
+        for i in range(len(self.columns)):
+            if self.n[i]:
+                fields += [self.n[i], self.low[i], self.high[i],
+                           self.sum[i], self.sumsq[i]]
+            else:
+                fields += [0, float('nan'), float('nan'), 0.0, 0.0]
+        return self._struct.pack(*fields)
+
 
 class ReadingLog:
     """Append-only daily CSV, with read-back across day boundaries.
@@ -36,19 +252,35 @@ class ReadingLog:
     load-bearing rather than tidy: `recent()` is what assembles the model's
     window, and it reads a directory. Demo samples left at the top level would
     be handed to a real turn as though they came from the organism.
+
+    `binary_columns` names the numeric columns mirrored into the binary
+    sidecar; empty writes none. Reading through `window()` prefers the sidecar
+    wherever one exists, whatever this instance writes. `rollup_columns`
+    likewise names the columns aggregated into the rollups.
     """
 
-    def __init__(self, directory, prefix, fieldnames, run_provider=None):
+    def __init__(self, directory, prefix, fieldnames, run_provider=None,
+                 binary_columns=(), rollup_columns=()):
         self.directory = directory
         self.prefix = prefix
         self.run_provider = run_provider
         # run_id and mode are appended, not prepended, so existing files and
         # anything reading them by column name are unaffected.
         self.fieldnames = list(fieldnames) + ['run_id', 'mode']
+        self.binary_columns = list(binary_columns)
+        self._binary_record = struct.Struct('<d' + 'f' * len(self.binary_columns))
+        self.rollup_columns = list(rollup_columns)
+        self._rollups = {}
+        self._rollup_files = {}
         self._lock = threading.Lock()
         self._handle = None
         self._writer = None
         self._open_key = None
+        self._open_path = None
+        self._binary = None
+        self._index = None
+        self._index_ceiling = float('-inf')
+        self._index_next = float('-inf')
         os.makedirs(directory, exist_ok=True)
 
     def _run(self):
@@ -118,15 +350,166 @@ class ReadingLog:
                     record['mode'] = 'test'
                 writer.writerow(record)
         os.replace(tmp, path)
+        # Every byte offset in the old index now points into a different
+        # file, and the binary mirror may be missing a column. Rebuilt here
+        # rather than left for the next open, so a reader never uses either
+        # in between.
+        self._rebuild_sidecars(path)
         print(f"store: migrated {os.path.basename(path)} to include "
               f"{', '.join(missing)}", flush=True)
 
+    def _new_rollups(self):
+        return {seconds: Rollup(seconds, self.rollup_columns)
+                for seconds in ROLLUP_SECONDS} if self.rollup_columns else {}
+
+    def _rebuild_sidecars(self, path, rollups=None):
+        """Regenerate the index, binary mirror and rollups from the CSV, in
+        one pass.
+
+        Returns the index writer's state. Run on every open for append, not
+        only after a migration: a file written by a version without sidecars,
+        or appended to while a sidecar write failed, would otherwise be read
+        through an index that stops short or a mirror missing its tail. One
+        scan per file per process start is what every `recent()` used to cost.
+
+        `rollups`, from the writer, are left holding each width's last bucket
+        open for the rows still to come; without them every bucket is written.
+        """
+        ceiling, next_at = float('-inf'), float('-inf')
+        records, mirrored = [], []
+        hold = rollups is not None
+        if rollups is None:
+            rollups = self._new_rollups()
+        rolled = {seconds: [] for seconds in rollups}
+        try:
+            with open(path, 'rb') as handle:
+                header = next(csv.reader([handle.readline().decode('utf-8')]), [])
+                column = header.index('timestamp') if 'timestamp' in header else 0
+                positions = [header.index(name) if name in header else None
+                             for name in self.binary_columns]
+                summed = [header.index(name) if name in header else None
+                          for name in self.rollup_columns]
+                offset = handle.tell()
+                for line in handle:
+                    try:
+                        fields = next(csv.reader([line.decode('utf-8')]))
+                        stamp = float(fields[column])
+                    except (IndexError, StopIteration, UnicodeDecodeError,
+                            ValueError):
+                        offset += len(line)
+                        continue
+                    if stamp >= next_at:
+                        records.append(INDEX_RECORD.pack(ceiling, offset))
+                        next_at = stamp + INDEX_STRIDE_S
+                    ceiling = max(ceiling, stamp)
+                    offset += len(line)
+                    if self.binary_columns:
+                        mirrored.append(self._binary_record.pack(
+                            stamp, *(_number(fields, i) for i in positions)))
+                    if rollups:
+                        values = [_number(fields, i) for i in summed]
+                        for seconds, rollup in rollups.items():
+                            rolled[seconds].append(rollup.add(stamp, values))
+        except OSError:
+            return ceiling, next_at
+
+        outputs = [(index_path(path), b''.join(records))]
+        if self.binary_columns:
+            outputs.append((binary_path(path),
+                            _binary_header(self.binary_columns)
+                            + b''.join(mirrored)))
+        for seconds, rollup in rollups.items():
+            if not hold:
+                rolled[seconds].append(rollup.record())
+            outputs.append((rollup_path(path, seconds),
+                            _binary_header(self.rollup_columns, ROLLUP_MAGIC)
+                            + b''.join(rolled[seconds])))
+        for target, data in outputs:
+            tmp = target + '.rebuilding'
+            try:
+                with open(tmp, 'wb') as handle:
+                    handle.write(data)
+                os.replace(tmp, target)
+            except OSError as exc:
+                print(f"store: could not write {os.path.basename(target)}: "
+                      f"{exc}", flush=True)
+        return ceiling, next_at
+
+    def _seek_offset(self, path, cutoff):
+        """Byte offset to start reading from for rows at or after `cutoff`.
+
+        None means read from the top: no index, or nothing in it is early
+        enough to skip by.
+        """
+        try:
+            with open(index_path(path), 'rb') as handle:
+                data = handle.read()
+        except OSError:
+            return None
+
+        # A trailing partial record is a write in progress; ignore it.
+        lo, hi = 0, len(data) // INDEX_RECORD.size
+        while lo < hi:
+            mid = (lo + hi) // 2
+            ceiling, _ = INDEX_RECORD.unpack_from(data, mid * INDEX_RECORD.size)
+            if ceiling < cutoff:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            return None
+        return INDEX_RECORD.unpack_from(data, (lo - 1) * INDEX_RECORD.size)[1]
+
+    def _window_paths(self, seconds, now, mode):
+        """(cutoff, daily files) covering the last `seconds` of one mode."""
+        if mode is None:
+            mode = self._run().get('mode', 'test')
+        now = now or datetime.now(timezone.utc)
+        cutoff = (now - timedelta(seconds=seconds)).timestamp()
+
+        # A window can straddle midnight, so read yesterday too.
+        days = sorted({(now - timedelta(seconds=seconds)).date(), now.date()})
+        paths = [self.path_for(day, mode) for day in days]
+        return cutoff, [path for path in paths if os.path.exists(path)]
+
+    def _rows_since(self, path, cutoff):
+        """Rows of one daily file at or after `cutoff`, in file order."""
+        offset = self._seek_offset(path, cutoff)
+        rows = []
+        with open(path, 'rb') as raw:
+            header = next(csv.reader([raw.readline().decode('utf-8')]), [])
+            start = raw.tell()
+            if offset is not None and offset > start:
+                # An offset that does not land on a row boundary means the
+                # index belongs to some other version of this file. Fall back
+                # to the scan rather than parse from mid-row.
+                raw.seek(offset - 1)
+                if raw.read(1) != b'\n':
+                    raw.seek(start)
+            reader = csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8',
+                                                     newline=''),
+                                    fieldnames=header)
+            for row in reader:
+                try:
+                    stamp = float(row["timestamp"])
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if stamp >= cutoff:
+                    rows.append(row)
+        return rows
+
     def _ensure_open(self, day, mode):
         key = (day, mode)
         if self._open_key == key and self._handle is not None:
             return
         if self._handle is not None:
             self._handle.close()
+        if self._index is not None:
+            self._index.close()
+        if self._binary is not None:
+            self._binary.close()
+            self._binary = None
+        self._close_rollups()
 
         path = self.path_for(day, mode)
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -138,7 +521,104 @@ class ReadingLog:
                                       extrasaction='ignore')
         if is_new:
             self._writer.writeheader()
+            self._handle.flush()
+        self._rollups = self._new_rollups()
+        self._index_ceiling, self._index_next = self._rebuild_sidecars(
+            path, rollups=self._rollups)
+        self._index = open(index_path(path), 'ab')
+        if self.binary_columns:
+            self._binary = open(binary_path(path), 'ab')
+        for seconds in self._rollups:
+            self._rollup_files[seconds] = open(rollup_path(path, seconds), 'ab')
         self._open_key = key
+        self._open_path = path
+
+    def _index_row(self, stamp):
+        """Record where the row about to be written starts, once per stride."""
+        if stamp >= self._index_next:
+            try:
+                self._index.write(INDEX_RECORD.pack(self._index_ceiling,
+                                                    self._handle.tell()))
+                self._index.flush()
+            except OSError as exc:
+                # The CSV is the record and the index only makes it fast. A
+                # failed write leaves a gap the next open's rebuild fills.
+                print(f"store: index write failed: {exc}", flush=True)
+            self._index_next = stamp + INDEX_STRIDE_S
+        self._index_ceiling = max(self._index_ceiling, stamp)
+
+    def _mirror_row(self, row):
+        """Append the row's numeric columns to the binary sidecar."""
+        if self._binary is None:
+            return
+        values = []
+        for name in self.binary_columns:
+            try:
+                values.append(float(row.get(name)))
+            except (TypeError, ValueError):
+                values.append(float('nan'))
+        try:
+            self._binary.write(self._binary_record.pack(float(row["timestamp"]),
+                                                        *values))
+            self._binary.flush()
+        except (OSError, OverflowError, struct.error) as exc:
+            # A mirror missing one row would hand a turn a window with a hole
+            # in it and nothing to say so. Removing it sends readers back to
+            # the CSV until the next open rebuilds it.
+            print(f"store: binary mirror write failed, dropping it: {exc}",
+                  flush=True)
+            self._binary.close()
+            self._binary = None
+            try:
+                os.unlink(binary_path(self._open_path))
+            except OSError:
+                pass
+
+    def _roll_row(self, row):
+        """Fold the row into every rollup, appending any bucket it closes."""
+        if not self._rollups:
+            return
+        stamp = float(row["timestamp"])
+        values = [_number_or_nan(row.get(name)) for name in self.rollup_columns]
+        for seconds, rollup in list(self._rollups.items()):
+            closed = rollup.add(stamp, values)
+            if closed:
+                self._write_rollup(seconds, closed)
+
+    def _write_rollup(self, seconds, data):
+        try:
+            handle = self._rollup_files[seconds]
+            handle.write(data)
+            handle.flush()
+        except (KeyError, OSError) as exc:
+            # As with the binary mirror: a rollup with a bucket missing would
+            # be read as a quiet stretch. Removed, readers use the raw rows
+            # until the next open rebuilds it.
+            print(f"store: rollup write failed, dropping it: {exc}", flush=True)
+            handle = self._rollup_files.pop(seconds, None)
+            if handle is not None:
+                handle.close()
+            self._rollups.pop(seconds, None)
+            try:
+                os.unlink(rollup_path(self._open_path, seconds))
+            except OSError:
+                pass
+
+    def _close_rollups(self):
+        """Write each open bucket and close the files.
+
+        Called when the day changes, when every bucket of the old day is
+        complete, and on close(). A bucket cut short by a restart is
+        rewritten whole by the next open's rebuild.
+        """
+        for seconds, rollup in list(self._rollups.items()):
+            closed = rollup.record()
+            if closed and seconds in self._rollup_files:
+                self._write_rollup(seconds, closed)
+        for handle in self._rollup_files.values():
+            handle.close()
+        self._rollup_files = {}
+        self._rollups = {}
 
     def append(self, row):
         """Write one row. `row` must carry a 'timestamp' as a unix float."""
@@ -148,11 +628,14 @@ class ReadingLog:
                    mode=active.get('mode', 'test'))
         with self._lock:
             self._ensure_open(moment.date(), row['mode'])
+            self._index_row(float(row["timestamp"]))
             self._writer.writerow(row)
             # Flushed every row rather than buffered: at 1 Hz the cost is
             # nothing, and it means pulling the power loses at most one
             # sample instead of an unknown tail.
             self._handle.flush()
+            self._mirror_row(row)
+            self._roll_row(row)
 
     def recent(self, seconds, now=None, mode=None):
         """Rows from the last `seconds`, oldest first, across day boundaries.
@@ -163,31 +646,132 @@ class ReadingLog:
         never be reduced as though it were the organism, and development noise
         can never end up in an experimental turn.
         """
-        if mode is None:
-            mode = self._run().get('mode', 'test')
-        now = now or datetime.now(timezone.utc)
-        cutoff = (now - timedelta(seconds=seconds)).timestamp()
-
-        # A window can straddle midnight, so read yesterday too.
-        days = sorted({(now - timedelta(seconds=seconds)).date(), now.date()})
-
+        cutoff, paths = self._window_paths(seconds, now, mode)
         rows = []
-        for day in days:
-            path = self.path_for(day, mode)
-            if not os.path.exists(path):
-                continue
-            with open(path, newline='', encoding='utf-8') as handle:
-                for row in csv.DictReader(handle):
-                    try:
-                        stamp = float(row["timestamp"])
-                    except (KeyError, TypeError, ValueError):
-                        continue
-                    if stamp >= cutoff:
-                        rows.append(row)
+        for path in paths:
+            rows.extend(self._rows_since(path, cutoff))
 
         rows.sort(key=lambda r: float(r["timestamp"]))
         return rows
 
+    def window(self, seconds, channels, now=None, mode=None):
+        """The last `seconds` as {chN: volts}, the shape reduce_window wants.
+
+        What `channels_from_rows(recent(...))` returns, as arrays, read off
+        the binary sidecar: a memory-mapped slice, no CSV parsed and no string
+        converted. Any day without a usable sidecar -- none written yet, or
+        one missing a requested channel -- is read from its CSV instead, so
+        the answer never depends on which files happen to exist. Values agree
+        with the CSV to float32 precision, far below the ADC's resolution.
+        """
+        cutoff, paths = self._window_paths(seconds, now, mode)
+        columns = [f'ch{channel}_mv' for channel in channels]
+        stamps, values = [], {column: [] for column in columns}
+
+        for path in paths:
+            opened = open_binary(binary_path(path))
+            if opened is not None and all(c in opened[0] for c in columns):
+                records = opened[1]
+                # Masked rather than bisected: the wall clock can step
+                # backwards, so the column is not guaranteed sorted. Either
+                # way it is one vectorised pass over a day.
+                chosen = records[records['timestamp'] >= cutoff]
+                stamps.append(np.asarray(chosen['timestamp'], dtype=float))
+                for column in columns:
+                    values[column].append(np.asarray(chosen[column], dtype=float))
+                continue
+
+            rows = self._rows_since(path, cutoff)
+            stamps.append(np.array([float(r["timestamp"]) for r in rows]))
+            for column in columns:
+                values[column].append(np.array(
+                    [_number_or_nan(r.get(column)) for r in rows], dtype=float))
+
+        if not stamps:
+            return {f'ch{channel}': np.zeros(0) for channel in channels}
+        order = np.argsort(np.concatenate(stamps), kind='stable')
+        out = {}
+        for channel, column in zip(channels, columns):
+            series = np.concatenate(values[column])[order]
+            # A blank cell is skipped per channel, as channels_from_rows does.
+            out[f'ch{channel}'] = series[~np.isnan(series)] / 1000.0
+        return out
+
+    def _day_paths(self, start, end, mode):
+        if mode is None:
+            mode = self._run().get('mode', 'test')
+        day = datetime.fromtimestamp(start, timezone.utc).date()
+        last = datetime.fromtimestamp(end, timezone.utc).date()
+        while day <= last:
+            path = self.path_for(day, mode)
+            day += timedelta(days=1)
+            if os.path.exists(path):
+                yield path
+
+    def _day_span(self, path, start, end, columns):
+        opened = open_binary(binary_path(path))
+        if opened is not None and all(c in opened[0] for c in columns):
+            records = opened[1]
+            stamps = records['timestamp']
+            chosen = records[(stamps >= start) & (stamps < end)]
+            return (np.asarray(chosen['timestamp'], dtype=float),
+                    {c: np.asarray(chosen[c], dtype=float) for c in columns})
+        rows = [r for r in self._rows_since(path, start)
+                if float(r["timestamp"]) < end]
+        return (np.array([float(r["timestamp"]) for r in rows]),
+                {c: np.array([_number_or_nan(r.get(c)) for r in rows],
+                             dtype=float) for c in columns})
+
+    def span(self, start, end, columns, mode=None):
+        """Rows with `start` <= timestamp < `end`, a UTC day at a time.
+
+        Yields (timestamps, {column: values}) per daily file in date order,
+        as float arrays in file order -- off the binary sidecar where it has
+        every column asked for, off the CSV where it does not, exactly as
+        window() chooses. Blank cells are NaN. One day is held at a time, so
+        a range of months costs a day's memory.
+        """
+        for path in self._day_paths(start, end, mode):
+            yield self._day_span(path, start, end, columns)
+
+    def summaries(self, start, end, columns, seconds, mode=None):
+        """Buckets of `seconds` overlapping [start, end), a UTC day at a time.
+
+        Yields (starts, rows, {column: (n, min, max, sum)}) per daily file,
+        as arrays. Read off the rollup of that width where there is one with
+        every column; where there is not, and for the rows past a rollup's
+        last closed bucket -- today's open one -- the raw rows come back in
+        the same shape, one "bucket" per row, so a caller folds both alike.
+        Buckets at the ends may reach up to `seconds` outside the range.
+        """
+        for path in self._day_paths(start, end, mode):
+            covered = start
+            opened = open_rollup(rollup_path(path, seconds))
+            if opened is not None and all(c in opened[0] for c in columns):
+                records = opened[1]
+                begins = records['start']
+                chosen = records[(begins + seconds > start) & (begins < end)]
+                if len(chosen):
+                    yield (np.asarray(chosen['start'], dtype=float),
+                           np.asarray(chosen['rows'], dtype=np.int64),
+                           {c: (np.asarray(chosen[f'{c}:n'], dtype=np.int64),
+                                np.asarray(chosen[f'{c}:min'], dtype=float),
+                                np.asarray(chosen[f'{c}:max'], dtype=float),
+                                np.asarray(chosen[f'{c}:sum'], dtype=float))
+                            for c in columns})
+                if len(records):
+                    covered = max(start, float(np.max(begins)) + seconds)
+            if covered >= end:
+                continue
+            stamps, values = self._day_span(path, covered, end, columns)
+            stats = {}
+            for c in columns:
+                series = values[c]
+                present = ~np.isnan(series)
+                stats[c] = (present.astype(np.int64), series, series,
+                            np.where(present, series, 0.0))
+            yield stamps, np.ones(len(stamps), dtype=np.int64), stats
+
     def close(self):
         with self._lock:
             if self._handle is not None:
@@ -195,6 +779,31 @@ class ReadingLog:
                 self._handle = None
                 self._writer = None
                 self._open_day = None
+            if self._index is not None:
+                self._index.close()
+                self._index = None
+            if self._binary is not None:
+                self._binary.close()
+                self._binary = None
+            self._close_rollups()
+
+
+def _number(fields, position):
+    if position is None:
+        return float('nan')
+    try:
+        return _number_or_nan(fields[position])
+    except IndexError:
+        return float('nan')
+
+
+def _number_or_nan(raw):
+    if raw in (None, ''):
+        return float('nan')
+    try:
+        return float(raw)
+    except ValueError:
+        return float('nan')
 
 
 def _run_provider(config):
@@ -206,10 +815,15 @@ def _run_provider(config):
 def electrode_log(config):
     """Daily electrode CSV: one column per configured channel, in millivolts."""
     channels = tuple(getattr(config, 'ADC_CHANNELS', (0, 1, 2)))
+    columns = [f'ch{c}_mv' for c in channels]
     return ReadingLog(
         config.CSV_DIR, 'electrodes',
-        ['timestamp', 'datetime'] + [f'ch{c}_mv' for c in channels],
+        ['timestamp', 'datetime'] + columns,
         run_provider=_run_provider(config),
+        binary_columns=(columns if getattr(config, 'READINGS_BINARY_SIDECAR', True)
+                        else ()),
+        rollup_columns=(columns if getattr(config, 'READINGS_ROLLUPS', True)
+                        else ()),
     )
 
 
@@ -220,6 +834,8 @@ def environment_log(config):
         ['timestamp', 'datetime', 'temperature_c', 'temperature_f',
          'humidity_pct', 'fan_on'],
         run_provider=_run_provider(config),
+        rollup_columns=(['temperature_c', 'humidity_pct']
+                        if getattr(config, 'READINGS_ROLLUPS', True) else ()),
     )
 
 
@@ -244,3 +860,57 @@ def channels_from_rows(rows, channels):
                 continue
         out[f'ch{channel}'] = values
     return out
+
+
+def backfill(log, force=False, include_today=False):
+    """Build sidecars for every daily file of `log` that lacks them.
+
+    Today's file is left alone unless asked: the API has it open for append,
+    and replacing a sidecar underneath a writer sends its next rows into the
+    unlinked old file. The writer rebuilds today's on its own next open.
+    Returns the paths rebuilt.
+    """
+    import run as run_state
+
+    today = f"{log.prefix}_{datetime.now(timezone.utc):%Y%m%d}.csv"
+    directories = sorted({log.directory_for(mode) for mode in run_state.MODES})
+    rebuilt = []
+    for directory in directories:
+        for path in sorted(glob.glob(os.path.join(directory,
+                                                  f'{log.prefix}_*.csv'))):
+            if os.path.basename(path) == today and not include_today:
+                continue
+            present = (os.path.exists(index_path(path))
+                       and (not log.binary_columns
+                            or os.path.exists(binary_path(path)))
+                       and all(os.path.exists(rollup_path(path, seconds))
+                               for seconds in (ROLLUP_SECONDS
+                                               if log.rollup_columns else ())))
+            if present and not force:
+                continue
+            log._rebuild_sidecars(path)
+            rebuilt.append(path)
+    return rebuilt
+
+
+def main():
+    # Config lives beside this module's parent, so the deployed copy at
+    # /var/www/sllm finds its own config rather than the checkout's.
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'api'))
+    import config
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else ""
+    if mode != "backfill":
+        print(f"usage: python3 {sys.argv[0]} backfill [--force] [--today]")
+        return 1
+
+    force = '--force' in sys.argv[2:]
+    include_today = '--today' in sys.argv[2:]
+    for log in (electrode_log(config), environment_log(config)):
+        for path in backfill(log, force=force, include_today=include_today):
+            print(f"indexed {os.path.relpath(path, config.CSV_DIR)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+"""Benchmark for the reading store: sidecar reads against the full-file scan.
+
+Builds a synthetic store of whole days at 1 Hz in a scratch directory -- the
+shape data/readings reaches after a week of recording -- then assembles the
+model's window the three ways it can be read:
+
+    binary    ReadingLog.window(), a memmap slice of the .bin sidecar
+    indexed   channels_from_rows(recent()), seeking through the .idx
+    scan      the same with both sidecars removed, which is exactly what every
+              turn used to pay
+
+Touches no hardware and nothing under data/.
+
+    ./scripts/py gpio/store_bench.py                 # 7 days, 30 min window
+    ./scripts/py gpio/store_bench.py --days 2 --repeat 50
+"""
+
+import argparse
+import csv
+import glob
+import math
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+import numpy as np  # noqa: E402
+
+from store import (ReadingLog, binary_path, channels_from_rows,  # noqa: E402
+                   index_path)
+
+CHANNELS = (0, 1, 2)
+START = datetime(2026, 8, 1, tzinfo=timezone.utc)
+
+
+def build(directory, days, tail_s=600, rate_hz=1.0):
+    """Write `days` whole days of rows straight to CSV, then index them.
+
+    Followed by `tail_s` seconds of the next day, so there is a moment just
+    after midnight whose window straddles a full file and a new one.
+
+    Written directly rather than through append(), which flushes every row and
+    would make building a week of data the slowest part of the benchmark. The
+    sidecars are then produced by the same rebuild a restarted writer runs.
+    """
+    columns = [f'ch{c}_mv' for c in CHANNELS]
+    log = ReadingLog(directory, 'electrodes', ['timestamp', 'datetime'] + columns,
+                     run_provider=lambda: {'id': 'bench', 'mode': 'live'},
+                     binary_columns=columns)
+    step = 1.0 / rate_hz
+    for day in range(days + 1):
+        length = 86400 if day < days else tail_s
+        first = START + timedelta(days=day)
+        path = log.path_for(first.date(), 'live')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', newline='', encoding='utf-8') as handle:
+            writer = csv.writer(handle)
+            writer.writerow(log.fieldnames)
+            base = first.timestamp()
+            for i in range(int(length * rate_hz)):
+                stamp = base + i * step
+                wave = 1.5 * math.sin(2 * math.pi * stamp / 90)
+                writer.writerow(
+                    [f'{stamp:.3f}',
+                     datetime.fromtimestamp(stamp, timezone.utc).isoformat()]
+                    + [f'{wave + c * 0.1:.4f}' for c in CHANNELS]
+                    + ['bench', 'live'])
+        log._rebuild_sidecars(path)
+    return log
+
+
+def timed(read, moments, repeat):
+    """Mean seconds per window, and the window read at each moment."""
+    windows = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        windows = [read(moment) for moment in moments]
+    return (time.perf_counter() - started) / (repeat * len(moments)), windows
+
+
+def same(a, b):
+    """Windows equal to float32 precision, which is what the sidecar keeps."""
+    return all(
+        set(x) == set(y) and all(
+            len(x[k]) == len(y[k]) and np.allclose(x[k], y[k], rtol=1e-6, atol=0)
+            for k in x)
+        for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--window', type=int, default=1800,
+                        help='seconds, as LLM_WINDOW_S')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--keep', action='store_true',
+                        help='leave the scratch store in place')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='sllm-store-bench-')
+    try:
+        print(f"building {args.days} days at 1 Hz, plus ten minutes, "
+              f"in {directory}")
+        started = time.perf_counter()
+        log = build(directory, args.days)
+        print(f"  built in {time.perf_counter() - started:.1f}s\n")
+
+        # The end of the last full day, when the file is at its largest and
+        # the scan at its worst, and the end of the short tail after it, when
+        # the window straddles midnight and yesterday's file is full.
+        tail = START + timedelta(days=args.days)
+        moments = [tail - timedelta(seconds=1), tail + timedelta(minutes=10)]
+
+        def from_rows(moment):
+            rows = log.recent(args.window, now=moment, mode='live')
+            return channels_from_rows(rows, CHANNELS)
+
+        def from_binary(moment):
+            return log.window(args.window, CHANNELS, now=moment, mode='live')
+
+        binary, windows_binary = timed(from_binary, moments, args.repeat)
+        indexed, windows_indexed = timed(from_rows, moments, args.repeat)
+        for path in glob.glob(os.path.join(directory, '*.csv')):
+            os.unlink(index_path(path))
+            os.unlink(binary_path(path))
+        scanned, windows_scanned = timed(from_rows, moments, args.repeat)
+
+        agree = (same(windows_binary, windows_scanned)
+                 and same(windows_indexed, windows_scanned))
+        print(f"{args.window}s window at {len(moments)} moments, "
+              f"{', '.join(str(len(w['ch0'])) for w in windows_scanned)} samples")
+        print(f"  full scan  {scanned * 1000:9.2f} ms per window")
+        print(f"  indexed    {indexed * 1000:9.2f} ms per window  "
+              f"{scanned / max(indexed, 1e-9):7.1f}x")
+        print(f"  binary     {binary * 1000:9.2f} ms per window  "
+              f"{scanned / max(binary, 1e-9):7.1f}x")
+        print(f"  identical windows: {'yes' if agree else 'NO'}")
+        return 0 if agree else 1
+    finally:
+        if args.keep:
+            print(f"\nleft in {directory}")
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+"""Regression check for DerivativeWorker.submit with a render already finished.
+
+A future that is done by the time its callback is added runs the callback at
+once, on the submitting thread. submit() used to add it while holding the
+lock _finished takes, and so deadlocked. The pool here hands back futures
+that are already done; submit() must return, and the bookkeeping settle.
+
+    ./scripts/py -m pytest gpio/test_derivatives.py
+    ./scripts/py gpio/test_derivatives.py
+"""
+
+import concurrent.futures
+import pathlib
+import sys
+import tempfile
+import threading
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from derivatives import DerivativeWorker  # noqa: E402
+
+
+class _DonePool:
+    """A pool whose every future has already finished."""
+
+    def submit(self, function, *args):
+        future = concurrent.futures.Future()
+        future.set_result(None)
+        return future
+
+
+def test_submit_with_a_future_already_done():
+    with tempfile.TemporaryDirectory() as image_dir:
+        worker = DerivativeWorker(image_dir, sizes={'thumb': 64, 'medium': 128})
+        worker.available = True
+        worker._pool = _DonePool()
+        original = str(pathlib.Path(image_dir) / 'slime_20260805_120000.jpg')
+
+        returned = []
+        caller = threading.Thread(
+            target=lambda: returned.append(worker.submit(original)), daemon=True)
+        caller.start()
+        caller.join(timeout=5)
+
+        assert not caller.is_alive(), "submit() deadlocked on its own lock"
+        assert sorted(returned[0]) == ['medium', 'thumb']
+        assert worker.done == 2
+        assert worker._pending == {}
+
+
+if __name__ == '__main__':
+    test_submit_with_a_future_already_done()
+    print("ok")
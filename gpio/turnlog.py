@@ -0,0 +1,376 @@
+"""The model's turn log, and an index that lets it be read from the end.
+
+llm/loop.py appends one JSON line per turn to a daily file under data/logs:
+
+    data/logs/turns_20260805.jsonl
+    data/logs/switches_20260805.jsonl
+
+The public /logs page polls /api/turns every few seconds for the newest few
+hundred of those, or for whatever has arrived since the last one it showed.
+That used to read every daily file there was into memory, joined a file at a
+time onto the front of everything read so far, and decoded every line of it
+on every request -- and with `after=` it never stopped early, so each poll
+parsed the whole history to return, most of the time, nothing.
+
+Each daily file now has a sidecar beside it, `turns_20260805.idx`: one fixed
+record per line, the turn's `datetime` and where its line starts and ends.
+TurnLog writes it alongside the line; TurnTail, in the API process, reads it
+and follows the files as they grow by polling their size. A request becomes a
+search through keys already in memory, a seek, and a decode of only the lines
+it returns.
+
+Same rules as the readings sidecars in store.py: the JSONL is the record, the
+index is derived from it, a missing or stale one costs a scan and nothing
+else, and the writer rebuilds it whenever the two could disagree.
+
+    ./scripts/py gpio/turnlog.py backfill     # indexes for days already on disk
+"""
+
+import bisect
+import glob
+import json
+import os
+import pathlib
+import struct
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+# (datetime, offset, length) of one line. The datetime is the record's own
+# string, NUL-padded, not a parsed timestamp: /api/turns has always compared
+# `after` against it as a string, and an index that compared anything else
+# would answer a different question. isoformat() with microseconds and an
+# offset is 32 characters.
+KEY_BYTES = 40
+INDEX_RECORD = struct.Struct(f'<{KEY_BYTES}sQI')
+
+
+def index_path(jsonl_path):
+    """The sidecar index for a daily JSONL file."""
+    return os.path.splitext(jsonl_path)[0] + '.idx'
+
+
+def _key(record):
+    return str(record.get('datetime') or '').encode('utf-8')[:KEY_BYTES]
+
+
+def _records(data, offset=0):
+    """Decode JSONL bytes into (key, offset, length) for every usable line.
+
+    Blank lines, lines that are not a JSON object, and a trailing line with
+    no newline yet -- a write in progress -- are left out, as /api/turns
+    has always left them out. Returns the entries and how far they reach.
+    """
+    entries = []
+    position = 0
+    while True:
+        end = data.find(b'\n', position)
+        if end < 0:
+            break
+        line = data[position:end + 1]
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                entries.append((_key(record), offset + position, len(line)))
+        position = end + 1
+    return entries, offset + position
+
+
+def rebuild_index(path):
+    """Regenerate the index of one JSONL file from the file. Returns its size."""
+    try:
+        with open(path, 'rb') as handle:
+            data = handle.read()
+    except OSError:
+        return 0
+    entries, _ = _records(data)
+    target = index_path(path)
+    tmp = target + '.rebuilding'
+    try:
+        with open(tmp, 'wb') as handle:
+            handle.write(b''.join(INDEX_RECORD.pack(*entry) for entry in entries))
+        os.replace(tmp, target)
+    except OSError as exc:
+        print(f"turnlog: could not write {os.path.basename(target)}: {exc}",
+              flush=True)
+    return len(data)
+
+
+def _index_covers(path):
+    """Whether the index ends exactly where the JSONL does."""
+    try:
+        size = os.path.getsize(path)
+        indexed = os.path.getsize(index_path(path))
+    except OSError:
+        return False
+    if indexed % INDEX_RECORD.size:
+        return False
+    if indexed == 0:
+        return size == 0
+    with open(index_path(path), 'rb') as handle:
+        handle.seek(indexed - INDEX_RECORD.size)
+        _, offset, length = INDEX_RECORD.unpack(handle.read(INDEX_RECORD.size))
+    return offset + length == size
+
+
+class TurnLog:
+    """Append-only JSONL of every turn, sham or not.
+
+    Replay and dry runs write to a `replay/` subdirectory rather than
+    alongside the real record. Synthetic turns look exactly like live ones
+    once they are in a file -- same shape, same fields, plausible numbers --
+    and anything later reading data/logs to ask what the organism did must not
+    have to guess which rows were about an organism at all.
+    """
+
+    def __init__(self, directory, replay=False, prefix='turns'):
+        if replay:
+            directory = os.path.join(directory, 'replay')
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._checked = set()
+
+    def append(self, record):
+        day = datetime.now(timezone.utc).strftime('%Y%m%d')
+        path = os.path.join(self.directory, f'{self.prefix}_{day}.jsonl')
+        line = (json.dumps(record) + '\n').encode('utf-8')
+        with self._lock:
+            # Once per file per process, as store.py does: a file written by
+            # a version without the index, or appended to while an index
+            # write failed, gets its index rebuilt before it is extended.
+            if path not in self._checked:
+                if os.path.exists(path) and not _index_covers(path):
+                    rebuild_index(path)
+                self._checked.add(path)
+            with open(path, 'ab') as handle:
+                handle.seek(0, os.SEEK_END)
+                offset = handle.tell()
+                handle.write(line)
+            try:
+                with open(index_path(path), 'ab') as handle:
+                    handle.write(INDEX_RECORD.pack(_key(record), offset, len(line)))
+            except OSError as exc:
+                # The JSONL is the record. A missing index entry only means
+                # readers decode this line themselves, and the next process
+                # to append here rebuilds the index.
+                print(f"turnlog: index write failed: {exc}", flush=True)
+                self._checked.discard(path)
+        return path
+
+
+class _File:
+    """What TurnTail knows of one daily file: its lines' keys and positions."""
+
+    def __init__(self, inode):
+        self.inode = inode
+        self.size = 0            # bytes of the JSONL accounted for
+        self.index_inode = None
+        self.index_read = 0      # bytes of the index consumed
+        self.keys = []
+        self.offsets = []
+        self.lengths = []
+        self.ordered = True      # keys non-decreasing, so bisect is exact
+        self.newest = ''
+
+    def add(self, key, offset, length):
+        key = key.rstrip(b'\0').decode('utf-8', 'replace')
+        if self.keys and key < self.keys[-1]:
+            self.ordered = False
+        self.newest = max(self.newest, key)
+        self.keys.append(key)
+        self.offsets.append(offset)
+        self.lengths.append(length)
+
+    def after(self, after):
+        """Positions of lines whose datetime sorts after `after`, in order."""
+        if not after:
+            return range(len(self.keys))
+        if self.newest <= after:
+            return range(0)
+        if self.ordered:
+            return range(bisect.bisect_right(self.keys, after), len(self.keys))
+        # The wall clock stepped backwards inside this file. Still no decoding:
+        # the keys are in memory, they just cannot be bisected.
+        return [i for i, key in enumerate(self.keys) if key > after]
+
+
+class TurnTail:
+    """The turn log as seen from the API: follows the files, reads from the end.
+
+    Holds each daily file's keys and line positions in memory -- 60 bytes or
+    so a turn, 6 MB for 100,000 -- and brings them up to date at most every
+    `interval` seconds, by stat. A file that grew is read from where it was
+    left off: index records first, then any lines past the end of the index
+    decoded directly. A file that shrank or was replaced is started over.
+
+    Nothing here writes. The API runs as a different user from the loop and
+    has no business rewriting its index; a file with no index is decoded
+    once, in full, and followed from there.
+    """
+
+    def __init__(self, directory, prefix='turns', interval=1.0):
+        self.directory = directory
+        self.prefix = prefix
+        self.interval = interval
+        self._files = {}
+        self._lock = threading.Lock()
+        self._refreshed = float('-inf')
+
+    def refresh(self, force=False):
+        """Bring the in-memory view up to date with the files on disk."""
+        with self._lock:
+            self._refresh(force)
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._refreshed < self.interval:
+            return
+        self._refreshed = now
+        paths = glob.glob(os.path.join(self.directory, f'{self.prefix}_*.jsonl'))
+        for gone in set(self._files) - set(paths):
+            del self._files[gone]
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self._files.pop(path, None)
+                continue
+            state = self._files.get(path)
+            if state is None or state.inode != stat.st_ino or stat.st_size < state.size:
+                state = self._files[path] = _File(stat.st_ino)
+            if stat.st_size > state.size:
+                self._follow(path, state, stat.st_size)
+
+    @staticmethod
+    def _follow(path, state, size):
+        """Account for everything between state.size and `size`."""
+        try:
+            with open(index_path(path), 'rb') as handle:
+                inode = os.fstat(handle.fileno()).st_ino
+                if inode != state.index_inode:
+                    # Rebuilt, by os.replace, since it was last read.
+                    state.index_inode, state.index_read = inode, 0
+                handle.seek(state.index_read)
+                data = handle.read()
+        except OSError:
+            data = b''
+        usable = len(data) - len(data) % INDEX_RECORD.size
+        state.index_read += usable
+        for key, offset, length in INDEX_RECORD.iter_unpack(data[:usable]):
+            # Records for lines already accounted for, or for lines that are
+            # not all on disk yet, are skipped; the tail scan covers both.
+            if offset >= state.size and offset + length <= size:
+                state.add(key, offset, length)
+                state.size = offset + length
+        if state.size >= size:
+            return
+        try:
+            with open(path, 'rb') as handle:
+                handle.seek(state.size)
+                data = handle.read(size - state.size)
+        except OSError:
+            return
+        entries, reached = _records(data, state.size)
+        for key, offset, length in entries:
+            state.add(key, offset, length)
+        state.size = reached
+
+    def turns(self, limit, after=''):
+        """The last `limit` records whose datetime sorts after `after`.
+
+        Oldest first, exactly as a scan of every file in name order keeping
+        `datetime > after` (or everything, when `after` is empty) would give.
+        Only the records returned are read and decoded.
+        """
+        with self._lock:
+            self._refresh()
+            picked, count = [], 0
+            for path in sorted(self._files, reverse=True):
+                if count >= limit:
+                    break
+                state = self._files[path]
+                positions = state.after(after)[-(limit - count):]
+                if positions:
+                    picked.append((path, [(state.offsets[i], state.lengths[i])
+                                          for i in positions]))
+                    count += len(positions)
+
+        records = []
+        for path, lines in reversed(picked):
+            records += _read(path, lines)
+        return records[-limit:]
+
+
+def _read(path, lines):
+    """Decode the lines at (offset, length), reading runs of them at once."""
+    out = []
+    try:
+        handle = open(path, 'rb')
+    except OSError:
+        return out
+    with handle:
+        i = 0
+        while i < len(lines):
+            start = lines[i][0]
+            end = start + lines[i][1]
+            j = i + 1
+            while j < len(lines) and lines[j][0] == end:
+                end += lines[j][1]
+                j += 1
+            handle.seek(start)
+            for line in handle.read(end - start).splitlines():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if isinstance(record, dict):
+                    out.append(record)
+            i = j
+    return out
+
+
+def backfill(directory, prefixes=('turns', 'switches'), force=False,
+             include_today=False):
+    """Build indexes for every daily file under `directory` that lacks one.
+
+    Today's file is left to the loop, which checks and rebuilds its own on
+    the first append. Returns the paths indexed.
+    """
+    today = f"{datetime.now(timezone.utc):%Y%m%d}"
+    rebuilt = []
+    for prefix in prefixes:
+        for path in sorted(glob.glob(os.path.join(directory, '**',
+                                                  f'{prefix}_*.jsonl'),
+                                     recursive=True)):
+            if path.endswith(f'_{today}.jsonl') and not include_today:
+                continue
+            if not force and _index_covers(path):
+                continue
+            rebuild_index(path)
+            rebuilt.append(path)
+    return rebuilt
+
+
+def main():
+    sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / 'api'))
+    import config
+
+    mode = sys.argv[1] if len(sys.argv) > 1 else ""
+    if mode != "backfill":
+        print(f"usage: python3 {sys.argv[0]} backfill [--force] [--today]")
+        return 1
+
+    for path in backfill(config.LOG_DIR, force='--force' in sys.argv[2:],
+                         include_today='--today' in sys.argv[2:]):
+        print(f"indexed {os.path.relpath(path, config.LOG_DIR)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Load test for /api/turns: the turn index against the full scan it replaced.
+
+Writes a synthetic turn log to a scratch directory -- 100,000 turns by
+default, at the live loop's 144 a day, which is nearly two years of daily
+files -- indexes it the way the loop does, and answers the three requests
+the /logs page makes, with the tail checking the files for growth once a
+second as the API does:
+
+    first     limit=300, no `after`: the page being opened
+    poll      limit=300, after= the newest turn: the poll that finds nothing
+    follow    limit=300, after= five turns back: the poll that finds a few
+
+each two ways:
+
+    scan      the old get_turns(), reproduced here verbatim: every file read,
+              every line decoded, on every request
+    tail      gpio/turnlog.TurnTail, as the API now holds it
+
+Both must return the same records, or this exits non-zero. A last check
+appends a turn through TurnLog and confirms the tail picks it up.
+
+Touches no hardware and nothing under data/.
+
+    ./scripts/py gpio/turnlog_bench.py
+    ./scripts/py gpio/turnlog_bench.py --turns 20000 --repeat 20
+"""
+
+import argparse
+import glob
+import json
+import os
+import pathlib
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+from turnlog import TurnLog, TurnTail, rebuild_index  # noqa: E402
+
+TURN_S = 600
+
+
+def build(directory, turns, points):
+    """Write `turns` turn records, one file per UTC day, then index them.
+
+    Written straight to the files, then indexed by the same rebuild the loop
+    runs on an unindexed file, rather than appended one open at a time.
+    """
+    rng = random.Random(0)
+    per_day = 86400 // TURN_S
+    # Ending yesterday, so a turn appended now is the newest there is.
+    start = (datetime.now(timezone.utc).replace(hour=0, minute=0, second=0,
+                                                microsecond=0)
+             - timedelta(days=-(-turns // per_day)))
+    for first in range(0, turns, per_day):
+        day = start + timedelta(seconds=first * TURN_S)
+        path = os.path.join(directory, f'turns_{day:%Y%m%d}.jsonl')
+        with open(path, 'w', encoding='utf-8') as handle:
+            for turn in range(first, min(turns, first + per_day)):
+                moment = start + timedelta(seconds=turn * TURN_S,
+                                           microseconds=rng.randrange(1, 10**6))
+                handle.write(json.dumps({
+                    'turn': turn,
+                    'datetime': moment.astimezone().isoformat(),
+                    'source': 'bench',
+                    'window_samples': 1800,
+                    'state': {f'ch{c}': [round(rng.gauss(0, 1), 3)
+                                         for _ in range(points)]
+                              for c in range(3)},
+                    'reply': {'note': 'nothing to report', 'resource': None},
+                    'action': None,
+                    'sham': turn % 4 == 0,
+                    'applied': False,
+                }) + '\n')
+        rebuild_index(path)
+
+
+def scan(directory, limit, after):
+    """get_turns() before the index, minus the response shaping."""
+    paths = sorted(glob.glob(os.path.join(directory, 'turns_*.jsonl')))
+    lines = []
+    for path in reversed(paths):
+        try:
+            with open(path) as handle:
+                lines = handle.readlines() + lines
+        except OSError:
+            continue
+        if len(lines) >= limit and not after:
+            break
+
+    turns = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if after and record.get('datetime', '') <= after:
+            continue
+        turns.append(record)
+    return turns[-limit:]
+
+
+def timed(read, repeat):
+    """(milliseconds per call, last result)."""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = read()
+    return (time.perf_counter() - started) * 1000 / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--turns', type=int, default=100_000)
+    parser.add_argument('--points', type=int, default=20,
+                        help='values per channel in each synthetic state')
+    parser.add_argument('--limit', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='calls per measurement (the scan is slow)')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='turnlog_bench_')
+    try:
+        started = time.perf_counter()
+        build(directory, args.turns, args.points)
+        size = sum(os.path.getsize(p) for p in
+                   glob.glob(os.path.join(directory, '*.jsonl')))
+        print(f"{args.turns} turns in "
+              f"{len(glob.glob(os.path.join(directory, '*.jsonl')))} files, "
+              f"{size / 1e6:.1f} MB, built in {time.perf_counter() - started:.1f}s")
+
+        tail = TurnTail(directory)
+        started = time.perf_counter()
+        tail.refresh()
+        print(f"tail loaded the index in "
+              f"{(time.perf_counter() - started) * 1000:.0f} ms\n")
+
+        newest = scan(directory, 6, '')
+        cases = [('first', ''), ('poll', newest[-1]['datetime']),
+                 ('follow', newest[0]['datetime'])]
+        ok = True
+        print(f"  {'request':<8} {'scan ms':>10} {'tail ms':>10} {'speedup':>9}"
+              f"  turns")
+        for label, after in cases:
+            slow, expected = timed(lambda: scan(directory, args.limit, after),
+                                   args.repeat)
+            fast, got = timed(lambda: tail.turns(args.limit, after),
+                              args.repeat * 20)
+            same = got == expected
+            ok &= same
+            print(f"  {label:<8} {slow:10.1f} {fast:10.3f} {slow / fast:8.0f}x"
+                  f"  {len(got)}{'' if same else '  MISMATCH'}")
+
+        log = TurnLog(directory)
+        record = {'turn': args.turns, 'source': 'bench',
+                  'datetime': datetime.now(timezone.utc).astimezone().isoformat()}
+        log.append(record)
+        tail.refresh(force=True)
+        got = tail.turns(args.limit, newest[-1]['datetime'])
+        followed = got == [record]
+        ok &= followed
+        print(f"\n  appended turn {'seen' if followed else 'NOT seen'} by the tail")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
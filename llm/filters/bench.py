@@ -0,0 +1,137 @@
+"""
+Micro-benchmark for the reducer's correlation engine.
+
+Times dominant_period, phase_lag, describe_channel and the whole of
+reduce_window with the correlations computed directly (np.correlate and the
+strided circular scan) and through the FFT, across window lengths from the
+half hour the loop uses to a full day at 1 Hz, and from the three channels the
+rig has to sixteen. Each cell also checks the two engines agree, which is the
+property that lets reducer.py switch between them on window length alone.
+
+A second table times the whole reduction a channel at a time
+(reduce_channels) against all channels stacked (reduce_array), over the same
+sweep, to show what adding electrodes costs each way.
+
+The direct autocorrelation is O(n^2): a full day of it costs over a second
+per channel, per call, so direct runs above --max-direct samples are skipped
+and shown as "-".
+
+Usage:
+    python bench.py
+    python bench.py --windows 1800 7200 --channels 3 --repeat 20
+    python bench.py --max-direct 86400     # include the slow cells
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import reducer
+from harness import session
+from reducer import (PERIOD_MAX, SAMPLE_HZ, describe_channel, dominant_period,
+                     phase_lag, reduce_array, reduce_channels, reduce_window)
+
+DIRECT = "direct"
+FFT = "fft"
+
+
+def engine(name):
+    """Force every correlation in reducer.py through one engine."""
+    reducer.FFT_MIN_SAMPLES = 0 if name == FFT else sys.maxsize
+
+
+def timed(call, repeat):
+    """Best of `repeat` wall times, in milliseconds, and the last result."""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000, result
+
+
+def cases(channels):
+    """The four calls benchmarked, each a function of the channel dict."""
+    first, second = channels["ch0"], channels["ch1"]
+    period = dominant_period(first) or PERIOD_MAX / 2
+    return {
+        "dominant_period": lambda: dominant_period(first),
+        "phase_lag": lambda: phase_lag(first, second, period),
+        "describe_channel": lambda: describe_channel(first),
+        "reduce_window": lambda: reduce_window(channels),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--windows", type=int, nargs="+",
+                        default=[1800, 7200, 21600, 86400],
+                        help="window lengths in samples")
+    parser.add_argument("--channels", type=int, nargs="+", default=[3, 8, 16])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-direct", type=int, default=21600,
+                        help="skip the direct engine above this many samples")
+    args = parser.parse_args()
+
+    threshold = reducer.FFT_MIN_SAMPLES
+    print(f"reducer.FFT_MIN_SAMPLES = {threshold}; times are best of "
+          f"{args.repeat}, in ms\n")
+    print(f"{'samples':>8} {'chans':>5}  {'call':<17} {'direct':>10} "
+          f"{'fft':>10} {'speedup':>8}  agree")
+
+    disagreements = 0
+    try:
+        for n in args.windows:
+            for count in args.channels:
+                channels = session(duration_s=n / SAMPLE_HZ, n_channels=count)
+                calls = cases(channels)
+                for name, call in calls.items():
+                    # Only reduce_window depends on the channel count.
+                    if name != "reduce_window" and count != args.channels[0]:
+                        continue
+                    results = {}
+                    times = {}
+                    for which in (DIRECT, FFT):
+                        if which == DIRECT and n > args.max_direct:
+                            continue
+                        engine(which)
+                        times[which], results[which] = timed(call, args.repeat)
+
+                    agree = "-"
+                    if len(results) == 2:
+                        agree = "yes" if results[DIRECT] == results[FFT] else "NO"
+                        disagreements += agree == "NO"
+                    direct = times.get(DIRECT)
+                    speedup = (f"{direct / times[FFT]:7.1f}x"
+                               if direct is not None else f"{'-':>8}")
+                    direct = f"{direct:10.2f}" if direct is not None else f"{'-':>10}"
+                    print(f"{n:>8} {count:>5}  {name:<17} {direct} "
+                          f"{times[FFT]:10.2f} {speedup}  {agree}")
+    finally:
+        reducer.FFT_MIN_SAMPLES = threshold
+
+    print(f"\n{disagreements} cells where the engines disagree\n")
+
+    print(f"{'samples':>8} {'chans':>5}  {'per channel':>11} {'stacked':>10} "
+          f"{'speedup':>8}  agree")
+    for n in args.windows:
+        for count in args.channels:
+            channels = session(duration_s=n / SAMPLE_HZ, n_channels=count)
+            stacked = np.vstack(list(channels.values()))
+            each, expected = timed(lambda: reduce_channels(channels), args.repeat)
+            batch, result = timed(lambda: reduce_array(stacked, list(channels)),
+                                  args.repeat)
+            agree = "yes" if result == expected else "NO"
+            disagreements += agree == "NO"
+            print(f"{n:>8} {count:>5}  {each:11.2f} {batch:10.2f} "
+                  f"{each / batch:7.1f}x  {agree}")
+
+    print(f"\n{disagreements} cells disagreeing in all")
+    return 1 if disagreements else 0
+
+
+if __name__ == "__main__":
+    np.seterr(all="ignore")
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Benchmark: per-call latency to /api/chat with and without connection pooling.
+
+Sends the same small chat request N times two ways:
+
+    fresh    requests.post per call, a new TCP connection every time -- what
+             loop.py, harness.py and noise_floor.py each used to do
+    pooled   ollama_client.Ollama.chat, one keep-alive connection reused
+
+against fake_ollama.py started in-process (the default), or any server given
+with --url. The stub answers instantly, so the difference is the connection
+setup alone. On localhost that is a fraction of a millisecond; against the
+laptop over Tailscale it is one or more round trips per call, which is the
+case worth running with --url.
+
+Usage:
+    python client_bench.py
+    python client_bench.py --calls 500
+    python client_bench.py --url http://100.127.41.6:11434 --model qwen2.5:14b --calls 20
+"""
+
+import argparse
+import statistics
+import time
+
+import requests
+
+import fake_ollama
+from ollama_client import Ollama
+
+MESSAGES = [{"role": "system", "content": "Reply with JSON only."},
+            {"role": "user", "content": "{}"}]
+
+
+def fresh_call(url, model):
+    def call():
+        response = requests.post(url, json={
+            "model": model, "messages": MESSAGES, "stream": False,
+        }, timeout=300)
+        response.raise_for_status()
+        return response.json()["message"]["content"]
+    return call
+
+
+def timed(call, calls):
+    """Per-call latencies in milliseconds, after one untimed warm-up call."""
+    call()
+    out = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call()
+        out.append((time.perf_counter() - started) * 1000)
+    return out
+
+
+def summary(label, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"  {label:<8} mean {statistics.mean(latencies):8.3f} ms  "
+          f"median {statistics.median(latencies):8.3f} ms  p95 {p95:8.3f} ms")
+    return statistics.mean(latencies)
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--calls", type=int, default=200)
+    p.add_argument("--url", default=None,
+                   help="a real server instead of the in-process stub")
+    p.add_argument("--model", default="fake")
+    args = p.parse_args()
+
+    server = None
+    url = args.url
+    if url is None:
+        server = fake_ollama.serve(port=0)
+        url = fake_ollama.url(server)
+
+    client = Ollama(url, args.model, pool_size=1)
+    try:
+        print(f"{args.calls} calls to {client.url}\n")
+        fresh = summary("fresh", timed(fresh_call(client.url, args.model),
+                                       args.calls))
+        pooled = summary("pooled", timed(lambda: client.chat(MESSAGES),
+                                         args.calls))
+        print(f"\n  pooled saves {fresh - pooled:.3f} ms per call "
+              f"({fresh / pooled:.2f}x)")
+    finally:
+        client.close()
+        if server is not None:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
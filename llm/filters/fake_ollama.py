@@ -0,0 +1,219 @@
+"""
+A stand-in for Ollama's /api/chat, for measuring the harness with no model.
+
+Answers every chat request with a reply derived from a hash of the messages
+it was sent, so the same conversation always gets the same answer and two
+runs of a sweep produce identical results files. The reply has the shape the
+prompt asks for: a prompt that offers light gets a light action (never zone
+2), one that does not gets a note only.
+
+--latency holds each reply back for a fixed time, to stand in for the model's
+own generation time when judging how much concurrency buys. Requests are
+served on a thread each, like Ollama with OLLAMA_NUM_PARALLEL set, so the
+latency overlaps across concurrent sessions.
+
+A request with "stream": true is answered as Ollama answers it: NDJSON, a
+few characters of the reply per line, the latency spread evenly across them,
+and a final line with "done": true. The light action is written first and the
+note last, in the order the prompt lists them, so a streaming client has
+something to act on long before the reply ends.
+
+prompt_eval_count is reported as a server with a prefix cache would report
+it: only the part of the prompt that differs from the last conversation, so
+what the loop's history layout saves can be read off the turn log offline.
+
+Nothing here is a model. Replies carry no information about the state they
+were given beyond the hash; it exists for throughput, not for results.
+
+Usage:
+    python fake_ollama.py                         # port 11435, no latency
+    python fake_ollama.py --port 11500 --latency 0.5
+    python harness.py --url http://localhost:11435/api/chat
+    ./scripts/py llm/loop.py --replay synthetic --speed 600 --host http://localhost:11435
+"""
+
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PORT = 11435
+CHUNK_CHARS = 4                    # about a token's worth per streamed line
+# What /api/tags claims is pulled, so loop.py --check passes against it.
+MODELS = ["fake", "qwen2.5:14b"]
+ZONES = [0, 1, 3, 4, 5, 6, 7, 8]   # as the prompt offers them: zone 2 is out
+
+
+def reply_for(request):
+    """The deterministic reply to one /api/chat request body."""
+    messages = request.get("messages", [])
+    digest = hashlib.sha256(
+        json.dumps(messages, sort_keys=True).encode()).digest()
+    system = next((m["content"] for m in messages if m.get("role") == "system"),
+                  "")
+
+    reply = {}
+    if '"light"' in system:
+        reply["light"] = {"zone": ZONES[digest[4] % len(ZONES)],
+                          "intensity": round(digest[5] / 255, 2),
+                          "duration_s": 10 + digest[6] % 50}
+        reply["resource"] = None
+    reply["note"] = (f"fake reply {digest[:4].hex()} to {len(messages)} "
+                     f"messages. " + "Nothing here was read. " * 8).strip()
+    return reply
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, as Ollama does, so a pooled client can be told apart from
+    # one that connects per call.
+    protocol_version = "HTTP/1.1"
+    # Headers and body leave in one segment. Written separately, with Nagle
+    # on, the body waits on the client's delayed ACK: 40 ms per call that
+    # would be charged to keep-alive.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+    latency = 0.0
+
+    def do_GET(self):
+        if self.path != "/api/tags":
+            self.send_error(404)
+            return
+        body = json.dumps({"models": [{"name": m} for m in MODELS]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+        started = time.perf_counter_ns()
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self.send_error(400, "body is not JSON")
+            return
+
+        content = json.dumps(reply_for(request))
+        if request.get("stream", True):
+            self.stream(request, content, started)
+            return
+        if self.latency:
+            time.sleep(self.latency)
+
+        body = json.dumps({
+            **self.chunk(request, content),
+            **self.totals(request, content, started),
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, request, content, started):
+        """NDJSON, one chunk of content per line, with chunked encoding."""
+        pieces = [content[i:i + CHUNK_CHARS]
+                  for i in range(0, len(content), CHUNK_CHARS)]
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(line):
+            data = (json.dumps(line) + "\n").encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for piece in pieces:
+            if self.latency:
+                time.sleep(self.latency / len(pieces))
+            send({**self.chunk(request, piece), "done": False})
+        send({**self.chunk(request, ""),
+              **self.totals(request, content, started)})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    @staticmethod
+    def chunk(request, content):
+        return {
+            "model": request.get("model", "fake"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "message": {"role": "assistant", "content": content},
+        }
+
+    def totals(self, request, content, started):
+        return {
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": time.perf_counter_ns() - started,
+            "prompt_eval_count": self.evaluated(request, content),
+            "eval_count": len(content) // 4,
+        }
+
+    def evaluated(self, request, content):
+        """Prompt tokens a server with a prefix cache would have to encode.
+
+        As Ollama does, remembers the last conversation -- the prompt and
+        the reply generated to it -- and counts only the messages after the
+        point a new prompt stops matching it, at about four characters a
+        token. One cache for the whole server, so concurrent sessions evict
+        each other much as they would on a real one.
+        """
+        messages = request.get("messages", [])
+        with self.cache_lock:
+            cached = self.cache.get("conversation", [])
+            shared = 0
+            while (shared < min(len(messages), len(cached))
+                   and messages[shared] == cached[shared]):
+                shared += 1
+            self.cache["conversation"] = messages + [
+                {"role": "assistant", "content": content}]
+        return sum(len(m.get("content", "")) for m in messages[shared:]) // 4
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=PORT, latency=0.0, host="127.0.0.1"):
+    """Start the server on a daemon thread. Returns it; .shutdown() stops it.
+
+    port=0 takes any free port: the one chosen is server.server_port.
+    """
+    handler = type("FakeOllama", (Handler,), {
+        "latency": latency, "cache": {}, "cache_lock": threading.Lock()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def url(server):
+    """The /api/chat URL of a server returned by serve()."""
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/api/chat"
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--port", type=int, default=PORT)
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--latency", type=float, default=0.0,
+                   help="seconds to hold each reply")
+    args = p.parse_args()
+
+    server = serve(args.port, args.latency, args.host)
+    print(f"fake ollama on {url(server)}, latency {args.latency}s")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,21 +10,29 @@ you did not plant, that is confabulation. If it misses one you did plant, the
 reduction is throwing it away. Neither can be established with real
 recordings.
 
+One session runs its turns in series, because each turn's history is the
+turns before it. Many sessions at once -- seeds, prompts, history on and off
+-- are sweep.py's job.
+
 Usage:
     python harness.py                    # default session, BLIND prompt
     python harness.py --prompt null
     python harness.py --turns 40 --interval 300
     python harness.py --no-history       # ablation: does history help?
+    python harness.py --url http://localhost:11435/api/chat   # fake_ollama.py
+    python harness.py --url http://laptop:11434 http://desktop:11434
 """
 
 import argparse
 import json
+import threading
 from datetime import timedelta
 
 import numpy as np
-import requests
 
-from reducer import SAMPLE_HZ, reduce_window
+from incremental import IncrementalReducer
+from ollama_client import OllamaPool
+from reducer import SAMPLE_HZ
 
 OLLAMA = "http://localhost:11434/api/chat"
 MODEL = "qwen2.5:14b"
@@ -33,6 +41,12 @@ WINDOW_S = 1800          # what the model sees
 TURN_INTERVAL_S = 600    # how often it speaks
 HISTORY_TURNS = 8        # how far back it remembers
 
+# Connections kept open per endpoint. sweep.py raises it to its concurrency,
+# so no session in flight waits on another for a connection.
+POOL_SIZE = 4
+_clients = {}
+_clients_lock = threading.Lock()
+
 PROMPTS = {}
 
 PROMPTS["blind"] = """You are coupled to a system you cannot observe directly.
@@ -88,7 +102,9 @@ def session(duration_s, events=(), n_channels=3, lag_s=12, seed=0):
     for start, end, param, value in events:
         i, j = int(start * SAMPLE_HZ), int(end * SAMPLE_HZ)
         ramp = np.linspace(baseline[param], value, max(j - i, 1))
-        tracks[param][i:j] = ramp
+        # Clipped, so a session shorter than its events ends mid-ramp instead
+        # of failing to build.
+        tracks[param][i:j] = ramp[:len(tracks[param][i:j])]
         tracks[param][j:] = value
 
     # Integrate phase so a changing period stays continuous.
@@ -115,61 +131,55 @@ def slice_window(channels, end_s):
 # ---------------------------------------------------------------------------
 
 
-def ask(system, state, history, retries=2):
-    messages = [{"role": "system", "content": system}]
-    messages += history[-HISTORY_TURNS * 2:]
-    messages.append({"role": "user", "content": json.dumps(state)})
-
-    last_error = None
-    for attempt in range(retries + 1):
-        r = requests.post(OLLAMA, json={
-            "model": MODEL,
-            "messages": messages,
-            "stream": False,
-            # Constrains sampling to valid JSON. Without this the model
-            # occasionally emits a literal newline inside a string and the
-            # parse fails, which loses the turn.
-            "format": "json",
-            # Retries at a lower temperature, so a second attempt is a
-            # genuine second try rather than the same dice roll.
-            "options": {"temperature": 0.8 if attempt == 0 else 0.3},
-        }, timeout=300)
-        r.raise_for_status()
-
-        text = r.json()["message"]["content"]
-        cleaned = text.replace("```json", "").replace("```", "").strip()
+def client(url=OLLAMA):
+    """The shared client for `url`, made on first use.
 
-        try:
-            return json.loads(cleaned)
-        except json.JSONDecodeError as e:
-            last_error = e
-            # Salvage the common case: unescaped control characters inside
-            # an otherwise well formed string.
-            try:
-                return json.loads(cleaned, strict=False)
-            except json.JSONDecodeError:
-                pass
-
-    raise ValueError(f"unparseable after {retries + 1} attempts: "
-                     f"{last_error}\nraw: {cleaned[:400]}")
-
-
-def run(turns, interval, prompt, use_history, events, out):
-    channels = session(duration_s=WINDOW_S + turns * interval, events=events)
+    url is one endpoint or a list of them. One client per distinct set for
+    the life of the process, so every turn of every session -- and every
+    session in a sweep, across threads -- reuses the same keep-alive
+    connections, and concurrent sessions spread over every endpoint that is
+    answering.
+    """
+    urls = (url,) if isinstance(url, str) else tuple(url)
+    with _clients_lock:
+        if urls not in _clients:
+            _clients[urls] = OllamaPool(urls, MODEL, pool_size=POOL_SIZE)
+        return _clients[urls]
+
+
+def ask(system, state, history, retries=2, url=OLLAMA):
+    return client(url).ask(system, state, history[-HISTORY_TURNS * 2:],
+                           retries=retries)
+
+
+def replay(turns, interval, prompt, use_history, events, seed=0, url=OLLAMA,
+           verbose=True):
+    """Run one session through the model, turn by turn. Returns the log."""
+    channels = session(duration_s=WINDOW_S + turns * interval, events=events,
+                       seed=seed)
     system = PROMPTS[prompt]
 
     history, log = [], []
     previous = None
 
+    # Slid rather than re-reduced: each turn pushes only the interval's new
+    # samples, so a multi-day session costs what its new data costs.
+    reducer = IncrementalReducer(WINDOW_S)
+    pushed = 0
+
     for turn in range(turns):
         end_s = WINDOW_S + turn * interval
-        state = reduce_window(slice_window(channels, end_s), previous)
+        end = int(end_s * SAMPLE_HZ)
+        reducer.push({k: v[pushed:end] for k, v in channels.items()})
+        pushed = end
+        state = reducer.state(previous)
         previous = state
 
         try:
-            reply = ask(system, state, history if use_history else [])
+            reply = ask(system, state, history if use_history else [], url=url)
         except Exception as e:
-            print(f"turn {turn} failed: {e}")
+            if verbose:
+                print(f"turn {turn} failed: {e}")
             log.append({"turn": turn, "elapsed": str(timedelta(seconds=end_s)),
                         "state": state, "reply": None, "error": str(e)})
             continue
@@ -178,12 +188,15 @@ def run(turns, interval, prompt, use_history, events, out):
         planted = [e for e in events if e[0] <= end_s <= e[1] + interval]
 
         log.append({"turn": turn, "elapsed": stamp, "state": state,
-                    "reply": reply, "events_active": planted})
+                    "reply": reply, "events_active": planted,
+                    "endpoint": client(url).last_endpoint})
 
         if use_history:
             history.append({"role": "user", "content": json.dumps(state)})
             history.append({"role": "assistant", "content": json.dumps(reply)})
 
+        if not verbose:
+            continue
         marker = "  <-- planted" if planted else ""
         period = state["ch0"]["period_s"]
         print(f"\n[{stamp}] period {period}s{marker}")
@@ -191,6 +204,22 @@ def run(turns, interval, prompt, use_history, events, out):
             print(f"  zone {reply['light'].get('zone')}")
         print(f"  {reply.get('note', '')[:280]}")
 
+    return log
+
+
+def planted_events(interval):
+    """One real event: the period lengthens from 90s to 140s over turns 10-14.
+
+    Nothing at all happens anywhere else. Any other event the model reports
+    is its own invention.
+    """
+    start = WINDOW_S + 10 * interval
+    return [(start, start + 4 * interval, "period_s", 140.0)]
+
+
+def run(turns, interval, prompt, use_history, events, out, seed=0, url=OLLAMA):
+    log = replay(turns, interval, prompt, use_history, events, seed=seed,
+                 url=url)
     with open(out, "w") as f:
         json.dump(log, f, indent=2)
     print(f"\nwrote {out}")
@@ -203,20 +232,19 @@ def main():
     p.add_argument("--prompt", default="blind", choices=list(PROMPTS))
     p.add_argument("--no-history", action="store_true")
     p.add_argument("--out", default="session.json")
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--url", nargs="+", default=[OLLAMA],
+                   help="one or more Ollama servers")
     args = p.parse_args()
 
-    # One real event: the period lengthens from 90s to 140s over turns 10-14.
-    # Nothing at all happens anywhere else. Any other event the model
-    # reports is its own invention.
-    start = WINDOW_S + 10 * args.interval
-    events = [(start, start + 4 * args.interval, "period_s", 140.0)]
+    events = planted_events(args.interval)
 
     print(f"{args.turns} turns, {args.interval}s apart, "
           f"{args.prompt} prompt, history {'off' if args.no_history else 'on'}")
     print(f"planted: period 90s -> 140s across turns 10 to 14\n")
 
     run(args.turns, args.interval, args.prompt,
-        not args.no_history, events, args.out)
+        not args.no_history, events, args.out, seed=args.seed, url=args.url)
 
 
 if __name__ == "__main__":
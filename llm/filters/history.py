@@ -0,0 +1,104 @@
+"""
+Conversation history for the live loop, laid out so the model can reuse it.
+
+Ollama keeps the KV cache of the prompt it last evaluated, and evaluates only
+what follows the longest prefix a new prompt shares with it. A turn's prompt
+is the system prompt, the history, then the new state. If the history is
+append-only, everything up to the new state is the previous prompt plus the
+previous reply, and only the newest turn costs anything to encode.
+
+The old layout made that impossible. It sent the last LLM_HISTORY_TURNS
+turns, so once the history was full the oldest turn dropped out every turn,
+and the prompt diverged from its predecessor straight after the system prompt.
+Every turn re-encoded all of it: up to sixteen messages, each state carrying
+sixty coarse points per channel.
+
+Two changes:
+
+  Trimming in blocks. When the window is over its length, the oldest half is
+  dropped at once rather than a turn at a time. Between drops the history
+  only grows at the end and the prefix holds. The model sees between half and
+  all of LLM_HISTORY_TURNS, never more.
+
+  Compaction when the cache is cold. Whenever the whole history has to be
+  re-encoded anyway -- the model was unloaded, or a block was just dropped --
+  the older states are replaced by their own changes_since_last_turn, the
+  part of a state that describes how it differed from the one before. The
+  most recent keep_full turns stay whole. A compacted turn stays compacted,
+  so the next warm turn finds exactly the prefix this one sent.
+
+Each message's text is rendered once, when the turn is added, so a turn
+renders to the same bytes however often it is resent.
+"""
+
+import json
+
+
+class History:
+    """The (state, reply) pairs of past turns, as chat messages."""
+
+    def __init__(self, turns, keep_full=2):
+        self.turns = turns
+        self.step = max(1, turns // 2)
+        self.keep_full = keep_full
+        # Only the turns still in the window; a dropped block is deleted, so
+        # the list stays within turns + 1 entries however long the loop runs.
+        self.entries = []
+
+    def __len__(self):
+        return len(self.entries)
+
+    def append(self, state, reply, text=None):
+        """Add a finished turn.
+
+        text is the reply exactly as the model generated it, when known. It
+        is what gets sent back, so it matches the tokens the server cached.
+        """
+        if self.turns <= 0:
+            return
+        changes = state.get("changes_since_last_turn")
+        self.entries.append({
+            "full": json.dumps(state),
+            # The first turn has nothing to have changed from, so it has no
+            # compact form and is only ever dropped whole.
+            "compact": (json.dumps({"changes_since_last_turn": changes})
+                        if changes is not None else None),
+            "reply": text if text is not None else json.dumps(reply),
+            "compacted": False,
+        })
+
+    def messages(self, warm=True):
+        """(messages, info) for the next turn.
+
+        warm says whether the server still holds the last prompt. info is for
+        the turn log: whether the prefix is expected to be cached, how many
+        turns are included, and how many of those are compacted.
+        """
+        if self.turns <= 0:
+            return [], {"cache": "off", "turns": 0, "compacted": 0}
+
+        moved = False
+        if len(self.entries) > self.turns:
+            over = len(self.entries) - self.turns
+            drop = -(-over // self.step) * self.step
+            del self.entries[:drop]
+            moved = True
+
+        n = len(self.entries)
+        cold = not warm or moved
+        if cold:
+            for entry in self.entries[:n - self.keep_full]:
+                if entry["compact"] is not None:
+                    entry["compacted"] = True
+
+        messages = []
+        for entry in self.entries:
+            content = entry["compact"] if entry["compacted"] else entry["full"]
+            messages.append({"role": "user", "content": content})
+            messages.append({"role": "assistant", "content": entry["reply"]})
+
+        return messages, {
+            "cache": "cold" if cold else "warm",
+            "turns": n,
+            "compacted": sum(e["compacted"] for e in self.entries),
+        }
@@ -0,0 +1,428 @@
+"""
+reduce_window over a sliding window, updated per turn instead of recomputed.
+
+Consecutive turns share two thirds of their samples -- a 1800 s window moved
+on by a 600 s interval -- and reduce_window throws all of it away each time,
+re-running an O(n^2) autocorrelation, two polyfits per channel and a rolled
+copy of every channel per candidate lag. Over a multi-day replay that is most
+of the cost of the run.
+
+IncrementalReducer keeps, per channel, a ring buffer of the window, running
+sums of the samples, and the lag products sum(x[i] * x[i + k]) for every lag
+the period search can look at; per adjacent pair, the cross products for every
+lag the phase search can look at. Sliding the window adds the products that
+involve new samples and subtracts the ones that involved evicted samples:
+O(new samples x lag band), not O(window^2).
+
+Everything reduce_window reports is then recovered from those sums:
+
+  * the linear fit comes from the sums in closed form
+  * the autocorrelation of the *detrended* signal is the raw lag products with
+    the fit's contribution expanded out algebraically, so nothing is ever
+    re-detrended and re-correlated
+  * the circular cross-correlation phase_lag scans is the linear lag products
+    plus the few wrapped-around terms at the window's ends
+
+Percentiles and the coarse means are taken off the ring buffer directly. They
+are O(window), vectorised, and small next to what they sit beside.
+
+The output is the same state dict reduce_window produces, key for key, and
+matches it to the reported resolution -- `parity.py` holds it to that. Until
+the window first fills it simply calls reduce_window, which is also what the
+start of any live run does.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from reducer import (LAG_QUANTUM_S, PERIOD_MAX, PERIOD_MIN, PERIOD_QUANTUM_S,
+                     SAMPLE_HZ, coarse, compare, reduce_window)
+
+# Longest autocorrelation lag dominant_period can choose, and the widest lag
+# phase_lag can search: half the longest period it could be handed.
+MAX_PERIOD_LAG = int(PERIOD_MAX * SAMPLE_HZ)
+MAX_PHASE_LAG = int(PERIOD_MAX * SAMPLE_HZ / 2)
+
+
+def lag_products(values, partners, start, stop, max_lag):
+    """sum(values[j] * partners[j - k]) over j in [start, stop), k = 0..max_lag.
+
+    A partner index below zero contributes nothing. One matrix product over a
+    strided view, so no rolled or shifted copies are made.
+    """
+    padded = np.concatenate((np.zeros(max_lag), partners))
+    windows = sliding_window_view(padded, max_lag + 1)[start:stop]
+    return (values[start:stop] @ windows)[::-1]
+
+
+class _Channel:
+    """One channel's ring buffer, running sums and autocorrelation products.
+
+    Samples are held shifted by the first value the channel ever saw. Every
+    quantity reported is invariant to a constant offset, and electrode offsets
+    of tens of millivolts under a signal of one or two would otherwise cost
+    the running sums most of their precision.
+    """
+
+    def __init__(self, capacity):
+        self.ring = np.zeros(capacity)
+        self.offset = None
+        self.sum = 0.0
+        self.sum_sq = 0.0
+        # sum((position - origin) * y) with absolute positions, re-based at
+        # every resync so the weights never grow large.
+        self.sum_pos = 0.0
+        self.products = np.zeros(MAX_PERIOD_LAG + 1)
+
+
+class IncrementalReducer:
+    """Sliding-window reducer. `push` new samples, then ask for `state`.
+
+        reducer = IncrementalReducer(1800)
+        reducer.push(first_half_hour)        # {name: array of volts}
+        state = reducer.state()
+        reducer.push(next_ten_minutes)
+        state = reducer.state(previous=state)
+
+    Channels are pushed together and in equal lengths; their order is the
+    order of the first push, which fixes the phase-lag pairs the way the dict
+    order does for reduce_window.
+    """
+
+    def __init__(self, window_s=1800, sample_hz=SAMPLE_HZ):
+        self.capacity = int(window_s * sample_hz)
+        if self.capacity <= MAX_PERIOD_LAG + 1:
+            raise ValueError(f"window of {self.capacity} samples is too short "
+                             f"for lags up to {MAX_PERIOD_LAG}")
+        self.names = None
+        self.total = 0
+        self._channels = {}
+        self._cross = {}
+        self._origin = 0
+        self._since_resync = 0
+
+    # --- window bookkeeping -------------------------------------------------
+
+    @property
+    def count(self):
+        """Samples currently in the window."""
+        return min(self.total, self.capacity)
+
+    def _span(self, channel, start, stop):
+        """Shifted samples at absolute positions [start, stop), in order."""
+        if stop <= start:
+            return np.zeros(0)
+        idx = np.arange(start, stop) % self.capacity
+        return channel.ring[idx]
+
+    def window(self, name):
+        """The current window of one channel, in volts, oldest first."""
+        channel = self._channels[name]
+        return self._span(channel, self.total - self.count, self.total) + channel.offset
+
+    # --- updates ------------------------------------------------------------
+
+    def push(self, channels):
+        """Slide the window on by the new samples in `channels`."""
+        if self.names is None:
+            self.names = list(channels)
+            self._channels = {name: _Channel(self.capacity) for name in self.names}
+            self._cross = {(a, b): [np.zeros(MAX_PHASE_LAG + 1),
+                                    np.zeros(MAX_PHASE_LAG + 1)]
+                           for a, b in zip(self.names, self.names[1:])}
+        if list(channels) != self.names:
+            raise ValueError(f"channels {list(channels)} differ from {self.names}")
+
+        blocks = {name: np.asarray(channels[name], dtype=float)
+                  for name in self.names}
+        lengths = {len(block) for block in blocks.values()}
+        if len(lengths) != 1:
+            raise ValueError("channels must be pushed in equal lengths")
+        m = lengths.pop()
+        if m == 0:
+            return
+
+        for name, block in blocks.items():
+            channel = self._channels[name]
+            if channel.offset is None:
+                channel.offset = float(block[0])
+            blocks[name] = block - channel.offset
+
+        if m >= self.capacity:
+            # Nothing survives the slide; start again from the last window.
+            self.total += m - self.capacity
+            for name, block in blocks.items():
+                self._write(self._channels[name], block[-self.capacity:],
+                            self.total)
+            self.total += self.capacity
+            self._resync()
+            return
+
+        lo = self.total - self.count
+        new_lo = max(0, self.total + m - self.capacity)
+
+        # Evicted samples first, while they are still in the ring.
+        if new_lo > lo:
+            self._evict(lo, new_lo)
+
+        for name, block in blocks.items():
+            channel = self._channels[name]
+            self._write(channel, block, self.total)
+        self._admit(self.total, self.total + m, new_lo)
+        self.total += m
+
+        self._since_resync += m
+        if self._since_resync >= self.capacity:
+            # Once per turnover of the window, recompute every sum exactly.
+            # Adding and subtracting for days would otherwise let rounding
+            # walk; this costs one batch pass per window's worth of samples.
+            self._resync()
+
+    def _write(self, channel, block, start):
+        idx = np.arange(start, start + len(block)) % self.capacity
+        channel.ring[idx] = block
+
+    def _evict(self, lo, new_lo):
+        """Subtract every product with its earlier sample in [lo, new_lo)."""
+        end = self.total
+        for channel in self._channels.values():
+            gone = self._span(channel, lo, new_lo)
+            channel.sum -= gone.sum()
+            channel.sum_sq -= gone @ gone
+            channel.sum_pos -= np.arange(lo - self._origin,
+                                         new_lo - self._origin) @ gone
+            channel.products -= self._leading(channel, channel, lo, new_lo,
+                                              end, MAX_PERIOD_LAG)
+        for (a, b), (forward, backward) in self._cross.items():
+            first, second = self._channels[a], self._channels[b]
+            # forward[L] pairs a[i] with b[i - L]; its earlier sample is b's.
+            forward -= self._leading(first, second, lo, new_lo, end,
+                                     MAX_PHASE_LAG, earlier_is_partner=True)
+            backward -= self._leading(second, first, lo, new_lo, end,
+                                      MAX_PHASE_LAG, earlier_is_partner=True)
+
+    def _leading(self, values, partners, lo, new_lo, end, max_lag,
+                 earlier_is_partner=False):
+        """Products whose earlier sample is evicted and later one is not new.
+
+        sum(values[j] * partners[j - k]) over pairs with the earlier position
+        in [lo, new_lo) and the later one below `end`. Read backwards, that is
+        lag_products over the reversed span.
+        """
+        stop = min(new_lo + max_lag, end)
+        if earlier_is_partner:
+            # Earlier sample from `partners`, later from `values`.
+            early = self._span(partners, lo, stop)[::-1]
+            late = self._span(values, lo, stop)[::-1]
+        else:
+            early = self._span(values, lo, stop)[::-1]
+            late = self._span(partners, lo, stop)[::-1]
+        n = stop - lo
+        return lag_products(early, late, n - (new_lo - lo), n, max_lag)
+
+    def _admit(self, start, stop, new_lo):
+        """Add every product whose later sample is in [start, stop)."""
+        for channel in self._channels.values():
+            fresh = self._span(channel, start, stop)
+            channel.sum += fresh.sum()
+            channel.sum_sq += fresh @ fresh
+            channel.sum_pos += np.arange(start - self._origin,
+                                         stop - self._origin) @ fresh
+            channel.products += self._trailing(channel, channel, start, stop,
+                                               new_lo, MAX_PERIOD_LAG)
+        for (a, b), (forward, backward) in self._cross.items():
+            first, second = self._channels[a], self._channels[b]
+            forward += self._trailing(first, second, start, stop, new_lo,
+                                      MAX_PHASE_LAG)
+            backward += self._trailing(second, first, start, stop, new_lo,
+                                       MAX_PHASE_LAG)
+
+    def _trailing(self, values, partners, start, stop, new_lo, max_lag):
+        """sum(values[j] * partners[j - k]) for new j, partners in the window."""
+        first = max(new_lo, start - max_lag)
+        late = self._span(values, first, stop)
+        early = self._span(partners, first, stop)
+        return lag_products(late, early, start - first, stop - first, max_lag)
+
+    def _resync(self):
+        """Recompute every running sum exactly from the ring buffer."""
+        n = self.count
+        lo = self.total - n
+        self._origin = lo
+        self._since_resync = 0
+        spans = {name: self._span(channel, lo, self.total)
+                 for name, channel in self._channels.items()}
+        positions = np.arange(n)
+        for name, channel in self._channels.items():
+            y = spans[name]
+            channel.sum = y.sum()
+            channel.sum_sq = y @ y
+            channel.sum_pos = positions @ y
+            channel.products = lag_products(y, y, 0, n, MAX_PERIOD_LAG)
+        for (a, b), pair in self._cross.items():
+            pair[0] = lag_products(spans[a], spans[b], 0, n, MAX_PHASE_LAG)
+            pair[1] = lag_products(spans[b], spans[a], 0, n, MAX_PHASE_LAG)
+
+    # --- the state dict -----------------------------------------------------
+
+    def state(self, previous=None):
+        """The state dict reduce_window would return for the current window."""
+        if self.names is None:
+            raise ValueError("nothing pushed yet")
+        if self.count < self.capacity:
+            return reduce_window({name: self.window(name) for name in self.names},
+                                 previous)
+
+        spans = {name: self._span(channel, self.total - self.capacity, self.total)
+                 for name, channel in self._channels.items()}
+        state = {name: self._describe(self._channels[name], spans[name])
+                 for name in self.names}
+
+        periods = [state[n]["period_s"] for n in self.names if state[n]["period_s"]]
+        reference = float(np.median(periods)) if periods else None
+
+        state["phase_lags_s"] = {
+            f"{a}->{b}": self._phase_lag(a, b, spans, reference)
+            for a, b in zip(self.names, self.names[1:])
+        }
+
+        if previous is not None:
+            state["changes_since_last_turn"] = compare(previous, state, self.names)
+        return state
+
+    def _fit(self, channel, n):
+        """(intercept, slope) of the least squares line, from the sums."""
+        # Window-relative positions: sum(i * y) with i counted from the start.
+        lo = self.total - n
+        sum_iy = channel.sum_pos - (lo - self._origin) * channel.sum
+        t_mean = (n - 1) / 2
+        t_var = n * (n * n - 1) / 12
+        slope = (sum_iy - t_mean * channel.sum) / t_var
+        intercept = channel.sum / n - slope * t_mean
+        return intercept, slope, sum_iy
+
+    def _residual_autocorrelation(self, channel, y, intercept, slope, sum_iy):
+        """sum(r[i] * r[i + k]) of the detrended window, from the lag products.
+
+        r[i] = y[i] - intercept - slope * i. Expanding the product leaves the
+        raw lag product plus sums over the head and tail of the window, which
+        are the only parts of it the fit touches differently at each lag.
+        """
+        n = len(y)
+        k = np.arange(MAX_PERIOD_LAG + 1)
+        idx = np.arange(n)
+
+        head = np.concatenate(([0.0], np.cumsum(y[:MAX_PERIOD_LAG])))
+        head_pos = np.concatenate(([0.0], np.cumsum(idx[:MAX_PERIOD_LAG]
+                                                     * y[:MAX_PERIOD_LAG])))
+        tail_y = y[n - MAX_PERIOD_LAG:][::-1]
+        tail_i = idx[n - MAX_PERIOD_LAG:][::-1]
+        tail = np.concatenate(([0.0], np.cumsum(tail_y)))
+        tail_pos = np.concatenate(([0.0], np.cumsum(tail_i * tail_y)))
+
+        leading = channel.sum - tail          # sum(y[i]) for i < n - k
+        leading_pos = sum_iy - tail_pos       # sum(i * y[i]) for i < n - k
+        lagging = channel.sum - head          # sum(y[j]) for j >= k
+        lagging_pos = (sum_iy - head_pos) - k * lagging  # sum((j - k) * y[j])
+
+        m = n - k
+        i1 = m * (m - 1) / 2
+        i2 = (m - 1) * m * (2 * m - 1) / 6
+        a, b = intercept, slope
+        return (channel.products
+                - a * (leading + lagging)
+                - b * (leading_pos + k * leading + lagging_pos)
+                + m * a * a
+                + a * b * (2 * i1 + k * m)
+                + b * b * (i2 + k * i1))
+
+    def _describe(self, channel, y):
+        """describe_channel, off the sums."""
+        n = len(y)
+        intercept, slope, sum_iy = self._fit(channel, n)
+        autocorr = self._residual_autocorrelation(channel, y, intercept, slope,
+                                                  sum_iy)
+        residuals = y - (intercept + slope * np.arange(n))
+
+        iqr = np.percentile(residuals, 75) - np.percentile(residuals, 25)
+        return {
+            "period_s": self._period(autocorr, n),
+            "amplitude_mv": round(float(iqr) * 1.414 * 1000, 2),
+            "drift_mv_per_min": self._drift(autocorr, residuals, slope, n),
+            "coarse_mv": coarse(y + channel.offset),
+        }
+
+    @staticmethod
+    def _period(autocorr, n):
+        """dominant_period on the detrended window."""
+        if np.sqrt(max(autocorr[0], 0.0) / n) < 1e-12:
+            return None
+        corr = autocorr / autocorr[0]
+
+        lo, hi = int(PERIOD_MIN * SAMPLE_HZ), int(PERIOD_MAX * SAMPLE_HZ)
+        hi = min(hi, n - 1)
+        if hi <= lo:
+            return None
+
+        band = corr[lo:hi]
+        peak = int(np.argmax(band))
+        if band[peak] < 0.2:
+            return None
+
+        raw = float(peak + lo) / SAMPLE_HZ
+        return round(raw / PERIOD_QUANTUM_S) * PERIOD_QUANTUM_S
+
+    @staticmethod
+    def _drift(autocorr, residuals, slope, n):
+        """drift(), with the residual sums already in hand."""
+        t_var = n * (n * n - 1) / 12
+        se = np.sqrt(max(autocorr[0], 0.0) / (n - 2) / t_var)
+
+        # corrcoef(r[:-1], r[1:]). The residuals sum to zero, so the two
+        # shifted sums are just the end sample left off each.
+        m = n - 1
+        first, last = residuals[0], residuals[-1]
+        su, sv = -last, -first
+        suu = autocorr[0] - last * last
+        svv = autocorr[0] - first * first
+        cov = autocorr[1] - su * sv / m
+        with np.errstate(invalid='ignore', divide='ignore'):
+            r1 = cov / np.sqrt((suu - su * su / m) * (svv - sv * sv / m))
+        r1 = min(max(r1, 0.0), 0.99)
+        se *= np.sqrt((1 + r1) / (1 - r1))
+
+        if abs(slope) < 2 * se:
+            return None
+        return round(float(slope) * 60 * 1000, 3)
+
+    def _phase_lag(self, a, b, spans, period):
+        """phase_lag, from the linear cross products plus the wrapped ends."""
+        first, second = self._channels[a], self._channels[b]
+        n = self.capacity
+        if period is None:
+            return None
+        for channel in (first, second):
+            var = channel.sum_sq / n - (channel.sum / n) ** 2
+            if np.sqrt(max(var, 0.0)) < 1e-12:
+                return None
+
+        span = int(period * SAMPLE_HZ / 2)
+        forward, backward = self._cross[(a, b)]
+        ya, yb = spans[a], spans[b]
+
+        # np.roll(b, lag) is circular. Its products are the linear ones at
+        # that lag plus the `lag` pairs that wrapped: the head of one channel
+        # against the tail of the other.
+        width = MAX_PHASE_LAG
+        wrapped_pos = np.correlate(yb[n - width:], ya[:width], mode="full")
+        wrapped_neg = np.correlate(ya[n - width:], yb[:width], mode="full")
+        lags = np.arange(1, span + 1)
+        positive = forward[lags] + wrapped_pos[2 * width - 1 - lags]
+        negative = backward[lags] + wrapped_neg[2 * width - 1 - lags]
+
+        # Scored in the order phase_lag scans them, so ties break the same way.
+        # The mean and scale normalisation it applies shift and stretch every
+        # score alike, so they cannot move the argmax and are left out.
+        scores = np.concatenate((negative[::-1], [forward[0]], positive))
+        raw = float(int(np.argmax(scores)) - span) / SAMPLE_HZ
+        return round(-raw / LAG_QUANTUM_S) * LAG_QUANTUM_S
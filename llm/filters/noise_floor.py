@@ -9,6 +9,10 @@ apparent responsiveness you get from nothing at all, and therefore what
 change in real input you would need before a difference in output means
 anything.
 
+Runs go out concurrently, one at a time per endpoint in ENDPOINTS, so
+listing more than one server spreads them across all that are answering.
+The input is frozen, so the order they finish in does not matter.
+
 Usage:
     python noise_floor.py            # NULL prompt, describe only
     python noise_floor.py blind      # BLIND prompt, includes actions
@@ -17,12 +21,13 @@ Usage:
 import json
 import sys
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-import requests
-
+from ollama_client import OllamaPool
 from reducer import reduce_window, synth
 
 OLLAMA = "http://localhost:11434/api/chat"
+ENDPOINTS = [OLLAMA]
 MODEL = "qwen2.5:14b"
 RUNS = 50
 
@@ -64,17 +69,18 @@ CAUSAL_WORDS = [
 ]
 
 
+# Keep-alive connections for all RUNS calls, through the same client the
+# live loop uses. Deliberately not client.ask(): that constrains the output
+# to JSON and retries at a lower temperature, and the noise floor is
+# measuring the model's variation without either.
+CLIENT = OllamaPool(ENDPOINTS, MODEL, pool_size=1)
+
+
 def ask(system, state):
-    r = requests.post(OLLAMA, json={
-        "model": MODEL,
-        "messages": [
-            {"role": "system", "content": system},
-            {"role": "user", "content": json.dumps(state)},
-        ],
-        "stream": False,
-    }, timeout=300)
-    r.raise_for_status()
-    text = r.json()["message"]["content"]
+    text = CLIENT.chat([
+        {"role": "system", "content": system},
+        {"role": "user", "content": json.dumps(state)},
+    ])
     return json.loads(text.replace("```json", "").replace("```", "").strip())
 
 
@@ -93,23 +99,25 @@ def main():
 
     zones, notes, causal = [], [], 0
 
-    for i in range(RUNS):
-        try:
-            reply = ask(system, state)
-        except Exception as e:
-            print(f"  run {i} failed: {e}")
-            continue
+    with ThreadPoolExecutor(max_workers=len(ENDPOINTS)) as pool:
+        futures = {pool.submit(ask, system, state): i for i in range(RUNS)}
+        for done, future in enumerate(as_completed(futures)):
+            try:
+                reply = future.result()
+            except Exception as e:
+                print(f"  run {futures[future]} failed: {e}")
+                continue
 
-        note = reply.get("note", "")
-        notes.append(note)
+            note = reply.get("note", "")
+            notes.append(note)
 
-        if any(w in note.lower() for w in CAUSAL_WORDS):
-            causal += 1
+            if any(w in note.lower() for w in CAUSAL_WORDS):
+                causal += 1
 
-        if "light" in reply:
-            zones.append(reply["light"].get("zone"))
+            if "light" in reply:
+                zones.append(reply["light"].get("zone"))
 
-        print(f"  {i + 1}/{RUNS}", end="\r", flush=True)
+            print(f"  {done + 1}/{RUNS}", end="\r", flush=True)
 
     print(f"\n\ncompleted {len(notes)} runs")
 
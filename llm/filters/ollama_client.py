@@ -0,0 +1,623 @@
+"""
+Chat client for Ollama, shared by the live loop and the tools in this folder.
+
+One pooled requests.Session per client, so a turn -- and a retry within a
+turn -- reuses the connection the previous turn opened rather than setting up
+a new TCP connection (and, over Tailscale, a new path) to the laptop every
+time. Each call used to be a bare requests.post, which opens a connection and
+throws it away.
+
+Timeouts are split three ways, because they fail for different reasons:
+
+    connect_timeout   how long to wait for the laptop to answer at all. Short:
+                      a sleeping laptop or a dropped tailnet shows up here, and
+                      waiting five minutes to find that out loses the turn.
+    read_timeout      the longest silence allowed between bytes once the
+                      request is in. Long: with stream off, Ollama says nothing
+                      until the whole reply is generated.
+    timeout           the overall budget for one ask(), across every attempt.
+                      No single read is allowed past what is left of it.
+
+Failures to connect, and 502/503/504 from a proxy or a model still loading,
+are retried inside the transport with exponential backoff. A read that times
+out is not: the model was generating, and asking it to start again will not
+be faster. Unparseable replies are retried by ask() itself, at a lower
+temperature, as before.
+
+ask_streaming() asks for the same reply as NDJSON chunks and watches the
+JSON arrive. Each top-level field is handed to a callback the moment its
+value is syntactically complete, so the loop can act on "light" while "note"
+-- by far the longest field, and the last -- is still being generated. With
+stream off, Ollama says nothing until the note is finished.
+
+OllamaPool puts several servers, or several models, behind the same
+interface, with background health checks, least-loaded routing and failover
+inside the turn's deadline.
+
+Prefix reuse. Ollama keeps the KV cache of the last prompt it evaluated for
+as long as the model stays loaded, and a new prompt that begins with the
+same tokens skips straight to where they diverge. Two things defeat that
+here, and the client handles the first: Ollama unloads a model after five
+idle minutes by default, and turns are ten minutes apart, so every turn
+reloaded the model and re-encoded everything. keep_alive is now sent with
+every request. The second, a history window that slides by a turn every
+turn and so changes the prefix every turn, is history.History's job.
+
+After each call the server's own accounting -- prompt tokens evaluated, and
+how long that and the generation took -- is kept in last_stats, so the
+saving can be read off the turn log rather than assumed.
+"""
+
+import json
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+CHAT_PATH = "/api/chat"
+
+# From the final response object, as Ollama names them. Durations are in
+# nanoseconds there and in seconds in last_stats.
+STAT_COUNTS = ("prompt_eval_count", "eval_count")
+STAT_DURATIONS = ("prompt_eval_duration", "eval_duration", "load_duration",
+                  "total_duration")
+
+
+class FieldScanner:
+    """Top-level fields of a JSON object, each as soon as it has arrived.
+
+    feed() takes the reply text a chunk at a time and returns the (key,
+    value) pairs whose values finished inside that chunk. Objects, arrays
+    and strings are complete at their closing character. Numbers, true,
+    false and null have none, so they complete at the comma or brace after
+    them. Anything before the opening brace, such as a ```json fence, is
+    skipped.
+
+    Only ever a preview. The reply is still parsed whole at the end, and
+    that parse is what gets recorded.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._expect = None      # at depth 1: "key", "colon", "value", "comma"
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def _complete(self, end, found):
+        raw = self.text[self._value_start:end].strip()
+        try:
+            value = json.loads(raw)
+        except json.JSONDecodeError:
+            pass
+        else:
+            self.fields[self._key] = value
+            found.append((self._key, value))
+        self._value_start = None
+        self._expect = "comma"
+
+    def feed(self, chunk):
+        found = []
+        self.text += chunk
+        text = self.text
+        for i in range(self._pos, len(text)):
+            c = text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif c == "\\":
+                    self._escaped = True
+                elif c == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key":
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._expect = "colon"
+                    elif self._depth == 1 and self._expect == "value":
+                        self._complete(i + 1, found)
+                continue
+
+            if self._depth == 0:
+                if c == "{" and self._expect is None:
+                    self._depth, self._expect = 1, "key"
+                continue
+
+            if c == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    self._key_start = i
+                elif self._depth == 1 and self._expect == "value":
+                    self._value_start = i
+            elif c in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._value_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._expect == "value":
+                    self._complete(i + 1, found)
+                elif self._depth == 0 and self._value_start is not None:
+                    self._complete(i, found)
+            elif self._depth == 1:
+                if c == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif c == ",":
+                    if self._value_start is not None:
+                        self._complete(i, found)
+                    self._expect = "key"
+                elif (not c.isspace() and self._expect == "value"
+                      and self._value_start is None):
+                    self._value_start = i
+        self._pos = len(text)
+        return found
+
+
+class Ollama:
+    """Chat client for the model running on the laptop.
+
+    host is the server's base URL; a full .../api/chat URL is accepted too,
+    which is what the harness tools have always been configured with.
+    """
+
+    def __init__(self, host, model, timeout=300, connect_timeout=5.0,
+                 read_timeout=300, pool_size=4, transport_retries=3,
+                 backoff=0.5, keep_alive=None):
+        host = host.rstrip("/")
+        if host.endswith(CHAT_PATH):
+            host = host[:-len(CHAT_PATH)]
+        self.host = host
+        self.url = host + CHAT_PATH
+        self.model = model
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # Seconds the server should keep the model loaded after each request;
+        # negative for indefinitely, None to leave it to the server.
+        self.keep_alive = keep_alive
+        # last_stats and last_text are per thread, so sessions sharing a
+        # client each read back their own call.
+        self._local = threading.local()
+        self._last_used = None
+
+        retry = Retry(
+            total=transport_retries,
+            connect=transport_retries,
+            read=0,
+            status=transport_retries,
+            status_forcelist=(502, 503, 504),
+            # POST is not retried by default because it is not idempotent in
+            # general. A chat request is: nothing happens server-side but the
+            # generation, and a refused connection generated nothing.
+            allowed_methods=None,
+            backoff_factor=backoff,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def last_stats(self):
+        """The server's accounting for this thread's last call."""
+        return getattr(self._local, "stats", {})
+
+    @last_stats.setter
+    def last_stats(self, value):
+        self._local.stats = value
+
+    @property
+    def last_text(self):
+        """This thread's last reply exactly as generated.
+
+        For sending back as history: the server has those tokens cached, and
+        a re-serialised copy of the parsed reply would differ from them in
+        whitespace at least.
+        """
+        return getattr(self._local, "text", None)
+
+    @last_text.setter
+    def last_text(self, value):
+        self._local.text = value
+
+    def warm(self):
+        """Whether the server should still hold this client's last prompt.
+
+        True only if the last request succeeded and keep_alive has not run
+        out since. A model unloaded in between, or restarted, or serving
+        someone else's prompt meanwhile, is not visible from here; the
+        prompt_eval_count in last_stats is what shows whether it was.
+        """
+        if self._last_used is None or self.keep_alive is None:
+            return False
+        if self.keep_alive < 0:
+            return True
+        return time.monotonic() - self._last_used < self.keep_alive
+
+    def _body(self, messages, stream, fields):
+        body = {"model": self.model, "messages": messages, "stream": stream}
+        if self.keep_alive is not None:
+            body["keep_alive"] = self.keep_alive
+        body.update(fields)
+        return body
+
+    def _finished(self, final):
+        """Note the server's accounting from a final response object."""
+        stats = {k: final[k] for k in STAT_COUNTS if k in final}
+        stats.update({k.replace("_duration", "_s"): round(final[k] / 1e9, 3)
+                      for k in STAT_DURATIONS if k in final})
+        self.last_stats = stats
+        self._last_used = time.monotonic()
+
+    def _timeouts(self, deadline):
+        """(connect, read) for one request, capped by what is left of deadline."""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise requests.Timeout(f"no time left of the {self.timeout}s budget")
+        return (min(self.connect_timeout, remaining),
+                min(self.read_timeout, remaining))
+
+    def reachable(self):
+        """(ok, detail). Checks the server answers and has the model."""
+        try:
+            response = self.session.get(
+                self.host + "/api/tags",
+                timeout=(self.connect_timeout, 10))
+            response.raise_for_status()
+        except requests.RequestException as exc:
+            return False, str(exc)
+
+        names = [m.get("name", "") for m in response.json().get("models", [])]
+        if not any(n == self.model or n.startswith(self.model + ":")
+                   for n in names):
+            return False, (f"{self.model} not pulled; available: "
+                           f"{', '.join(names) or 'none'}")
+        return True, f"{self.model} available"
+
+    def chat(self, messages, deadline=None, **fields):
+        """One non-streaming /api/chat call. Returns the reply text.
+
+        fields are added to the request body as they are: "format",
+        "options" and so on.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        self._last_used, self.last_stats = None, {}
+        response = self.session.post(self.url,
+                                     json=self._body(messages, False, fields),
+                                     timeout=self._timeouts(deadline))
+        response.raise_for_status()
+        final = response.json()
+        self._finished(final)
+        return final["message"]["content"]
+
+    def chat_streaming(self, messages, on_chunk, deadline=None, **fields):
+        """As chat(), but streamed: on_chunk(text) for each piece as it comes.
+
+        Returns the whole reply text. The read timeout now bounds the gap
+        between chunks rather than the whole generation, and the deadline
+        is checked between chunks as well.
+        """
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        self._last_used, self.last_stats = None, {}
+        parts = []
+        with self.session.post(self.url,
+                               json=self._body(messages, True, fields),
+                               timeout=self._timeouts(deadline),
+                               stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("error"):
+                    raise requests.HTTPError(chunk["error"], response=response)
+                text = chunk.get("message", {}).get("content", "")
+                if text:
+                    parts.append(text)
+                    on_chunk(text)
+                if chunk.get("done"):
+                    self._finished(chunk)
+                    break
+                if time.monotonic() > deadline:
+                    raise requests.Timeout(
+                        f"reply still streaming after {self.timeout}s")
+        return "".join(parts)
+
+    @staticmethod
+    def _messages(system, state, history):
+        messages = [{"role": "system", "content": system}]
+        messages += history
+        messages.append({"role": "user", "content": json.dumps(state)})
+        return messages
+
+    @staticmethod
+    def _request(attempt):
+        return {
+            # Constrains sampling to valid JSON. Without it the model
+            # occasionally emits a literal newline inside a string and the
+            # parse fails, which loses the turn.
+            "format": "json",
+            # A retry at a lower temperature is a genuine second try rather
+            # than the same dice roll again.
+            "options": {"temperature": 0.8 if attempt == 0 else 0.3},
+        }
+
+    @staticmethod
+    def _parse(text):
+        """(reply, None), or (None, the error) if it is not JSON."""
+        cleaned = text.replace("```json", "").replace("```", "").strip()
+        try:
+            return json.loads(cleaned), None
+        except json.JSONDecodeError as exc:
+            # Salvage the common case: unescaped control characters inside
+            # an otherwise well formed string.
+            try:
+                return json.loads(cleaned, strict=False), None
+            except json.JSONDecodeError:
+                return None, exc
+
+    def ask(self, system, state, history, retries=2, deadline=None):
+        """The model's JSON reply to `state`, after `history`."""
+        messages = self._messages(system, state, history)
+        self.last_text = None
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        last_error, text = None, ""
+        for attempt in range(retries + 1):
+            text = self.chat(messages, deadline=deadline,
+                             **self._request(attempt))
+            reply, last_error = self._parse(text)
+            if reply is not None:
+                self.last_text = text
+                return reply
+
+        raise ValueError(f"unparseable after {retries + 1} attempts: "
+                         f"{last_error}\nraw: {text[:400]}")
+
+    def ask_streaming(self, system, state, history, on_field, retries=2,
+                      deadline=None):
+        """As ask(), calling on_field(key, value) as each field completes.
+
+        Fields come in the order the model writes them, each once. If the
+        whole reply then fails to parse, it is retried as ask() would --
+        unless a field has already been handed over, since the caller may
+        have acted on it. The fields that did complete are returned instead,
+        because that is what was acted on, and a retry would be a different
+        reply to the same turn.
+        """
+        messages = self._messages(system, state, history)
+        self.last_text = None
+        if deadline is None:
+            deadline = time.monotonic() + self.timeout
+        last_error, text = None, ""
+        for attempt in range(retries + 1):
+            scanner = FieldScanner()
+
+            def chunk(piece):
+                for key, value in scanner.feed(piece):
+                    on_field(key, value)
+
+            text = self.chat_streaming(messages, chunk, deadline=deadline,
+                                       **self._request(attempt))
+            reply, last_error = self._parse(text)
+            if reply is not None:
+                self.last_text = text
+                return reply
+            if scanner.fields:
+                self.last_text = None
+                return dict(scanner.fields)
+
+        raise ValueError(f"unparseable after {retries + 1} attempts: "
+                         f"{last_error}\nraw: {text[:400]}")
+
+
+class Endpoint:
+    """One server in a pool, with what the pool knows about it."""
+
+    def __init__(self, client):
+        self.client = client
+        self.name = f"{client.model}@{client.host}"
+        self.healthy = None          # unknown until first checked or used
+        self.detail = "not yet checked"
+        self.in_flight = 0
+        self.latency = None          # smoothed seconds per successful call
+
+
+class OllamaPool:
+    """Several Ollama servers behind the same interface as one Ollama.
+
+    endpoints is a list of hosts, or of {"host": ..., "model": ...} dicts for
+    an endpoint serving a different model than `model`. Each call goes to the
+    least loaded endpoint that last answered its health check: fewest
+    requests in flight, then -- all else equal -- whichever served this
+    thread last, since that is where its prompt prefix is cached.
+
+    If that endpoint fails to connect, times out, or answers with an HTTP
+    error, the call moves on to the next, within the same deadline, and the
+    one that failed is marked down until a health check says otherwise.
+    Once a streaming call has handed a field to the caller it is not moved:
+    the caller may have acted on it, and a second endpoint would give a
+    different reply to the same turn. A reply that does not parse is the
+    model's failure, not the endpoint's, and is not retried elsewhere.
+
+    start() runs the health checks in the background every `interval`
+    seconds. Without it, endpoints are marked only by the calls made to them
+    and by explicit reachable() checks.
+
+    last_endpoint, last_stats and last_text describe the last call made from
+    the calling thread, so concurrent sessions sharing a pool each see their
+    own.
+    """
+
+    def __init__(self, endpoints, model, timeout=300, interval=30, **client):
+        self.timeout = timeout
+        self.interval = interval
+        self.endpoints = []
+        for spec in endpoints:
+            if isinstance(spec, str):
+                spec = {"host": spec}
+            self.endpoints.append(Endpoint(Ollama(
+                spec["host"], spec.get("model", model), timeout=timeout,
+                **client)))
+        if not self.endpoints:
+            raise ValueError("a pool needs at least one endpoint")
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stop = threading.Event()
+        self._checker = None
+
+    # -- per-thread view of the last call ------------------------------------
+
+    @property
+    def last_endpoint(self):
+        return getattr(self._local, "endpoint", None)
+
+    @property
+    def last_stats(self):
+        return getattr(self._local, "stats", {})
+
+    @property
+    def last_text(self):
+        return getattr(self._local, "text", None)
+
+    # -- health --------------------------------------------------------------
+
+    def check(self):
+        """Health-check every endpoint now."""
+        for endpoint in self.endpoints:
+            ok, detail = endpoint.client.reachable()
+            with self._lock:
+                endpoint.healthy, endpoint.detail = ok, detail
+
+    def reachable(self):
+        """(ok, detail). ok if any endpoint is; detail covers all of them."""
+        self.check()
+        return (any(e.healthy for e in self.endpoints),
+                "; ".join(f"{e.name} {'OK' if e.healthy else 'DOWN'}: "
+                          f"{e.detail}" for e in self.endpoints))
+
+    def start(self):
+        """Health-check in the background until close()."""
+        if self._checker is not None:
+            return
+
+        def run():
+            while not self._stop.wait(self.interval):
+                try:
+                    self.check()
+                except Exception as exc:  # noqa: BLE001 -- the checker must not die
+                    print(f"health check failed: {exc}")
+
+        self._checker = threading.Thread(target=run, name="ollama-health",
+                                         daemon=True)
+        self._checker.start()
+
+    def close(self):
+        self._stop.set()
+        for endpoint in self.endpoints:
+            endpoint.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- routing -------------------------------------------------------------
+
+    def _ranked(self):
+        """Endpoints in the order to try them."""
+        last = getattr(self._local, "served", None)
+        with self._lock:
+            return sorted(self.endpoints, key=lambda e: (
+                e.healthy is False, e.in_flight, e is not last,
+                e.latency if e.latency is not None else 0.0))
+
+    def warm(self):
+        """Whether the next call will land where this thread's prompt is cached.
+
+        That is the endpoint that served it last, if it is still first in
+        line and should still hold the model.
+        """
+        ranked = self._ranked()
+        return (ranked[0] is getattr(self._local, "served", None)
+                and ranked[0].client.warm())
+
+    def _call(self, method, *args, movable=lambda: True, **kwargs):
+        deadline = time.monotonic() + self.timeout
+        failures = []
+        self._local.endpoint, self._local.stats, self._local.text = None, {}, None
+        for endpoint in self._ranked():
+            if time.monotonic() >= deadline:
+                break
+            with self._lock:
+                endpoint.in_flight += 1
+            started = time.monotonic()
+            try:
+                result = getattr(endpoint.client, method)(
+                    *args, deadline=deadline, **kwargs)
+            except requests.RequestException as exc:
+                with self._lock:
+                    endpoint.healthy, endpoint.detail = False, str(exc)
+                failures.append(f"{endpoint.name}: {exc}")
+                if not movable():
+                    self._local.endpoint = endpoint.name
+                    raise
+                continue
+            except Exception:
+                # Answered, but not usably. Which endpoint said it still
+                # belongs in the record.
+                self._local.endpoint = endpoint.name
+                self._local.stats = endpoint.client.last_stats
+                raise
+            finally:
+                with self._lock:
+                    endpoint.in_flight -= 1
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                endpoint.healthy = True
+                endpoint.latency = (elapsed if endpoint.latency is None
+                                    else 0.7 * endpoint.latency + 0.3 * elapsed)
+            self._local.served = endpoint
+            self._local.endpoint = endpoint.name
+            self._local.stats = endpoint.client.last_stats
+            self._local.text = endpoint.client.last_text
+            return result
+
+        raise requests.ConnectionError(
+            "no endpoint answered: " + "; ".join(failures or ["deadline passed"]))
+
+    def chat(self, messages, **fields):
+        return self._call("chat", messages, **fields)
+
+    def ask(self, system, state, history, retries=2):
+        return self._call("ask", system, state, history, retries=retries)
+
+    def ask_streaming(self, system, state, history, on_field, retries=2):
+        delivered = []
+
+        def field(key, value):
+            delivered.append(key)
+            on_field(key, value)
+
+        return self._call("ask_streaming", system, state, history, field,
+                          retries=retries, movable=lambda: not delivered)
@@ -0,0 +1,227 @@
+"""
+Parity check: IncrementalReducer against reduce_window, reduce_window's two
+correlation engines against each other, and the batched reduce_array against
+reducing a channel at a time.
+
+Slides a window along synthetic data -- single synth() channels with drift,
+and harness.session() with a planted period change -- and at every step
+compares the incremental state dict with what reduce_window returns for the
+same window. Exits non-zero on any disagreement larger than the resolution the
+state is reported at.
+
+Steps of one sample, of an odd size, of the turn interval, and larger than the
+window are all exercised, because each takes a different path through the
+update.
+
+Then the same sources are slid through reduce_window twice, once with every
+correlation computed directly and once through the FFT, at a few window
+lengths either side of reducer.FFT_MIN_SAMPLES. Those must match exactly:
+the engine is picked on window length, so a change of window must never
+change the answer for any other reason.
+
+Last, reduce_array over the stacked channels against reduce_channels, the
+per-channel reference, on the same windows and on eight- and sixteen-channel
+sessions. Also exact: which path runs depends only on whether the channels
+happen to be the same length.
+
+Usage:
+    python parity.py
+    python parity.py --hours 24
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+import reducer
+from harness import session
+from incremental import IncrementalReducer
+from reducer import (LAG_QUANTUM_S, PERIOD_QUANTUM_S, reduce_array,
+                     reduce_channels, reduce_window, synth)
+
+WINDOW_S = 1800
+ENGINE_WINDOWS_S = (600, 1800, 7200)
+
+
+def differences(batch, incremental, path=""):
+    """Where two state dicts disagree by more than their reported resolution."""
+    out = []
+    if isinstance(batch, dict) and isinstance(incremental, dict):
+        if list(batch) != list(incremental):
+            return [f"{path}: keys {list(batch)} != {list(incremental)}"]
+        for key in batch:
+            out += differences(batch[key], incremental[key], f"{path}.{key}")
+        return out
+    if isinstance(batch, list) and isinstance(incremental, list):
+        if len(batch) != len(incremental):
+            return [f"{path}: length {len(batch)} != {len(incremental)}"]
+        if all(isinstance(v, str) for v in batch + incremental):
+            return [] if batch == incremental else [f"{path}: {batch} != {incremental}"]
+        for i, (a, b) in enumerate(zip(batch, incremental)):
+            out += differences(a, b, f"{path}[{i}]")
+        return out
+    if batch is None or incremental is None:
+        return [] if batch is incremental else [f"{path}: {batch} != {incremental}"]
+
+    # One step of whatever the value is rounded to. A value sitting on a
+    # rounding boundary can legitimately land either side of it.
+    if path.endswith("period_s"):
+        tolerance = PERIOD_QUANTUM_S
+    elif "phase_lags_s" in path:
+        tolerance = LAG_QUANTUM_S
+    elif path.endswith("drift_mv_per_min"):
+        tolerance = 0.001
+    else:
+        tolerance = 0.01
+    if abs(batch - incremental) > tolerance + 1e-9:
+        return [f"{path}: {batch} != {incremental}"]
+    return []
+
+
+def sweep(name, channels, step):
+    """Slide both reducers along `channels`; return (windows, exact, failures)."""
+    length = min(len(v) for v in channels.values())
+    reducer = IncrementalReducer(WINDOW_S)
+    pushed, end = 0, WINDOW_S
+    previous_batch = previous_incremental = None
+    windows = exact = 0
+    failures = []
+
+    while end <= length:
+        reducer.push({k: v[pushed:end] for k, v in channels.items()})
+        pushed = end
+
+        window = {k: v[end - WINDOW_S:end] for k, v in channels.items()}
+        batch = reduce_window(window, previous_batch)
+        incremental = reducer.state(previous_incremental)
+        previous_batch, previous_incremental = batch, incremental
+
+        windows += 1
+        if batch == incremental:
+            exact += 1
+        else:
+            found = differences(batch, incremental)
+            failures += [f"{name} step {step} end {end}: {d}" for d in found]
+        end += step
+
+    return windows, exact, failures
+
+
+def paired(name, channels, window_s, step, first, second):
+    """Slide two reductions along `channels`; return (windows, exact, failures).
+
+    first and second take (window, previous) and return a state dict.
+    """
+    length = min(len(v) for v in channels.values())
+    previous = [None, None]
+    windows = exact = 0
+    failures = []
+    for end in range(window_s, length + 1, step):
+        window = {k: v[end - window_s:end] for k, v in channels.items()}
+        states = [first(window, previous[0]), second(window, previous[1])]
+        previous = states
+        windows += 1
+        if states[0] == states[1]:
+            exact += 1
+        else:
+            failures.append(f"{name} window {window_s} end {end}: "
+                            f"{states[0]} != {states[1]}")
+    return windows, exact, failures
+
+
+def engine(minimum):
+    """reduce_window with reducer.FFT_MIN_SAMPLES forced for the one call."""
+    def reduce(window, previous):
+        threshold = reducer.FFT_MIN_SAMPLES
+        reducer.FFT_MIN_SAMPLES = minimum
+        try:
+            return reduce_window(window, previous)
+        finally:
+            reducer.FFT_MIN_SAMPLES = threshold
+    return reduce
+
+
+def stacked(window, previous):
+    """reduce_array over the window's channels, stacked in order."""
+    return reduce_array(np.vstack(list(window.values())), list(window), previous)
+
+
+def check(label, runs):
+    """Run (name, channels, window_s, first, second) cases; return failures."""
+    total = exact = 0
+    failures = []
+    for name, channels, window_s, first, second in runs:
+        n, e, f = paired(name, channels, window_s, 300, first, second)
+        total += n
+        exact += e
+        failures += f
+        print(f"{name:8} window {window_s:5}  {n:5} windows  {e:5} identical")
+    print(f"\n{exact}/{total} windows identical between {label}")
+    for failure in failures[:20]:
+        print(f"  {failure}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=6.0)
+    args = parser.parse_args()
+
+    duration = int(args.hours * 3600)
+    events = [(duration // 3, duration // 3 + 2400, "period_s", 140.0)]
+    sources = {
+        "synth": {
+            "ch0": synth(duration_s=duration, lag_s=0, seed=1),
+            "ch1": synth(duration_s=duration, lag_s=12, seed=2,
+                         drift_mv_per_min=0.05),
+            "ch2": synth(duration_s=duration, lag_s=24, seed=3, amplitude_mv=0),
+        },
+        "session": session(duration_s=duration, events=events),
+    }
+    # A DC offset the size a real electrode pair carries, which is what the
+    # incremental sums have to stay accurate underneath.
+    sources["offset"] = {k: v + 0.040 for k, v in sources["session"].items()}
+
+    total = exact = 0
+    failures = []
+    for name, channels in sources.items():
+        for step in (1, 37, 600, 2000):
+            data = channels
+            if step == 1:
+                # A sample at a time is slow in the batch reducer; an hour of
+                # it covers every code path.
+                data = {k: v[:WINDOW_S + 3600] for k, v in channels.items()}
+            n, e, f = sweep(name, data, step)
+            total += n
+            exact += e
+            failures += f
+            print(f"{name:8} step {step:5}  {n:5} windows  {e:5} identical  "
+                  f"{len(f)} beyond resolution")
+
+    print(f"\n{exact}/{total} windows identical to reduce_window, "
+          f"{len(failures)} disagreements beyond one step of resolution")
+    for failure in failures[:20]:
+        print(f"  {failure}")
+
+    print()
+    failures += check("the direct and FFT correlation engines", [
+        (name, channels, window_s, engine(sys.maxsize), engine(0))
+        for name, channels in sources.items()
+        for window_s in ENGINE_WINDOWS_S])
+
+    print()
+    wide = {f"wide{count}": session(duration_s=duration, events=events,
+                                    n_channels=count, seed=count)
+            for count in (8, 16)}
+    failures += check("reduce_array and reduce_channels", [
+        (name, channels, window_s, reduce_channels, stacked)
+        for name, channels in {**sources, **wide}.items()
+        for window_s in ENGINE_WINDOWS_S])
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    np.seterr(all="ignore")
+    sys.exit(main())
@@ -8,6 +8,7 @@ Channels are three recording electrodes read against a common reference.
 """
 
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 
 SAMPLE_HZ = 1
 COARSE_POINTS = 60
@@ -21,19 +22,79 @@ PERIOD_QUANTUM_S = 5
 PERIOD_MIN = 30
 PERIOD_MAX = 240
 
+# Window length, in samples, from which correlations go through the FFT. The
+# direct sums are O(n^2) for the autocorrelation and O(n x lags) for the phase
+# scan; the FFT is O(n log n) and overtakes them at a few hundred samples.
+# bench.py measures the crossover. Both engines give the same answers.
+FFT_MIN_SAMPLES = 1024
+
+
+# ---------------------------------------------------------------------------
+# Correlation engine. Direct sums for short windows, the FFT above
+# FFT_MIN_SAMPLES, chosen per call.
+
+
+def _fft_size(n):
+    """A power of two at least n, which is where the FFT is fastest."""
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+def autocorrelation(x):
+    """sum(x[i] * x[i + k]) for k = 0..n-1, i.e. np.correlate(x, x, "full")[n-1:].
+
+    Along the last axis, so a (channels x samples) array gives one row per
+    channel. The FFT path is zero padded to at least 2n - 1. Without the
+    padding the FFT computes a circular correlation, folding the end of the
+    window back onto its start, which is not what the period search means by
+    a lag.
+    """
+    x = np.asarray(x, dtype=float)
+    n = x.shape[-1]
+    if n < FFT_MIN_SAMPLES:
+        if x.ndim == 1:
+            return np.correlate(x, x, mode="full")[n - 1:]
+        return np.array([np.correlate(row, row, mode="full")[n - 1:]
+                         for row in x.reshape(-1, n)]).reshape(x.shape)
+    size = _fft_size(2 * n - 1)
+    spectrum = np.fft.rfft(x, size)
+    return np.fft.irfft(spectrum * np.conj(spectrum), size)[..., :n]
+
+
+def circular_correlation(a, b, span):
+    """[np.dot(a, np.roll(b, lag)) for lag in -span..span], without the rolls.
+
+    Along the last axis, so stacked rows of a and b give one row of scores
+    per pair. Circular on purpose, matching what phase_lag has always scored.
+    The FFT path is therefore NOT padded: an unpadded transform of length n
+    is exactly the wrap-around correlation np.roll gives. The direct path
+    scores every lag against one strided view of b extended circularly at
+    both ends, so no copy of b is made per lag.
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    n = a.shape[-1]
+    if n < FFT_MIN_SAMPLES:
+        extended = np.concatenate((b[..., n - span:], b, b[..., :span]), axis=-1)
+        # Row r of the view is np.roll(b, span - r).
+        view = sliding_window_view(extended, n, axis=-1)
+        return np.matmul(view, a[..., None])[..., 0][..., ::-1]
+    full = np.fft.irfft(np.fft.rfft(a) * np.conj(np.fft.rfft(b)), n)
+    return np.concatenate((full[..., n - span:], full[..., :span + 1]), axis=-1)
+
 
 def dominant_period(x):
     """Strongest oscillation period in seconds, or None if there isn't one.
 
-    Autocorrelation rather than FFT: the signal is short, non-stationary and
-    not a clean sinusoid, and we only want the dominant lag.
+    Autocorrelation rather than a spectral peak: the signal is short,
+    non-stationary and not a clean sinusoid, and we only want the dominant
+    lag. (Long windows compute that autocorrelation through the FFT; that is
+    arithmetic, not a change of method.)
     """
     x = np.asarray(x, dtype=float)
     x = x - x.mean()
     if x.std() < 1e-12:
         return None
 
-    corr = np.correlate(x, x, mode="full")[len(x) - 1:]
+    corr = autocorrelation(x)
     corr = corr / corr[0]
 
     lo, hi = int(PERIOD_MIN * SAMPLE_HZ), int(PERIOD_MAX * SAMPLE_HZ)
@@ -68,7 +129,7 @@ def phase_lag(a, b, period):
 
     span = int(period * SAMPLE_HZ / 2)
     lags = np.arange(-span, span + 1)
-    scores = [np.dot(a, np.roll(b, lag)) for lag in lags]
+    scores = circular_correlation(a, b, span)
     raw = float(lags[int(np.argmax(scores))]) / SAMPLE_HZ
 
     # Sign flipped so a positive value means b arrives after a, which is how
@@ -118,6 +179,12 @@ def amplitude(x):
     return round(float(iqr) * 1.414 * 1000, 2)
 
 
+def coarse(x):
+    """The window averaged down to COARSE_POINTS values, in mV."""
+    return [round(float(s.mean()) * 1000, 2)
+            for s in np.array_split(np.asarray(x, dtype=float), COARSE_POINTS)]
+
+
 def describe_channel(x):
     """Reduce one channel to the handful of numbers worth sending."""
     x = np.asarray(x, dtype=float)
@@ -128,11 +195,129 @@ def describe_channel(x):
         "period_s": dominant_period(detrended),
         "amplitude_mv": amplitude(detrended),
         "drift_mv_per_min": drift(x),
-        "coarse_mv": [round(float(s.mean()) * 1000, 2)
-                      for s in np.array_split(x, COARSE_POINTS)],
+        "coarse_mv": coarse(x),
     }
 
 
+# ---------------------------------------------------------------------------
+# The same reductions over a (channels x samples) array at once. Every step
+# is one numpy call across all channels rather than a Python loop over them,
+# so going from three electrodes to eight or more costs array width, not
+# interpreter time. The results are the ones the single-channel functions
+# above give; parity.py checks that.
+
+
+def _rounded(values, quantum):
+    """Round to the quantum per element, with None where values is NaN."""
+    return [None if np.isnan(v) else round(float(v) / quantum) * quantum
+            for v in values]
+
+
+def dominant_periods(x):
+    """dominant_period() of every row of x, as a list."""
+    x = np.asarray(x, dtype=float)
+    x = x - x.mean(axis=1, keepdims=True)
+    flat = x.std(axis=1) < 1e-12
+
+    lo, hi = int(PERIOD_MIN * SAMPLE_HZ), int(PERIOD_MAX * SAMPLE_HZ)
+    hi = min(hi, x.shape[1] - 1)
+    if hi <= lo:
+        return [None] * len(x)
+
+    corr = autocorrelation(x)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        band = corr[:, lo:hi] / corr[:, :1]
+    peak = np.argmax(band, axis=1)
+    strength = band[np.arange(len(x)), peak]
+
+    raw = (peak + lo) / SAMPLE_HZ
+    raw[flat | ~(strength >= 0.2)] = np.nan
+    return _rounded(raw, PERIOD_QUANTUM_S)
+
+
+def phase_lags(x, period):
+    """phase_lag() of each row of x against the next, as a list."""
+    x = np.asarray(x, dtype=float)
+    pairs = len(x) - 1
+    if period is None or pairs < 1:
+        return [None] * max(pairs, 0)
+
+    std = x.std(axis=1)
+    flat = std < 1e-12
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = (x - x.mean(axis=1, keepdims=True)) / std[:, None]
+
+    span = int(period * SAMPLE_HZ / 2)
+    lags = np.arange(-span, span + 1)
+    scores = circular_correlation(x[:-1], x[1:], span)
+    raw = lags[np.argmax(scores, axis=1)] / SAMPLE_HZ
+
+    raw = np.where(flat[:-1] | flat[1:], np.nan, -raw)
+    return _rounded(raw, LAG_QUANTUM_S)
+
+
+def describe_channels(x):
+    """describe_channel() of every row of x, as a list of dicts.
+
+    One least squares fit serves both the detrend and the drift test, where
+    describe_channel() fits each channel twice.
+    """
+    x = np.asarray(x, dtype=float)
+    n = x.shape[1]
+    t = np.arange(n) - (n - 1) / 2
+    tt = (t ** 2).sum()
+
+    slope = x @ t / tt
+    residuals = x - x.mean(axis=1, keepdims=True) - slope[:, None] * t
+
+    # As drift(): the slope's standard error, inflated by the lag-1
+    # autocorrelation of the residuals.
+    se = np.sqrt((residuals ** 2).sum(axis=1) / (n - 2) / tt)
+    head = residuals[:, :-1] - residuals[:, :-1].mean(axis=1, keepdims=True)
+    tail = residuals[:, 1:] - residuals[:, 1:].mean(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r1 = (head * tail).sum(axis=1) / np.sqrt(
+            (head ** 2).sum(axis=1) * (tail ** 2).sum(axis=1))
+    se *= np.sqrt((1 + np.clip(r1, 0.0, 0.99)) / (1 - np.clip(r1, 0.0, 0.99)))
+    drifting = ~(np.abs(slope) < 2 * se)
+
+    q75, q25 = np.percentile(residuals, [75, 25], axis=1)
+    amplitudes = (q75 - q25) * 1.414 * 1000
+    means = np.column_stack([s.mean(axis=1) for s in
+                             np.array_split(x, COARSE_POINTS, axis=1)])
+    periods = dominant_periods(residuals)
+
+    return [{
+        "period_s": periods[i],
+        "amplitude_mv": round(float(amplitudes[i]), 2),
+        "drift_mv_per_min": (round(float(slope[i]) * 60 * 1000, 3)
+                             if drifting[i] else None),
+        "coarse_mv": [round(float(m) * 1000, 2) for m in means[i]],
+    } for i in range(len(x))]
+
+
+def reduce_array(x, names, previous=None):
+    """As reduce_window(), for a (channels x samples) array of volts.
+
+    names labels the rows, in order; adjacent rows are the phase lag pairs.
+    """
+    x = np.asarray(x, dtype=float)
+    names = list(names)
+    state = dict(zip(names, describe_channels(x)))
+
+    periods = [state[n]["period_s"] for n in names if state[n]["period_s"]]
+    reference = float(np.median(periods)) if periods else None
+
+    state["phase_lags_s"] = dict(zip(
+        (f"{a}->{b}" for a, b in zip(names, names[1:])),
+        phase_lags(x, reference)))
+
+    if previous is not None:
+        state["changes_since_last_turn"] = compare(previous, state, names)
+
+    return state
+
+
 def reduce_window(channels, previous=None):
     """channels: dict of name -> array of volts. Returns the state dict.
 
@@ -140,10 +325,27 @@ def reduce_window(channels, previous=None):
     then. A change spread over several turns is invisible in any single
     turn's numbers, so without this it has to be reconstructed from the
     conversation, and it mostly isn't.
+
+    Channels of equal length -- the normal case -- are stacked and reduced
+    together by reduce_array(). Ragged windows, where a channel lost samples
+    the others kept, go a channel at a time through reduce_channels().
     """
-    state = {name: describe_channel(x) for name, x in channels.items()}
+    names = list(channels)
+    lengths = {len(channels[n]) for n in names}
+    if len(lengths) == 1 and lengths.pop() >= COARSE_POINTS:
+        return reduce_array(np.vstack([channels[n] for n in names]), names,
+                            previous)
+    return reduce_channels(channels, previous)
+
+
+def reduce_channels(channels, previous=None):
+    """reduce_window() one channel at a time, for windows of unequal length.
 
+    Also the reference reduce_array() is checked against.
+    """
     names = list(channels)
+    state = {name: describe_channel(x) for name, x in channels.items()}
+
     periods = [state[n]["period_s"] for n in names if state[n]["period_s"]]
     reference = float(np.median(periods)) if periods else None
 
@@ -0,0 +1,178 @@
+"""
+Sweep runner: many replay sessions at once.
+
+harness.py runs one session, and a session's turns have to run in series --
+each turn is sent with the turns before it as history. Different sessions
+share nothing, so a sweep across seeds, prompts, and history on and off runs
+them side by side, up to --concurrency sessions in flight against the model
+at once. Within a session the turns still go strictly in order.
+
+Every session in a sweep gets the same planted event as harness.py, so any
+difference between them is the seed, the prompt or the history. The whole
+sweep lands in one results file: the grid, each session's log, and the
+timing.
+
+Concurrency only helps as far as the server will take requests in parallel.
+Ollama serves one request per model at a time unless OLLAMA_NUM_PARALLEL is
+raised; with it at the default, a concurrency above 1 only queues requests
+in the server instead of here.
+
+Given several --url endpoints, sessions in flight are spread across every
+one that is answering, least loaded first; an endpoint that stops answering
+is skipped until it recovers. Each turn in the results records which
+endpoint served it.
+
+--fake starts fake_ollama.py in-process, for measuring throughput offline;
+--fake 3 starts three, to see the spread.
+
+Usage:
+    python sweep.py --seeds 0 1 2 3 --prompts blind null
+    python sweep.py --seeds 0-7 --concurrency 4 --turns 12
+    python sweep.py --fake --latency 0.2 --seeds 0-15 --concurrency 8
+    python sweep.py --url http://laptop:11434 http://desktop:11434 --concurrency 4
+"""
+
+import argparse
+import itertools
+import json
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+
+import fake_ollama
+import harness
+from harness import (OLLAMA, PROMPTS, TURN_INTERVAL_S, planted_events,
+                     replay)
+
+
+def seeds(values):
+    """Seeds from arguments like 3, 0-7 (inclusive)."""
+    out = []
+    for value in values:
+        first, _, last = value.partition("-")
+        out += range(int(first), int(last or first) + 1)
+    return out
+
+
+def grid(seed_list, prompts, histories):
+    """Every session of the sweep, as the keyword arguments that define it."""
+    return [{"seed": seed, "prompt": prompt, "use_history": history}
+            for seed, prompt, history
+            in itertools.product(seed_list, prompts, histories)]
+
+
+def sweep(sessions, turns, interval, url, concurrency, progress=print):
+    """Run every session, up to `concurrency` at a time.
+
+    Returns one result per session, in grid order: the session's parameters,
+    its log and how long it took.
+    """
+    events = planted_events(interval)
+    results = [None] * len(sessions)
+    lock = threading.Lock()
+    done = 0
+
+    def one(params):
+        started = time.perf_counter()
+        log = replay(turns, interval, params["prompt"], params["use_history"],
+                     events, seed=params["seed"], url=url, verbose=False)
+        return {**params,
+                "seconds": round(time.perf_counter() - started, 3),
+                "failed_turns": sum(1 for entry in log if entry.get("error")),
+                "endpoints": dict(Counter(entry.get("endpoint") for entry in log
+                                          if entry.get("endpoint"))),
+                "log": log}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = {pool.submit(one, params): i
+                   for i, params in enumerate(sessions)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            with lock:
+                done += 1
+            params = sessions[i]
+            progress(f"  {done}/{len(sessions)}  seed {params['seed']} "
+                     f"{params['prompt']} history "
+                     f"{'on' if params['use_history'] else 'off'}  "
+                     f"{results[i]['seconds']:.1f}s  "
+                     f"{results[i]['failed_turns']} failed turns")
+    return results
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--seeds", nargs="+", default=["0"],
+                   help="seeds, or inclusive ranges like 0-7")
+    p.add_argument("--prompts", nargs="+", default=["blind"],
+                   choices=list(PROMPTS))
+    p.add_argument("--history", choices=["on", "off", "both"], default="both")
+    p.add_argument("--turns", type=int, default=24)
+    p.add_argument("--interval", type=int, default=TURN_INTERVAL_S)
+    p.add_argument("--concurrency", type=int, default=4)
+    p.add_argument("--url", nargs="+", default=[OLLAMA],
+                   help="one or more Ollama servers")
+    p.add_argument("--fake", type=int, nargs="?", const=1, default=0,
+                   metavar="N",
+                   help="run against N fake_ollama.py servers instead of --url")
+    p.add_argument("--latency", type=float, default=0.0,
+                   help="with --fake, seconds each reply is held back")
+    p.add_argument("--out", default=None,
+                   help="results file (default sweep-<UTC time>.json)")
+    args = p.parse_args()
+
+    histories = {"on": [True], "off": [False], "both": [True, False]}
+    sessions = grid(seeds(args.seeds), args.prompts, histories[args.history])
+
+    # Enough pooled connections that no session in flight waits on another.
+    harness.POOL_SIZE = max(harness.POOL_SIZE, args.concurrency)
+
+    servers = [fake_ollama.serve(port=0, latency=args.latency)
+               for _ in range(args.fake)]
+    url = [fake_ollama.url(s) for s in servers] or args.url
+
+    started = datetime.now(timezone.utc)
+    out = args.out or f"sweep-{started.strftime('%Y%m%dT%H%M%SZ')}.json"
+    print(f"{len(sessions)} sessions of {args.turns} turns, "
+          f"{args.concurrency} at a time, against {', '.join(url)}\n")
+
+    clock = time.perf_counter()
+    try:
+        results = sweep(sessions, args.turns, args.interval, url,
+                        args.concurrency)
+    finally:
+        for server in servers:
+            server.shutdown()
+    elapsed = time.perf_counter() - clock
+
+    total = len(sessions) * args.turns
+    failed = sum(r["failed_turns"] for r in results)
+    with open(out, "w") as f:
+        json.dump({
+            "started": started.isoformat(),
+            "urls": url,
+            "fake": bool(args.fake),
+            "turns": args.turns,
+            "interval_s": args.interval,
+            "concurrency": args.concurrency,
+            "events": planted_events(args.interval),
+            "seconds": round(elapsed, 3),
+            "turns_per_second": round(total / elapsed, 3),
+            "failed_turns": failed,
+            "sessions": results,
+        }, f, indent=2)
+
+    served = Counter()
+    for r in results:
+        served.update(r["endpoints"])
+    print(f"\n{total} turns in {elapsed:.1f}s, {total / elapsed:.1f} turns/s, "
+          f"{failed} failed")
+    for name, count in served.most_common():
+        print(f"  {count:5} turns  {name}")
+    print(f"wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
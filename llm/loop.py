@@ -10,6 +10,8 @@ What is different from the harness:
   * the window comes off disk, from the CSV that gpio/adc.py writes, so the
     loop survives a restart and picks up mid-run instead of waiting 30 minutes
   * the action is applied to real hardware, or deliberately withheld
+  * the reply is streamed, and the light action applied the moment that field
+    of it is complete, not after the note has finished generating
   * every turn is appended to a JSONL log whether or not anything happened
 
 Sham blocks. Some fraction of turns are run with the action logged and not
@@ -51,8 +53,6 @@ only way to see how the loop behaves on real noise. Use both.
 """
 
 import argparse
-import json
-import os
 import pathlib
 import random
 import signal
@@ -61,8 +61,6 @@ import threading
 import time
 from datetime import datetime, timezone
 
-import requests
-
 HERE = pathlib.Path(__file__).resolve().parent
 ROOT = HERE.parent
 sys.path.insert(0, str(ROOT / 'api'))
@@ -72,8 +70,12 @@ sys.path.insert(0, str(HERE / 'filters'))
 import syspath  # noqa: E402,F401  (path setup, must precede hardware imports)
 
 import config  # noqa: E402
+from history import History  # noqa: E402
+from incremental import IncrementalReducer  # noqa: E402
+from ollama_client import OllamaPool  # noqa: E402
 from reducer import reduce_window  # noqa: E402
 from store import channels_from_rows, electrode_log  # noqa: E402
+from turnlog import TurnLog  # noqa: E402
 
 # The three prompt variants live in llm/filters/prompts.md as the source of
 # truth. harness.py carries copies of BLIND and NULL; INFORMED is only in the
@@ -114,7 +116,8 @@ class LiveSource:
         return f"{len(rows)} samples spanning {span / 60:.1f} min"
 
     def window(self, turn):
-        return channels_from_rows(self.log.recent(self.window_s), self.channels)
+        # Off the binary sidecar when there is one; the CSV otherwise.
+        return self.log.window(self.window_s, self.channels)
 
 
 class ReplaySource:
@@ -165,6 +168,8 @@ class ReplaySource:
             self.label = f"{path.name}, {len(rows)} samples"
 
         self.length = min((len(v) for v in self.series.values()), default=0)
+        self._reducer = None
+        self._pushed = 0
 
     def describe(self):
         total = self.length / self.sample_hz
@@ -179,6 +184,22 @@ class ReplaySource:
             return None
         return {name: values[start:end] for name, values in self.series.items()}
 
+    def reduce(self, turn, previous=None):
+        """reduce_window of this turn's window, slid on from the last one's.
+
+        Only the interval's new samples are folded in, so a sweep over days of
+        recording costs what the new data costs rather than a full reduction
+        per turn. Asked for an earlier turn, it starts again from that window.
+        """
+        end = int((self.window_s + turn * self.interval_s) * self.sample_hz)
+        if self._reducer is None or end < self._pushed:
+            self._reducer = IncrementalReducer(self.window_s, self.sample_hz)
+            self._pushed = max(0, end - int(self.window_s * self.sample_hz))
+        self._reducer.push({name: values[self._pushed:end]
+                            for name, values in self.series.items()})
+        self._pushed = end
+        return self._reducer.state(previous)
+
     def planted_at(self, turn):
         """Whether a planted event is active at this turn, for the log."""
         moment = self.window_s + turn * self.interval_s
@@ -186,91 +207,6 @@ class ReplaySource:
                 if e[0] <= moment <= e[1] + self.interval_s]
 
 
-class Ollama:
-    """Chat client for the model running on the laptop."""
-
-    def __init__(self, host, model, timeout=300):
-        self.url = host.rstrip('/') + '/api/chat'
-        self.model = model
-        self.timeout = timeout
-
-    def reachable(self):
-        """(ok, detail). Checks the server answers and has the model."""
-        tags = self.url.replace('/api/chat', '/api/tags')
-        try:
-            response = requests.get(tags, timeout=10)
-            response.raise_for_status()
-        except requests.RequestException as exc:
-            return False, str(exc)
-
-        names = [m.get('name', '') for m in response.json().get('models', [])]
-        if not any(n == self.model or n.startswith(self.model + ':')
-                   for n in names):
-            return False, (f"{self.model} not pulled; available: "
-                           f"{', '.join(names) or 'none'}")
-        return True, f"{self.model} available"
-
-    def ask(self, system, state, history, retries=2):
-        messages = [{"role": "system", "content": system}]
-        messages += history
-        messages.append({"role": "user", "content": json.dumps(state)})
-
-        last_error = None
-        for attempt in range(retries + 1):
-            response = requests.post(self.url, json={
-                "model": self.model,
-                "messages": messages,
-                "stream": False,
-                # Constrains sampling to valid JSON. Without it the model
-                # occasionally emits a literal newline inside a string and
-                # the parse fails, which loses the turn.
-                "format": "json",
-                # A retry at a lower temperature is a genuine second try
-                # rather than the same dice roll again.
-                "options": {"temperature": 0.8 if attempt == 0 else 0.3},
-            }, timeout=self.timeout)
-            response.raise_for_status()
-
-            text = response.json()["message"]["content"]
-            cleaned = text.replace("```json", "").replace("```", "").strip()
-            try:
-                return json.loads(cleaned)
-            except json.JSONDecodeError as exc:
-                last_error = exc
-                try:
-                    return json.loads(cleaned, strict=False)
-                except json.JSONDecodeError:
-                    pass
-
-        raise ValueError(f"unparseable after {retries + 1} attempts: "
-                         f"{last_error}\nraw: {cleaned[:400]}")
-
-
-class TurnLog:
-    """Append-only JSONL of every turn, sham or not.
-
-    Replay and dry runs write to a `replay/` subdirectory rather than
-    alongside the real record. Synthetic turns look exactly like live ones
-    once they are in a file -- same shape, same fields, plausible numbers --
-    and anything later reading data/logs to ask what the organism did must not
-    have to guess which rows were about an organism at all.
-    """
-
-    def __init__(self, directory, replay=False, prefix='turns'):
-        if replay:
-            directory = os.path.join(directory, 'replay')
-        os.makedirs(directory, exist_ok=True)
-        self.directory = directory
-        self.prefix = prefix
-
-    def append(self, record):
-        day = datetime.now(timezone.utc).strftime('%Y%m%d')
-        path = os.path.join(self.directory, f'{self.prefix}_{day}.jsonl')
-        with open(path, 'a', encoding='utf-8') as handle:
-            handle.write(json.dumps(record) + '\n')
-        return path
-
-
 def validate_action(reply, zones, barrier_zone, max_duration):
     """Pull a usable light action out of the reply, or None.
 
@@ -313,7 +249,8 @@ def open_matrix(dry_run):
     try:
         from matrix_client import open_matrix as _open
 
-        return _open()
+        # One session for the run rather than a connection per zone switch.
+        return _open(persistent=True)
     except Exception as exc:
         return None, str(exc)
 
@@ -393,8 +330,9 @@ def apply_action(matrix, action, speed=1.0, min_duration=0.0,
         matrix.clear_stimulus()
         return
 
-    matrix.clear_stimulus()
-    matrix.set_zone(action["zone"], intensity)
+    # The whole frame in one write: the new zone lit and any other put out
+    # together, one edge where clear_stimulus then set_zone made two.
+    matrix.set_frame({action["zone"]: intensity})
     _switch('on')
 
     # In a demo the zone stays lit until the model chooses the next one, so the
@@ -453,7 +391,9 @@ def main():
     parser.add_argument('--turns', type=int, default=0, help='0 runs forever')
     parser.add_argument('--interval', type=int,
                         default=getattr(config, 'LLM_TURN_INTERVAL', 600))
-    parser.add_argument('--host', default=getattr(config, 'OLLAMA_HOST', ''))
+    parser.add_argument('--host', action='append', default=None,
+                        help='an Ollama server; repeat for several. Default '
+                             'OLLAMA_ENDPOINTS, else OLLAMA_HOST')
     parser.add_argument('--model', default=getattr(config, 'OLLAMA_MODEL', ''))
     parser.add_argument('--replay', metavar='SOURCE',
                         help="'synthetic', or a path to a recorded "
@@ -462,6 +402,9 @@ def main():
                         help='time compression in replay, e.g. 600 runs a '
                              '10 min turn interval in 1 s')
     parser.add_argument('--sham-rate', type=float, default=None)
+    parser.add_argument('--no-stream', dest='stream', action='store_false',
+                        default=getattr(config, 'LLM_STREAM', True),
+                        help='wait for the whole reply before acting')
     parser.add_argument('--demo', action='store_true',
                         help='synthetic data at speed, DRIVING the panel. For '
                              'exercising the hardware; refuses if the chamber '
@@ -552,7 +495,21 @@ def main():
         return 1
     system = prompts[args.prompt]
 
-    ollama = Ollama(args.host, args.model)
+    # Every endpoint that can serve a turn. Each turn goes to the least loaded
+    # one that is answering, and moves to the next within the same deadline if
+    # that one fails -- so a laptop going to sleep costs a failover rather than
+    # every turn until someone wakes it.
+    endpoints = (args.host or getattr(config, 'OLLAMA_ENDPOINTS', None)
+                 or [getattr(config, 'OLLAMA_HOST', '')])
+    ollama = OllamaPool(
+        endpoints, args.model,
+        interval=getattr(config, 'OLLAMA_HEALTH_INTERVAL', 30),
+        timeout=getattr(config, 'OLLAMA_TIMEOUT', 300),
+        connect_timeout=getattr(config, 'OLLAMA_CONNECT_TIMEOUT', 5.0),
+        read_timeout=getattr(config, 'OLLAMA_READ_TIMEOUT', 300),
+        pool_size=getattr(config, 'OLLAMA_POOL_SIZE', 4),
+        transport_retries=getattr(config, 'OLLAMA_TRANSPORT_RETRIES', 3),
+        keep_alive=getattr(config, 'OLLAMA_KEEP_ALIVE', 3600))
     turns_log = TurnLog(config.LOG_DIR, replay=bool(args.replay) or args.dry_run)
 
     # When the light actually moved, which the turn record cannot say: it is
@@ -594,9 +551,10 @@ def main():
     else:
         source = LiveSource(config, window_s, channels)
 
-    print(f"model    {args.model} at {args.host}")
-    ok, detail = ollama.reachable()
-    print(f"ollama   {'OK' if ok else 'UNREACHABLE'}: {detail}")
+    ok, _ = ollama.reachable()
+    for endpoint in ollama.endpoints:
+        print(f"model    {endpoint.name}  "
+              f"{'OK' if endpoint.healthy else 'UNREACHABLE'}: {endpoint.detail}")
     print(f"source   {source.describe()}")
     print(f"prompt   {args.prompt}")
     print(f"sham     {sham_rate:.0%} of turns")
@@ -615,6 +573,7 @@ def main():
     if not ok:
         print("\nrefusing to start with the model unreachable")
         return 1
+    ollama.start()
 
     matrix, matrix_error = open_matrix(args.dry_run)
     print(f"matrix   {'ready' if matrix else 'NOT DRIVEN (' + str(matrix_error) + ')'}")
@@ -624,7 +583,9 @@ def main():
               "--dry-run to say so deliberately.")
         return 1
 
-    history, previous, turn = [], None, 0
+    history = History(history_turns,
+                      keep_full=getattr(config, 'LLM_HISTORY_KEEP_FULL', 2))
+    previous, turn = None, 0
     print(f"\nrunning, a turn every {args.interval}s. ctrl-c to stop.\n")
 
     try:
@@ -642,7 +603,10 @@ def main():
                 time.sleep(min(args.interval, 60))
                 continue
 
-            state = reduce_window(series, previous)
+            if hasattr(source, 'reduce'):
+                state = source.reduce(turn, previous)
+            else:
+                state = reduce_window(series, previous)
             previous = state
 
             record = {
@@ -658,47 +622,85 @@ def main():
                 # can be checked against whether one happened.
                 record["events_planted"] = source.planted_at(turn)
 
+            # Decided before the model is asked, and never revealed to it. With
+            # streaming the action can be applied before the reply is over, so
+            # the draw has to be in hand first; the model's output cannot
+            # depend on it either way, so a sham turn still costs exactly what
+            # a real one does.
+            is_sham = random.random() < sham_rate
+            record["sham"] = is_sham
+            record["applied"] = False
+            asked = time.monotonic()
+            acted = {}
+
+            def act(reply):
+                """Validate the light action and apply it, once per turn.
+
+                Called from inside the stream the moment the "light" field is
+                complete, while the note is still generating; or after the whole
+                reply, if it never streamed one.
+                """
+                if acted:
+                    return
+                action, refusal = validate_action(
+                    reply, leds.ZONES, leds.BARRIER_ZONE,
+                    getattr(config, 'MAX_STIMULUS_DURATION', 300))
+                acted["action"] = action
+                record["action_refused"] = refusal
+
+                if action and not is_sham and not args.dry_run:
+                    try:
+                        apply_action(matrix, action, speed=args.speed,
+                                     min_duration=min_stimulus_s,
+                                     hold_until_next=args.demo,
+                                     full_intensity=args.demo,
+                                     on_switch=switch_recorder(turn))
+                        record["applied"] = True
+                    except Exception as exc:
+                        record["apply_error"] = str(exc)
+                        print(f"[turn {turn}] apply failed: {exc}")
+                record["time_to_action_s"] = round(time.monotonic() - asked, 3)
+
+            def field(key, value):
+                if key == 'light':
+                    act({"light": value})
+
+            # Laid out so the server can reuse what it encoded last turn; see
+            # llm/filters/history.py. Whether it did is in model_stats.
+            past, record["history"] = history.messages(warm=ollama.warm())
+
             try:
-                reply = ollama.ask(system, state, history[-history_turns * 2:])
+                if args.stream:
+                    reply = ollama.ask_streaming(system, state, past, field)
+                else:
+                    reply = ollama.ask(system, state, past)
             except Exception as exc:
                 print(f"[turn {turn}] model failed: {exc}")
                 record["error"] = str(exc)
+                record["endpoint"] = ollama.last_endpoint
+                record["model_stats"] = ollama.last_stats
+                # A stream can fail after its light action went out. The
+                # record says so rather than implying the turn did nothing.
+                record["action"] = acted.get("action")
                 turns_log.append(record)
                 turn += 1
                 time.sleep(max(0, args.interval / args.speed - (time.monotonic() - started)))
                 continue
 
+            record["time_to_complete_s"] = round(time.monotonic() - asked, 3)
+            # The server's own accounting. prompt_eval_count is the tokens it
+            # actually had to encode: on a warm turn, the new state and not
+            # much else.
+            record["endpoint"] = ollama.last_endpoint
+            record["model_stats"] = ollama.last_stats
             record["reply"] = reply
-
-            action, refusal = validate_action(
-                reply, leds.ZONES, leds.BARRIER_ZONE,
-                getattr(config, 'MAX_STIMULUS_DURATION', 300))
-            record["action_refused"] = refusal
-
-            # Decided before the action is applied, and never revealed to the
-            # model. The reply is already in hand either way, so a sham turn
-            # costs exactly what a real one does.
-            is_sham = random.random() < sham_rate
-            record["sham"] = is_sham
-            record["applied"] = False
-
-            if action and not is_sham and not args.dry_run:
-                try:
-                    apply_action(matrix, action, speed=args.speed,
-                                 min_duration=min_stimulus_s,
-                                 hold_until_next=args.demo,
-                                 full_intensity=args.demo,
-                                 on_switch=switch_recorder(turn))
-                    record["applied"] = True
-                except Exception as exc:
-                    record["apply_error"] = str(exc)
-                    print(f"[turn {turn}] apply failed: {exc}")
+            act(reply)
+            action = acted["action"]
 
             record["action"] = action
             path = turns_log.append(record)
 
-            history.append({"role": "user", "content": json.dumps(state)})
-            history.append({"role": "assistant", "content": json.dumps(reply)})
+            history.append(state, reply, text=ollama.last_text)
 
             stamp = datetime.now().strftime('%H:%M:%S')
             mark = "SHAM" if is_sham else ("applied" if record["applied"] else "--")
@@ -722,6 +724,7 @@ def main():
         cancel_stimulus_timer()
         if matrix is not None:
             matrix.clear_stimulus()
+        ollama.close()
         print(f"turns logged under {turns_log.directory}")
 
     return 0